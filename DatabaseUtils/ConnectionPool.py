@@ -0,0 +1,349 @@
+import logging
+import threading
+import time
+from collections import deque, OrderedDict
+
+
+class ConnectionPoolError(Exception):
+    pass
+
+
+class PooledConnection(object):
+    """
+    A connection checked out of a ConnectionPool
+
+    Everything is passed through to the real connection, except close(), which gives it back to the pool
+    Used as a context manager it commits (or rolls back on an exception) and then goes back to the pool
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._is_released = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type:
+                self._conn.rollback()
+            else:
+                self._conn.commit()
+        finally:
+            self.close()
+
+    @property
+    def raw_connection(self):
+        return self._conn
+
+    def get_statement_cursor(self, sql: str):
+        """
+        Cursor kept open for this statement on this connection. See ConnectionPool.get_statement_cursor()
+        Don't close it. Call discard_statement_cursor() if it's left with unread results or errors
+        """
+        return self._pool.get_statement_cursor(self._conn, sql)
+
+    def discard_statement_cursor(self, sql: str):
+        self._pool.discard_statement_cursor(self._conn, sql)
+
+    def close(self):
+        """
+        Return the connection to the pool
+        """
+        if self._is_released:
+            return
+
+        self._is_released = True
+        self._pool.release(self._conn)
+
+    def discard(self):
+        """
+        Close the real connection instead of returning it to the pool, e.g. after a network error
+        """
+        if self._is_released:
+            return
+
+        self._is_released = True
+        self._pool.release(self._conn, is_broken=True)
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of DB-API connections (e.g. pyodbc)
+
+    - Keeps at least min_size connections open and never more than max_size
+    - Idle connections above min_size are closed after idle_timeout seconds
+    - Each connection is checked with health_check_sql when it's checked out, and replaced if it fails
+    - get_conn() waits up to checkout_timeout seconds when max_size connections are already checked out
+    - Each connection keeps a cursor open for its statement_cache_size most recently used statements,
+      so running the same parameterized SQL again reuses the statement pyodbc already prepared
+    """
+
+    def __init__(self,
+                 connect,
+                 min_size: int = 0,
+                 max_size: int = 10,
+                 idle_timeout: float = 300,
+                 checkout_timeout: float = 30,
+                 health_check_sql: str = 'SELECT 1',
+                 statement_cache_size: int = 20,
+                 logger: logging.Logger = None):
+        """
+        :param connect: function with no arguments that opens a new connection
+        :type connect: callable
+        :param min_size: connections opened up front and always kept open
+        :type min_size: int
+        :param max_size: max number of open connections, idle or checked out
+        :type max_size: int
+        :param idle_timeout: seconds an idle connection is kept above min_size. None to keep forever
+        :type idle_timeout: float
+        :param checkout_timeout: seconds to wait for a connection when the pool is at max_size
+        :type checkout_timeout: float
+        :param health_check_sql: query run on checkout. None to skip the health check
+        :type health_check_sql: str
+        :param statement_cache_size: prepared statements (cursors) kept per connection. 0 to disable
+        :type statement_cache_size: int
+        """
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        if min_size < 0 or min_size > max_size:
+            raise ValueError('min_size must be between 0 and max_size')
+
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_sql = health_check_sql
+        self.statement_cache_size = statement_cache_size if statement_cache_size and statement_cache_size > 0 else 0
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self._condition = threading.Condition()
+        # (connection, time it was returned), most recently returned on the right
+        self._idle = deque()
+        self._size = 0
+        self._is_closed = False
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'discarded': 0,
+            'expired': 0,
+            'health_check_failures': 0,
+            'waits': 0,
+            'statement_cache_hits': 0,
+            'statement_cache_misses': 0,
+        }
+        # id(connection) -> OrderedDict of sql -> open cursor, least recently used first
+        # Only the thread that has the connection checked out touches its entry
+        self._statement_cursors = {}
+
+        for _ in range(min_size):
+            self._idle.append((self.__open(), time.monotonic()))
+            self._size += 1
+
+    def __count(self, name: str):
+        with self._condition:
+            self._stats[name] += 1
+
+    def __open(self):
+        conn = self._connect()
+        self.__count('created')
+        return conn
+
+    def __close_quietly(self, conn):
+        self._statement_cursors.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def __close_cursor_quietly(cur):
+        try:
+            cur.close()
+        except Exception:
+            pass
+
+    def get_statement_cursor(self, conn, sql: str):
+        """
+        Cursor for sql on a checked out connection, opened the first time the statement runs on it
+        pyodbc only prepares a statement again when a cursor runs different SQL, so reusing the cursor
+        skips the prepare for repeated parameterized queries
+
+        :param conn: real connection (not the PooledConnection)
+        :type conn:
+        :param sql: statement the cursor will run
+        :type sql: str
+        :return:
+        :rtype:
+        """
+        if not self.statement_cache_size:
+            return conn.cursor()
+
+        cursors = self._statement_cursors.setdefault(id(conn), OrderedDict())
+
+        cur = cursors.get(sql)
+        if cur is not None:
+            cursors.move_to_end(sql)
+            self.__count('statement_cache_hits')
+            return cur
+
+        self.__count('statement_cache_misses')
+        cur = conn.cursor()
+        cursors[sql] = cur
+
+        while len(cursors) > self.statement_cache_size:
+            _, old = cursors.popitem(last=False)
+            ConnectionPool.__close_cursor_quietly(old)
+
+        return cur
+
+    def discard_statement_cursor(self, conn, sql: str):
+        cursors = self._statement_cursors.get(id(conn))
+        cur = cursors.pop(sql, None) if cursors else None
+        if cur is not None:
+            ConnectionPool.__close_cursor_quietly(cur)
+
+    def __is_healthy(self, conn):
+        if not self.health_check_sql:
+            return True
+
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute(self.health_check_sql)
+                cur.fetchall()
+            finally:
+                cur.close()
+            return True
+        except Exception as e:
+            self.logger.warning('Pooled connection failed health check: {}'.format(e))
+            return False
+
+    def __pop_expired(self):
+        """
+        Remove idle connections past idle_timeout, never going below min_size
+        Must hold the lock. Returns the connections so they can be closed outside the lock
+        """
+        expired = []
+        if self.idle_timeout is None:
+            return expired
+
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            expired.append(self._idle.popleft()[0])
+            self._size -= 1
+            self._stats['expired'] += 1
+
+        return expired
+
+    def get_conn(self):
+        """
+        Check out a connection. Call close() on it (or use it in a with block) to give it back
+
+        :return:
+        :rtype: PooledConnection
+        """
+        deadline = time.monotonic() + self.checkout_timeout if self.checkout_timeout is not None else None
+
+        while True:
+            conn = None
+            expired = []
+            with self._condition:
+                while True:
+                    if self._is_closed:
+                        raise ConnectionPoolError('Connection pool is closed')
+
+                    expired += self.__pop_expired()
+
+                    if self._idle:
+                        conn = self._idle.pop()[0]
+                        break
+
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        raise ConnectionPoolError('Timed out waiting for a connection. {}'.format(self.get_stats()))
+
+                    self._stats['waits'] += 1
+                    self._condition.wait(remaining)
+
+            for c in expired:
+                self.__close_quietly(c)
+
+            if conn is None:
+                try:
+                    conn = self.__open()
+                except Exception:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+                return PooledConnection(self, conn)
+
+            if self.__is_healthy(conn):
+                self.__count('reused')
+                return PooledConnection(self, conn)
+
+            # Drop the bad connection and try again
+            self.__count('health_check_failures')
+            self.release(conn, is_broken=True)
+
+    def release(self, conn, is_broken: bool = False):
+        """
+        Give a connection back to the pool
+        Any open transaction is rolled back. Broken connections are closed instead of being reused
+        """
+        if not is_broken:
+            try:
+                conn.rollback()
+            except Exception:
+                is_broken = True
+
+        with self._condition:
+            if is_broken or self._is_closed:
+                self._size -= 1
+                self._stats['discarded'] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+            self._condition.notify()
+
+        if conn is not None:
+            self.__close_quietly(conn)
+
+    def close(self):
+        """
+        Close all idle connections. Connections still checked out are closed when they're returned
+        """
+        with self._condition:
+            self._is_closed = True
+            idle = [c for c, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._condition.notify_all()
+
+        for conn in idle:
+            self.__close_quietly(conn)
+
+    def get_stats(self):
+        """
+        :return: counts of open, idle and checked out connections, plus lifetime counters
+        :rtype: dict
+        """
+        with self._condition:
+            stats = dict(self._stats)
+            stats['size'] = self._size
+            stats['idle'] = len(self._idle)
+            stats['checked_out'] = self._size - len(self._idle)
+            stats['min_size'] = self.min_size
+            stats['max_size'] = self.max_size
+
+        return stats
@@ -1,13 +1,24 @@
 import logging
 import subprocess
+import threading
+import time
+from collections import namedtuple, OrderedDict
 from enum import Enum
+from functools import lru_cache
 
 import pyodbc
 
+from DatabaseUtils.ConnectionPool import ConnectionPool
 from DatabaseUtils.DatabaseType import DatabaseType
+from DatabaseUtils.SchemaCatalog import SchemaCatalog
+from DatabaseUtils.SchemaDiff import SchemaDiff
+from DatabaseUtils.MssqlUtils.MssqlScripterShards import MssqlScripterShards
+from DatabaseUtils.MssqlUtils.SqlBatches import SqlBatches, SqlBatchError
+from DatabaseUtils.MssqlUtils.NativeScripter import MssqlCatalogSnapshot, NativeScripter
 
 import codecs
 import os
+import re
 
 import json
 
@@ -63,6 +74,138 @@ class Database(object):
     _schema_dir = os.path.join(_base_path, '00000_schema')
     _objects_dir = os.path.join(_base_path, '00000_objects')
 
+    # Statement text is built once; values are always passed as parameters
+    _objects_sql = """SELECT 
+                    obj.object_id
+                    ,obj.type
+                    ,FullName = CONCAT(s.Name, '.', obj.name)
+                    ,FullNameQuoted = CONCAT(QUOTENAME(s.Name), '.', QUOTENAME(obj.name))
+                    ,LastChangeDate = ISNULL(obj.modify_date, obj.create_date)
+                FROM sys.objects obj
+                JOIN sys.schemas s ON obj.schema_id = s.schema_id
+                """
+    # TODO: Don't convert to date and make it so it pulls datetime to compare
+    _objects_from_date_sql = _objects_sql + 'WHERE ISNULL(obj.modify_date, obj.create_date) >= TRY_CONVERT(date, ?)'
+    _objects_changed_since_sql = _objects_sql + 'WHERE ISNULL(obj.modify_date, obj.create_date) >= ?'
+    _object_ids_sql = 'SELECT object_id FROM sys.objects'
+    # User objects that are scripted on their own (not constraints, triggers, etc. that belong to a table)
+    _object_states_sql = """SELECT
+                    o.object_id
+                    ,o.type
+                    ,FullName = CONCAT(s.name, '.', o.name)
+                    ,FullNameQuoted = CONCAT(QUOTENAME(s.name), '.', QUOTENAME(o.name))
+                    ,o.modify_date
+                FROM sys.objects o
+                JOIN sys.schemas s ON o.schema_id = s.schema_id
+                WHERE 
+                    o.is_ms_shipped = 0
+                    AND o.parent_object_id = 0
+        """
+    # SHA2_256 of the definitions of some modules. {0} is the IN list of object ids
+    _definition_hashes_sql = """SELECT
+                    object_id
+                    ,DefinitionHash = CONVERT(varchar(64), HASHBYTES('SHA2_256', definition), 2)
+                FROM sys.sql_modules
+                WHERE object_id IN {0}
+        """
+    # What each user object references: modules from sys.sql_expression_dependencies, tables from foreign keys
+    # Names are schema.name. Unresolved references are named as written, in the referencing object's schema if
+    # none was given. References to other databases are left out
+    _object_dependencies_sql = """SELECT DISTINCT
+                    ReferencingName = CONCAT(s.name, '.', o.name)
+                    ,ReferencedName = CONCAT(COALESCE(rs.name, d.referenced_schema_name, s.name), '.',
+                                             COALESCE(ro.name, d.referenced_entity_name))
+                FROM sys.sql_expression_dependencies d
+                JOIN sys.objects o ON d.referencing_id = o.object_id
+                JOIN sys.schemas s ON o.schema_id = s.schema_id
+                LEFT JOIN sys.objects ro ON d.referenced_id = ro.object_id
+                LEFT JOIN sys.schemas rs ON ro.schema_id = rs.schema_id
+                WHERE 
+                    d.referencing_class = 1
+                    AND d.referenced_class = 1
+                    AND d.referenced_server_name IS NULL
+                    AND d.referenced_database_name IS NULL
+                    AND o.is_ms_shipped = 0
+                UNION
+                SELECT
+                    ReferencingName = CONCAT(s.name, '.', o.name)
+                    ,ReferencedName = CONCAT(rs.name, '.', ro.name)
+                FROM sys.foreign_keys fk
+                JOIN sys.objects o ON fk.parent_object_id = o.object_id
+                JOIN sys.schemas s ON o.schema_id = s.schema_id
+                JOIN sys.objects ro ON fk.referenced_object_id = ro.object_id
+                JOIN sys.schemas rs ON ro.schema_id = rs.schema_id
+                WHERE 
+                    fk.parent_object_id <> fk.referenced_object_id
+        """
+    # Functions, views and procedures, without their definitions. See SchemaDiff
+    _module_states_sql = """SELECT
+                    o.object_id
+                    ,o.type
+                    ,FullName = CONCAT(s.name, '.', o.name)
+                    ,o.modify_date
+                FROM sys.objects o
+                JOIN sys.schemas s ON o.schema_id = s.schema_id
+                WHERE 
+                    o.type IN ('FN', 'IF', 'TF', 'V', 'P')
+                    AND o.is_ms_shipped = 0
+        """
+    # {0} is the IN list of object ids
+    _module_definitions_sql = """SELECT object_id, definition FROM sys.sql_modules WHERE object_id IN {0}"""
+    # Parameters per statement. SQL Server's limit is 2100
+    _max_query_params = 2000
+
+    # Columns of many objects at once. {0} is the IN list of object ids, used twice
+    # Tables come from sys.columns, everything else from the first result set it returns
+    _columns_for_objects_sql = """SELECT
+                    o.object_id
+                    ,o.modify_date
+                    ,c.column_id AS column_ordinal
+                    ,c.name
+                    ,system_type_name = CASE
+                        WHEN t.name IN ('varchar', 'char', 'varbinary', 'binary')
+                            THEN CONCAT(t.name, '(', IIF(c.max_length = -1, 'max', CAST(c.max_length AS varchar(10))), ')')
+                        WHEN t.name IN ('nvarchar', 'nchar')
+                            THEN CONCAT(t.name, '(', IIF(c.max_length = -1, 'max', CAST(c.max_length / 2 AS varchar(10))), ')')
+                        WHEN t.name IN ('decimal', 'numeric')
+                            THEN CONCAT(t.name, '(', c.precision, ',', c.scale, ')')
+                        WHEN t.name IN ('datetime2', 'time', 'datetimeoffset')
+                            THEN CONCAT(t.name, '(', c.scale, ')')
+                        ELSE t.name
+                    END
+                    ,c.is_nullable
+                FROM sys.objects o
+                JOIN sys.columns c ON o.object_id = c.object_id
+                JOIN sys.types t ON c.user_type_id = t.user_type_id
+                WHERE 
+                    o.type = 'U'
+                    AND o.object_id IN {0}
+                UNION ALL
+                SELECT
+                    o.object_id
+                    ,o.modify_date
+                    ,d.column_ordinal
+                    ,d.name
+                    ,d.system_type_name
+                    ,d.is_nullable
+                FROM sys.objects o
+                CROSS APPLY sys.dm_exec_describe_first_result_set_for_object(o.object_id, 0) d
+                WHERE 
+                    o.type <> 'U'
+                    AND o.object_id IN {0}
+                    AND d.name IS NOT NULL
+                ORDER BY 
+                    object_id
+                    ,column_ordinal
+        """
+    _modify_dates_sql = """SELECT object_id, modify_date FROM sys.objects WHERE object_id IN {0}"""
+    _object_metadata_sql = """SELECT name
+                    ,system_type_name
+                    ,is_nullable 
+                FROM sys.dm_exec_describe_first_result_set_for_object(?, 0) t
+                ORDER BY 
+                    column_ordinal
+        """
 
     def __init__(self,
                  database_type: DatabaseType,
@@ -73,7 +216,18 @@ class Database(object):
                  port: int,
                  local_path: str,
                  logger: logging.Logger = None,
+                 pool_min_size: int = 0,
+                 pool_max_size: int = 10,
+                 pool_idle_timeout: float = 300,
                  ):
+        """
+        :param pool_min_size: connections kept open in the connection pool
+        :type pool_min_size: int
+        :param pool_max_size: max connections open at once. Callers wait for one to be returned after that
+        :type pool_max_size: int
+        :param pool_idle_timeout: seconds before an idle connection above pool_min_size is closed
+        :type pool_idle_timeout: float
+        """
         self._database_type = database_type
 
         if logger:
@@ -92,6 +246,15 @@ class Database(object):
         self._database_type = database_type
         self._local_path = local_path
 
+        self._pool_min_size = pool_min_size
+        self._pool_max_size = pool_max_size
+        self._pool_idle_timeout = pool_idle_timeout
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+        # object_id -> (modify_date, time loaded, [Column]). See get_columns_for_objects()
+        self._column_cache = {}
+
 
     @property
     def server(self):
@@ -148,19 +311,189 @@ class Database(object):
 
         raise NotImplementedError
 
-    def _get_conn(self):
+    def _connect(self):
+        """
+        Open a new connection. Only called by the connection pool
+        """
         return pyodbc.connect(self._get_connection_string())
 
-    def get_rows_from_sql(self, sql: str):
+    def get_pool(self):
+        """
+        Connection pool for this database, created on first use
+
+        :return:
+        :rtype: ConnectionPool
+        """
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ConnectionPool(connect=self._connect,
+                                                min_size=self._pool_min_size,
+                                                max_size=self._pool_max_size,
+                                                idle_timeout=self._pool_idle_timeout,
+                                                logger=self.logger)
+        return self._pool
+
+    def get_pool_stats(self):
+        return self.get_pool().get_stats()
+
+    def close_pool(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+
+    def _get_conn(self):
+        """
+        Check out a connection from the pool. close() gives it back to the pool
+        """
+        return self.get_pool().get_conn()
+
+    @staticmethod
+    def get_params(params):
+        """
+        Parameter values as a tuple. A single value is wrapped, None stays None
+        """
+        if params is None:
+            return None
+        if isinstance(params, (list, tuple)):
+            return tuple(params)
+        if isinstance(params, dict):
+            return params
+        return (params,)
+
+    def _execute(self, conn, sql: str, params=None):
+        """
+        Run sql on the connection's cached cursor for the statement, so a repeated statement isn't prepared again
+
+        :param conn: pooled connection
+        :type conn: PooledConnection
+        :param sql: statement with ? placeholders
+        :type sql: str
+        :param params: values for the placeholders
+        :type params:
+        :return: cursor. Read all the results or call conn.discard_statement_cursor(sql)
+        :rtype:
+        """
+        params = Database.get_params(params)
+        cur = conn.get_statement_cursor(sql)
+        try:
+            if params:
+                cur.execute(sql, params)
+            else:
+                cur.execute(sql)
+        except Exception:
+            conn.discard_statement_cursor(sql)
+            raise
+
+        return cur
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def get_in_placeholders(count: int):
+        """
+        (?, ?, ?) for an IN list of count values
+        """
+        return '({})'.format(', '.join(['?'] * count))
+
+    def iter_rows(self,
+                  sql: str,
+                  params=None,
+                  batch_size: int = 1000,
+                  as_dict: bool = False,
+                  as_namedtuple: bool = False):
+        """
+        Stream the results of a query, fetching batch_size rows at a time with fetchmany()
+        The connection is held until the generator is exhausted or closed, then goes back to the pool
+
+        :param sql: query
+        :type sql: str
+        :param params: parameter values for ? placeholders in the query
+        :type params: tuple
+        :param batch_size: rows fetched from the server at a time
+        :type batch_size: int
+        :param as_dict: yield each row as a dict of column name to value
+        :type as_dict: bool
+        :param as_namedtuple: yield each row as a namedtuple
+        :type as_namedtuple: bool
+        :return:
+        :rtype: generator
+        """
         if not sql:
             return
 
-        with self._get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(sql)
-                row = [row for row in cur]
+        if not batch_size or batch_size < 1:
+            batch_size = 1000
+
+        conn = self._get_conn()
+        is_exhausted = False
+        try:
+            cur = self._execute(conn, sql, params)
+
+            if cur.description is None:
+                is_exhausted = True
+                return
+
+            columns = [col[0] for col in cur.description]
+            row_type = namedtuple('Row', columns, rename=True) if as_namedtuple else None
+
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+
+                for row in rows:
+                    if as_dict:
+                        yield dict(zip(columns, row))
+                    elif row_type:
+                        yield row_type(*row)
+                    else:
+                        yield row
+
+            is_exhausted = True
+        finally:
+            # A cursor closed early still has unread results, so it can't be reused
+            if not is_exhausted:
+                conn.discard_statement_cursor(sql)
+            conn.close()
+
+    def get_rows_from_sql(self, sql: str, params=None, as_dict: bool = False):
+        if not sql:
+            return
 
-        return row
+        return list(self.iter_rows(sql, params=params, as_dict=as_dict))
+
+    def get_result_sets(self, queries, as_dict: bool = True):
+        """
+        Run several queries one after another on the same pooled connection
+
+        :param queries: name -> (sql, params)
+        :type queries: OrderedDict
+        :param as_dict: return each row as a dict of column name to value
+        :type as_dict: bool
+        :return: name -> list of rows
+        :rtype: OrderedDict
+        """
+        results = OrderedDict()
+        if not queries:
+            return results
+
+        conn = self._get_conn()
+        try:
+            for name, (sql, params) in queries.items():
+                cur = self._execute(conn, sql, params)
+                try:
+                    columns = [col[0] for col in cur.description] if cur.description else []
+                    rows = cur.fetchall() if cur.description else []
+                except Exception:
+                    conn.discard_statement_cursor(sql)
+                    raise
+
+                results[name] = [dict(zip(columns, row)) for row in rows] if as_dict else rows
+        finally:
+            conn.close()
+
+        return results
 
     def get_objects(self,
                     from_date: str = None,
@@ -170,22 +503,91 @@ class Database(object):
         :param from_date:
         :return:
         """
-
-        from_sql = ''
-        # TODO: Don't convert to date and make it so it pulls datetime to compare
         if from_date:
-            from_sql = 'WHERE ISNULL(obj.modify_date, obj.create_date) >= TRY_CONVERT(date, \'{}\')'.format(from_date)
-        sql = """SELECT 
-                    obj.object_id
-                    ,obj.type
-                    ,FullName = CONCAT(s.Name, '.', obj.name)
-                    ,FullNameQuoted = CONCAT(QUOTENAME(s.Name), '.', QUOTENAME(obj.name))
-                    ,LastChangeDate = ISNULL(obj.modify_date, obj.create_date)
-                FROM sys.objects obj
-                JOIN sys.schemas s ON obj.schema_id = s.schema_id
-                {}""".format(from_sql)
+            return self.get_rows_from_sql(self._objects_from_date_sql, params=(str(from_date),), as_dict=as_dict)
+
+        return self.get_rows_from_sql(self._objects_sql, as_dict=as_dict)
+
+    def get_objects_changed_since(self, since, as_dict: bool = False):
+        """
+        Same as get_objects(), but compares the full datetime instead of the date
+
+        :param since: datetime of the last check
+        :type since: datetime
+        """
+        return self.get_rows_from_sql(self._objects_changed_since_sql, params=(since,), as_dict=as_dict)
+
+    def get_object_states(self, as_dict: bool = False):
+        """
+        modify_date of every user object. Definitions are hashed separately, see get_definition_hashes()
+
+        :return: rows of (object_id, type, FullName, FullNameQuoted, modify_date)
+        :rtype: []
+        """
+        return self.get_rows_from_sql(self._object_states_sql, as_dict=as_dict)
+
+    def get_definition_hashes(self, object_ids: []):
+        """
+        SHA2_256 of the definitions of the objects (hashed by SQL Server), _max_query_params objects per query
+        Objects without a definition (tables) aren't returned
+
+        :return: object_id -> hash (lowercase hex)
+        :rtype: dict
+        """
+        object_ids = list(dict.fromkeys([int(x) for x in object_ids or []]))
+        hashes = {}
+
+        for i in range(0, len(object_ids), self._max_query_params):
+            chunk = object_ids[i:i + self._max_query_params]
+            sql = self._definition_hashes_sql.format(Database.get_in_placeholders(len(chunk)))
+
+            for row in self.iter_rows(sql, params=chunk):
+                if row[1] is not None:
+                    hashes[int(row[0])] = str(row[1]).lower()
+
+        return hashes
+
+    def get_object_dependencies(self):
+        """
+        What each user object references. See DeploymentPlanner
+
+        :return: rows of (ReferencingName, ReferencedName), as schema.name
+        :rtype: []
+        """
+        return self.get_rows_from_sql(self._object_dependencies_sql)
+
+    def get_module_states(self):
+        """
+        :return: rows of (object_id, type, FullName, modify_date) of every function, view and procedure
+        :rtype: []
+        """
+        return self.get_rows_from_sql(self._module_states_sql)
+
+    def get_module_definitions(self, object_ids: []):
+        """
+        Definitions of the objects, _max_query_params objects per query
+
+        :return: object_id -> definition
+        :rtype: dict
+        """
+        object_ids = list(dict.fromkeys([int(x) for x in object_ids or []]))
+        definitions = {}
+
+        for i in range(0, len(object_ids), self._max_query_params):
+            chunk = object_ids[i:i + self._max_query_params]
+            sql = self._module_definitions_sql.format(Database.get_in_placeholders(len(chunk)))
+
+            for row in self.iter_rows(sql, params=chunk):
+                definitions[int(row[0])] = row[1]
 
-        return self.get_rows_from_sql(sql, as_dict=as_dict)
+        return definitions
+
+    def get_object_ids(self):
+        """
+        :return: object_id of every object in sys.objects
+        :rtype: set
+        """
+        return set([int(row[0]) for row in self.iter_rows(self._object_ids_sql)])
 
     def get_object_metadata(self,
                             object_id: int,
@@ -193,32 +595,93 @@ class Database(object):
         if not object_id:
             return
 
-        sql = """SELECT name
-                    ,system_type_name
-                    ,is_nullable 
-                FROM sys.dm_exec_describe_first_result_set_for_object({}, 0) t
-                ORDER BY 
-                    column_ordinal
-        """.format(object_id)
-
-        return self.get_rows_from_sql(sql, as_dict)
+        return self.get_rows_from_sql(self._object_metadata_sql, params=(int(object_id),), as_dict=as_dict)
 
     def get_columns_from_object(self, object_id: int):
-        from DatabaseUtils.MssqlUtils.mssql_objects.MssqlObjects import Column
+        if not object_id:
+            return
 
-        metadata = self.get_object_metadata(object_id, as_dict=False)
+        cols = self.get_columns_for_objects([object_id]).get(int(object_id))
 
-        if not metadata:
+        if not cols:
             return
 
-        cols = []
+        return cols
 
-        for row in metadata:
-            cols.append(Column(name=row[0],
-                               sql=row[1],
-                               is_nullable=Database.get_bool_from_string(row[2])))
+    def get_columns_for_objects(self, object_ids, cache_ttl: float = None):
+        """
+        Columns of every object in object_ids, with one query per 1000 objects instead of one per object
+
+        :param object_ids: object_id of each table, view, function or procedure
+        :type object_ids: []
+        :param cache_ttl: seconds to keep the columns in memory. Cached columns are used until they expire
+            or the object's modify_date changes. None to always query
+        :type cache_ttl: float
+        :return: object_id -> [Column]. Objects that weren't found have an empty list
+        :rtype: dict
+        """
+        from DatabaseUtils.MssqlUtils.mssql_objects.MssqlObjects import Column
 
-        return cols
+        if not object_ids:
+            return {}
+
+        object_ids = list(dict.fromkeys([int(x) for x in object_ids]))
+        columns = {object_id: [] for object_id in object_ids}
+        to_fetch = object_ids
+
+        if cache_ttl is not None:
+            now = time.monotonic()
+            modify_dates = self.__get_modify_dates(object_ids)
+            to_fetch = []
+
+            for object_id in object_ids:
+                cached = self._column_cache.get(object_id)
+                if cached and cached[0] == modify_dates.get(object_id) and now - cached[1] <= cache_ttl:
+                    columns[object_id] = list(cached[2])
+                else:
+                    to_fetch.append(object_id)
+
+        # Each id is a parameter in both halves of the query
+        chunk_size = self._max_query_params // 2
+        loaded = {}
+
+        for i in range(0, len(to_fetch), chunk_size):
+            chunk = to_fetch[i:i + chunk_size]
+            sql = Database.__get_columns_for_objects_sql(len(chunk))
+
+            for row in self.iter_rows(sql, params=chunk + chunk):
+                object_id = int(row[0])
+                loaded[object_id] = row[1]
+                columns[object_id].append(Column(name=row[3],
+                                                 sql=row[4],
+                                                 is_nullable=Database.get_bool_from_string(row[5])))
+
+        if cache_ttl is not None:
+            now = time.monotonic()
+            for object_id, modify_date in loaded.items():
+                self._column_cache[object_id] = (modify_date, now, list(columns[object_id]))
+
+        return columns
+
+    def clear_column_cache(self):
+        self._column_cache = {}
+
+    def __get_modify_dates(self, object_ids: []):
+        modify_dates = {}
+
+        for i in range(0, len(object_ids), self._max_query_params):
+            chunk = object_ids[i:i + self._max_query_params]
+            sql = self._modify_dates_sql.format(Database.get_in_placeholders(len(chunk)))
+
+            for row in self.iter_rows(sql, params=chunk):
+                modify_dates[int(row[0])] = row[1]
+
+        return modify_dates
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def __get_columns_for_objects_sql(count: int):
+        return Database._columns_for_objects_sql.format(Database.get_in_placeholders(count))
 
     @staticmethod
     def get_sql_file_paths_from_dir(path: str):
@@ -313,16 +776,18 @@ class Database(object):
         for file in self.get_all_file_paths():
             return os.path.basename(file).replace('.sql', '')
 
-    def execute_scalar(self, sql: str):
-        cur = self._get_conn()
+    def execute_scalar(self, sql: str, params=None):
+        conn = self._get_conn()
         try:
-            cur.execute(sql)
-            cur.commit()
+            cur = self._execute(conn, sql, params)
+            if cur.description is not None:
+                conn.discard_statement_cursor(sql)
+            conn.commit()
         except Exception as e:
-            cur.rollback()
+            conn.rollback()
             raise e
         finally:
-            cur.close()
+            conn.close()
 
     def deploy_to_database(self):
         for sql in self.get_all_sql_as_list():
@@ -467,8 +932,19 @@ class MssqlDatabase(Database):
                  username: str,
                  password: str,
                  port: int=None,
-                 local_path: str=None
+                 local_path: str=None,
+                 pool_min_size: int = 0,
+                 pool_max_size: int = 10,
+                 pool_idle_timeout: float = 300,
+                 scripter_chunk_size: int = MssqlScripterShards.DEFAULT_CHUNK_SIZE,
+                 scripter_max_concurrency: int = 4
                  ):
+        """
+        :param scripter_chunk_size: most objects passed to one mssql-scripter run. See script_objects()
+        :type scripter_chunk_size: int
+        :param scripter_max_concurrency: mssql-scripter processes run at once when a list is split up
+        :type scripter_max_concurrency: int
+        """
         if not port or port == 0:
             port = 1433
 
@@ -478,7 +954,17 @@ class MssqlDatabase(Database):
                                             password=password,
                                             port=port,
                                             database_type=DatabaseType.MSSQL,
-                                            local_path=local_path)
+                                            local_path=local_path,
+                                            pool_min_size=pool_min_size,
+                                            pool_max_size=pool_max_size,
+                                            pool_idle_timeout=pool_idle_timeout)
+
+        self.scripter_chunk_size = scripter_chunk_size
+        self.scripter_max_concurrency = scripter_max_concurrency
+
+        # Per-run copy of sys.objects. See get_catalog()
+        self._catalog = None
+        self._catalog_lock = threading.Lock()
 
 
     def _get_connection_string(self):
@@ -513,77 +999,181 @@ class MssqlDatabase(Database):
         subprocess.check_output(args, shell=True)
 
     def get_conn(self):
-        return pyodbc.connect(self._get_connection_string())
+        return self._get_conn()
 
-    def execute_scalar(self, sql: str):
+    def execute_scalar(self, sql: str, params=None):
+        self.__execute_and_commit(sql, params)
+
+    def execute_many(self, sql: str, rows, batch_size: int = 1000):
+        """
+        Execute a parameterized statement once for every row in rows
+        Rows are sent batch_size at a time with pyodbc's fast_executemany and each batch is committed
+
+        :param sql: statement with ? placeholders
+        :type sql: str
+        :param rows: iterable of sequences of parameter values
+        :type rows:
+        :param batch_size: number of rows sent and committed at a time
+        :type batch_size: int
+        :return: number of rows executed
+        :rtype: int
+        """
+        import itertools
+
+        if not sql:
+            return 0
+
+        if not batch_size or batch_size < 1:
+            batch_size = 1000
+
+        count = 0
+        rows = iter(rows)
         conn = self.get_conn()
         cur = conn.cursor()
+        cur.fast_executemany = True
         try:
-            cur.execute(sql)
-            conn.commit()
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+
+                cur.executemany(sql, batch)
+                conn.commit()
+                count += len(batch)
         except Exception as e:
             conn.rollback()
             raise e
         finally:
+            cur.close()
             conn.close()
 
-    def get_one_result(self, sql: str):
+        return count
+
+    def get_one_result(self, sql: str, params=None):
         conn = self.get_conn()
-        cur = conn.cursor()
         try:
-            cur.execute(sql)
-            if cur:
-                return cur.fetchall()[0][0]
+            rows = self._execute(conn, sql, params).fetchall()
+            if rows:
+                return rows[0][0]
         except Exception as e:
             conn.rollback()
             raise e
         finally:
-            cur.close()
+            conn.close()
+
 
 
+    def get_query_results(self, sql: str, params=None):
+        """
+        Streams the rows of the query. See iter_rows()
+        """
+        return self.iter_rows(sql, params=params)
+
+    def execute_sql(self, sql: str, params=None):
+        print(sql)
+        self.__execute_and_commit(sql, params)
 
-    def get_query_results(self, sql: str):
+    def __execute_and_commit(self, sql: str, params=None):
         conn = self.get_conn()
-        cur = conn.cursor()
         try:
-            cur.execute(sql)
-            return cur
+            cur = self._execute(conn, sql, params)
+            # Don't keep a cursor with unread results
+            if cur.description is not None:
+                conn.discard_statement_cursor(sql)
+            conn.commit()
         except Exception as e:
             conn.rollback()
             raise e
         finally:
-            cur.close()
+            conn.close()
+
+    def execute_multiple_sql_statements(self, sql: []):
+        if not sql:
+            return
 
-    def execute_sql(self, sql: str):
-        print(sql)
         conn = self.get_conn()
         cur = conn.cursor()
         try:
-            cur.execute(sql)
+            for s in sql:
+                print(s)
+                cur.execute(s)
             conn.commit()
         except Exception as e:
             conn.rollback()
             raise e
         finally:
             cur.close()
+            conn.close()
 
-    def execute_multiple_sql_statements(self, sql: []):
-        from StringUtil import StringUtil
-        if not sql:
-            return
+    def execute_scripts(self, scripts: [], is_transaction: bool = True):
+        """
+        Run scripts in-process over one pooled connection, split into batches on GO like sqlcmd does
+        Stops at the first batch that fails and raises SqlBatchError
+
+        With is_transaction, everything runs in one transaction (with XACT_ABORT on) that is rolled back
+        if any batch fails, so nothing is left half-applied. Statements that can't run in a transaction
+        (e.g. CREATE/ALTER DATABASE) need is_transaction=False, where each batch is committed as it runs
+
+        :param scripts: file paths, or (name, sql) tuples
+        :type scripts: []
+        :param is_transaction: all or nothing
+        :type is_transaction: bool
+        :return: number of batches run
+        :rtype: int
+        """
+        if not scripts:
+            return 0
 
-        for s in sql:
-            print(s)
-            conn = self.get_conn()
-            cur = conn.cursor()
-            try:
-                cur.execute(s)
-            except Exception as e:
-                conn.rollback()
-                raise e
+        count = 0
+        conn = self.get_conn()
+        cur = conn.cursor()
+        try:
+            if is_transaction:
+                cur.execute('SET XACT_ABORT ON')
+
+            for script in scripts:
+                if isinstance(script, (tuple, list)):
+                    name, batches = script[0], SqlBatches.split(script[1])
+                else:
+                    name, batches = script, SqlBatches.read_file(script)
+
+                self.logger.info('Executing {} ({} batches)'.format(name, len(batches)))
 
-        conn.commit()
-        conn.close()
+                for batch in batches:
+                    try:
+                        for _ in range(batch.count):
+                            cur.execute(batch.sql)
+                            # Errors after the first statement of a batch only come up when reading past it
+                            while cur.nextset():
+                                pass
+                    except Exception as e:
+                        raise SqlBatchError(name, batch, e)
+
+                    if not is_transaction:
+                        conn.commit()
+                    count += 1
+
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            if is_transaction:
+                self.logger.error('Rolled back all {} scripts: {}'.format(len(scripts), e))
+            raise e
+        finally:
+            is_reset = True
+            if is_transaction:
+                # The connection goes back to the pool
+                try:
+                    cur.execute('SET XACT_ABORT OFF')
+                except Exception:
+                    is_reset = False
+            cur.close()
+            if is_reset:
+                conn.close()
+            else:
+                conn.discard()
+
+        return count
 
 
 
@@ -594,34 +1184,22 @@ class MssqlDatabase(Database):
         if type(objects) not in [tuple, list]:
             raise ValueError('Expecting a list of objects, but found type {}'.format(type(objects)))
 
-        sql = """
-            SELECT CONCAT(schema_name(schema_id), '.', name) as name
-            FROM sys.objects
-            WHERE
-                CONCAT(schema_name(schema_id), '.', name) IN (
-        """
-
-        for i, o in enumerate(objects):
-            if i > 0:
-                sql += ', '
+        return self.get_catalog().get_objects_not_found(objects)
 
-            sql += "'{}'".format(o)
-
-        sql += ')'
-
-        cur = self.get_query_results(sql)
-
-        objects_found = [x[0] for x in cur]
-        missing_objects = []
+    @staticmethod
+    def quote_name(name: str):
+        """
+        Same as QUOTENAME(): MyDb -> [MyDb], My]Db -> [My]]Db]
+        For names that can't be passed as parameters, like the database in a three-part name
+        """
+        if not name:
+            return
 
-        if len(objects_found) == len(objects):
-            return []
-        else:
-            for o in objects:
-                if str(o).strip().lower() not in objects_found:
-                    missing_objects.append(o)
+        name = str(name).strip()
+        if name.startswith('[') and name.endswith(']'):
+            name = name[1:-1].replace(']]', ']')
 
-        return missing_objects
+        return '[{}]'.format(name.replace(']', ']]'))
 
 
 
@@ -940,7 +1518,7 @@ class MssqlDatabase(Database):
 
         return current_list
 
-    def __do_mssqlscripter_action(self, args, is_include_default_options: bool = True):
+    def __do_mssqlscripter_action(self, args, is_include_default_options: bool = True, is_raise_errors: bool = False):
         from platform import system as platform_system
 
         """
@@ -951,6 +1529,8 @@ class MssqlDatabase(Database):
         :type args:
         :param is_include_default_options:
         :type is_include_default_options:
+        :param is_raise_errors: raise the error after logging it, instead of returning None
+        :type is_raise_errors: bool
         :return:
         :rtype:
         """
@@ -986,31 +1566,89 @@ class MssqlDatabase(Database):
 
         except Exception as e:
             self.logger .error('Unable to perform mssql-scripter action: {}\nargs: {}'.format(e, args))
+            if is_raise_errors:
+                raise e
+
+    @staticmethod
+    def get_use_database_pattern(database: str = None):
+        """
+        Regex (not compiled) for a line that is only a USE statement: USE [db] or USE db,
+        optionally followed by ; and a -- comment. Match it case-insensitively
+
+        :param database: only match USE of this database. None for any database
+        :type database: str
+        :rtype: str
+        """
+        if database:
+            name = r'(?:\[{0}\]|{0})'.format(re.escape(str(database).replace(']', ']]')))
+        else:
+            name = r'(?:\[(?:[^\]]|\]\])+\]|[^\s;\[\]]+)'
+
+        return r'^\s*use\s+{}\s*;?\s*(?:--.*)?$'.format(name)
+
+    @staticmethod
+    def get_unquoted_object_name(name: str):
+        """
+        [dbo].[MyProc] -> dbo.myproc
+        Same as the REPLACE() of brackets done in SQL, lowercased for comparing
+        """
+        if not name:
+            return
+
+        return str(name).replace('[', '').replace(']', '').strip().lower()
+
+    def get_catalog(self, snapshot_path: str = None, is_refresh: bool = False):
+        """
+        SchemaCatalog of sys.objects, loaded the first time and kept for the rest of the run
+
+        :param snapshot_path: SQLite file the catalog is loaded from on the first refresh, and saved to after
+            each refresh that changed it. See SchemaCatalog. Only used when the catalog is first created
+        :type snapshot_path: str
+        :param is_refresh: pull objects changed since the catalog was loaded or last refreshed
+        :type is_refresh: bool
+        :return:
+        :rtype: SchemaCatalog
+        """
+        with self._catalog_lock:
+            if self._catalog is None:
+                self._catalog = SchemaCatalog(self, snapshot_path=snapshot_path, logger=self.logger)
+                self._catalog.refresh()
+            elif is_refresh:
+                self._catalog.refresh()
+
+            return self._catalog
+
+    def get_object_names(self, is_refresh: bool = False):
+        """
+        Names (schema.name, lowercase) of every object in sys.objects. See get_catalog()
+
+        :param is_refresh: pull changes from the database first
+        :type is_refresh: bool
+        :return:
+        :rtype: set
+        """
+        return self.get_catalog(is_refresh=is_refresh).get_names()
+
+    def clear_object_cache(self):
+        with self._catalog_lock:
+            self._catalog = None
 
-    def get_objects_not_found(self, objects: []):
+    def get_objects_not_found(self, objects: [], is_refresh_cache: bool = False):
+        """
+        Returns the objects that aren't in the database
+        Checked against the cached catalog of sys.objects, so this doesn't query the database per object
+
+        :param objects: object names. Can be quoted with brackets
+        :type objects: []
+        :param is_refresh_cache: reload sys.objects before checking
+        :type is_refresh_cache: bool
+        :return:
+        :rtype: []
+        """
         if not objects:
             return
 
-        bad_objects = []
-        for o in objects:
-            # sql = "SELECT ObjectId = OBJECT_ID('{}')".format(o)
-            sql = """
-                ;WITH c AS (
-                    SELECT 
-                        CONCAT(s.name, '.', o.name) AS FullName 
-                    FROM sys.objects o
-                    JOIN sys.schemas s ON o.schema_id = s.schema_id
-                )
-                
-                SELECT ISNULL(
-                        (SELECT TOP 1 1
-                        FROM c 
-                        WHERE 
-                            REPLACE(REPLACE('{}', '[', ''), ']', '') = c.FullName)
-                , 0) AS IsExists """.format(o)
-            object_Id = self.get_one_result(sql)
-            if not object_Id:
-                bad_objects.append(o)
+        bad_objects = self.get_catalog(is_refresh=is_refresh_cache).get_objects_not_found(objects)
 
         if bad_objects or len(bad_objects) > 0:
             self.logger.warning(
@@ -1024,9 +1662,27 @@ class MssqlDatabase(Database):
     def script_objects(self,
                        objects: [],
                        path: str=None,
-                       is_file_per_object: bool=True):
-        from StringUtil import StringUtil
-
+                       is_file_per_object: bool=True,
+                       chunk_size: int=None,
+                       is_native: bool=False):
+        """
+        Script objects with mssql-scripter
+        Long lists are split into shards of chunk_size objects, run at the same time (see MssqlScripterShards)
+        With is_native, objects are scripted in-process by NativeScripter instead
+
+        :param objects: object names
+        :type objects: []
+        :param path: folder to script to. None to return the script
+        :type path: str
+        :param is_file_per_object: one file per object when scripting to path
+        :type is_file_per_object: bool
+        :param chunk_size: most objects per mssql-scripter run. Defaults to scripter_chunk_size
+        :type chunk_size: int
+        :param is_native: script tables, views, functions, procedures and triggers without mssql-scripter
+        :type is_native: bool
+        :return: the script of every object when there's no path, in the order of objects
+        :rtype: str
+        """
         if not objects:
             return
 
@@ -1039,6 +1695,14 @@ class MssqlDatabase(Database):
             self.logger.error('Unable to find all objects')
             raise ValueError
 
+        if is_native:
+            scripter = self.get_native_scripter(objects)
+            if path:
+                scripter.write_to_path(path, objects, is_use_folders=False, is_file_per_object=is_file_per_object)
+                return
+
+            return ''.join(scripter.script_objects(objects).values())
+
         args = []
         if path:
             args.append(MssqlScripterArguments.FILE_PATH.value)
@@ -1047,28 +1711,87 @@ class MssqlDatabase(Database):
         if is_file_per_object and path:
             args.append(MssqlScripterArguments.FILE_PER_OBJECT.value)
 
-        args.append(MssqlScripterArguments.INCLUDE_OBJECTS.value)
-        for o in objects:
-            args.append(o)
-
         args.append(MssqlScripterArguments.EXCLUDE_USE_DATABASE.value)
         args.append(MssqlScripterArguments.SCRIPT_DROP_CREATE.value)
         args.append(MssqlScripterArguments.CHECK_FOR_EXISTENCE.value)
+        args.append(MssqlScripterArguments.INCLUDE_OBJECTS.value)
 
-        result = self.__do_mssqlscripter_action(args, is_include_default_options=True)
+        shards = MssqlScripterShards(chunk_size=chunk_size or self.scripter_chunk_size,
+                                     max_workers=self.scripter_max_concurrency,
+                                     logger=self.logger)
+        base_length = MssqlScripterShards.get_command_length(self.__get_default_mssqlscripter_args() +
+                                                             self.__default_mssqlscripter_options +
+                                                             args)
 
+        results = shards.run(lambda shard: self.__do_mssqlscripter_action(args + shard,
+                                                                          is_include_default_options=True,
+                                                                          is_raise_errors=True),
+                             objects,
+                             base_length)
 
         if not path:
-            output_str = result.decode('ascii', 'ignore')
+            output_str = MssqlScripterShards.merge(results).decode('ascii', 'ignore')
 
             return''.join(output_str)
 
-    def compare_objects_in_databases(self, db1: str, db2: str):
+    def get_native_scripter(self,
+                            objects: [] = None,
+                            is_script_drop_create: bool = True,
+                            is_check_for_existence: bool = True):
+        """
+        NativeScripter over a snapshot of the catalog, read with one query per catalog view
+
+        :param objects: object names to read. None for every object
+        :type objects: []
+        :return:
+        :rtype: NativeScripter
+        """
+        object_ids = None
+        if objects is not None:
+            catalog = self.get_catalog()
+            object_ids = [o.object_id for o in [catalog.get_object(name) for name in objects] if o]
+
+        return NativeScripter(MssqlCatalogSnapshot.read(self, object_ids),
+                              database_name=self.database,
+                              is_script_drop_create=is_script_drop_create,
+                              is_check_for_existence=is_check_for_existence,
+                              logger=self.logger)
+
+    def compare_objects_in_databases(self, db1: str, db2: str, is_streaming: bool = False):
+        """
+        Both databases have to be on this server, and every definition is hashed on each call.
+        See diff_objects() for a cached comparison that works across servers
+
+        :param is_streaming: return a generator over the rows (see iter_rows()) instead of a list
+        :type is_streaming: bool
+        """
         if not db1 or not db2:
             return
 
+        sql = MssqlDatabase.__get_compare_objects_sql(MssqlDatabase.quote_name(db1), MssqlDatabase.quote_name(db2))
+
+        if is_streaming:
+            return self.iter_rows(sql)
 
-        sql = """
+        return self.get_rows_from_sql(sql)
+
+    def diff_objects(self, target, cache_path: str = None):
+        """
+        Functions, views and procedures to create, modify or drop in target to match this database. See SchemaDiff
+
+        :param target: database to compare to, on any server
+        :type target: MssqlDatabase
+        :param cache_path: JSON file to keep definition hashes in between runs
+        :type cache_path: str
+        :return: 'create', 'modify' and 'drop' lists of ObjectState
+        :rtype: OrderedDict
+        """
+        return SchemaDiff(self, target, cache_path=cache_path, logger=self.logger).compare()
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def __get_compare_objects_sql(db1: str, db2: str):
+        return """
         ;WITH c_DB1_GetData AS (
             SELECT
                 o.object_id
@@ -1168,8 +1891,6 @@ class MssqlDatabase(Database):
             ,v.FullNameQuoted
         """.format(db1, db2)
 
-        return self.get_rows_from_sql(sql)
-
 
 
 
@@ -1,4 +1,7 @@
 from DatabaseUtils.Database import Database, MssqlDatabase, DatabaseType
+from DatabaseUtils.DeploymentPlanner import DeploymentPlanner
+from DatabaseUtils.ScriptDirectoryIndex import ScriptDirectoryIndex
+from collections import OrderedDict
 from enum import Enum
 import json
 import logging
@@ -124,7 +127,23 @@ class MssqlDatabaseDeployment(DatabaseDeployment):
                  destination_database: MssqlDatabase,
                  local_repo_path: str,
                  objects: [],
-                 logger: logging.Logger=None):
+                 logger: logging.Logger=None,
+                 is_in_process: bool = True,
+                 is_transaction: bool = True,
+                 max_parallel: int = 1):
+        """
+        :param is_in_process: deploy over one connection from the destination's pool instead of a sqlcmd per file.
+            See MssqlDatabase.execute_scripts()
+        :type is_in_process: bool
+        :param is_transaction: deploy all files in one transaction, rolled back if any of them fails.
+            With max_parallel above 1, only each object's files are. Only with is_in_process
+        :type is_transaction: bool
+        :param max_parallel: objects deployed at once, in dependency order. See DeploymentPlanner.
+            With 1 (the default), everything is deployed one at a time, in one transaction with is_transaction.
+            Above 1, each object is deployed in its own transaction, so a failure doesn't roll back objects
+            already deployed. Only with is_in_process
+        :type max_parallel: int
+        """
         self._source_database = source_database,
         self._destination_database = destination_database,
 
@@ -136,12 +155,19 @@ class MssqlDatabaseDeployment(DatabaseDeployment):
 
         self._local_repo_path = local_repo_path
         self._objects = objects
+        self.is_in_process = is_in_process
+        self.is_transaction = is_transaction
+        self.max_parallel = max_parallel if max_parallel and max_parallel > 0 else 1
 
         if not logger:
             self._logger = logging.getLogger(__name__)
         else:
             self._logger = logger
 
+        if self.is_transaction and self.max_parallel > 1:
+            self._logger.warning('max_parallel is {}: each object is deployed in its own transaction, '
+                                 'not all of them in one'.format(self.max_parallel))
+
         if self._is_have_bad_objects():
             self._logger.error('Objects argument contains one or more objects that are not found')
             raise ValueError
@@ -200,19 +226,38 @@ class MssqlDatabaseDeployment(DatabaseDeployment):
         self._source_database.script_objects(self._objects, self._destination_database.local_path)
 
     def get_sql_from_path(self):
-        from StringUtil import StringUtil
         sql = []
-        for o in os.listdir(os.path.abspath(self._destination_database.local_path)):
-            if not '.'.join(o.split('.')[0:2]).strip().lower() in [str(x).strip().lower() for x in self._objects]:
-                continue
-
-            sql.append(MssqlDatabase.read_script(os.path.join(self._destination_database.local_path, o)))
+        for path in self._get_sql_file_paths():
+            sql.append(MssqlDatabase.read_script(path))
 
         return sql
         # return '\nGO\n'.join(sql)
 
     def _deploy_changes(self):
         os.chdir(self._destination_database.local_path) # TODO: Probably can take out
+
+        if self.is_in_process:
+            paths_by_object = OrderedDict()
+            for f in self._get_sql_file_paths():
+                if f:
+                    paths_by_object.setdefault(DeploymentPlanner.get_object_name_from_file(f), []).append(f)
+
+            planner = self._get_deployment_planner(paths_by_object)
+
+            if self.max_parallel > 1:
+                self._logger.info('Deploying {} objects in dependency order, {} at a time'.format(len(paths_by_object),
+                                                                                                self.max_parallel))
+                planner.deploy(self._destination_database,
+                               paths_by_object,
+                               max_workers=self.max_parallel,
+                               is_transaction=self.is_transaction)
+                return
+
+            paths = [p for name in planner.get_order() for p in paths_by_object[name]]
+            self._logger.info('Deploying {} files{}'.format(len(paths), ' in one transaction' if self.is_transaction else ''))
+            self._destination_database.execute_scripts(paths, is_transaction=self.is_transaction)
+            return
+
         for f in self._get_sql_file_paths():
             if not f:
                 continue
@@ -220,19 +265,32 @@ class MssqlDatabaseDeployment(DatabaseDeployment):
             self._logger.info('Deploying {}'.format(file_path))
             self._destination_database.execute_script(file_path)
 
+    def _get_deployment_planner(self, paths_by_object: dict):
+        """
+        Dependencies from the source database, or from the scripts if the database can't give them
+        """
+        scripts = {}
+        for name, paths in paths_by_object.items():
+            sql = []
+            for p in paths:
+                with open(p, 'r', encoding='utf-8-sig') as f:
+                    sql.append(f.read())
+            scripts[name] = '\n'.join(sql)
+
+        return DeploymentPlanner.from_database(self._source_database,
+                                               list(paths_by_object.keys()),
+                                               scripts=scripts,
+                                               logger=self._logger)
+
     def _get_scripted_objects(self):
         return self._source_database.script_objects(self._objects, None, False)
 
     def _get_sql_file_paths(self):
-        paths = []
-        for o in os.listdir(os.path.abspath(self._destination_database.local_path)):
-            if not '.'.join(o.split('.')[0:2]).strip().lower() in [str(x).strip().lower() for x in self._objects]:
-                continue
-            paths.append(os.path.join(self._destination_database.local_path, o))
-            # paths.append(o)
-        return paths
-
-
+        """
+        Scripts of the objects being deployed, in the order of objects. See ScriptDirectoryIndex
+        """
+        index = ScriptDirectoryIndex.get_index(self._destination_database.local_path)
+        return index.get_paths_for_objects(self._objects)
 
     def _commit_changes(self):
         from StringUtil import StringUtil
@@ -0,0 +1,198 @@
+import logging
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from DatabaseUtils.Database import MssqlDatabase
+
+
+class DeploymentPlanner(object):
+    """
+    Orders the objects of a deployment so each is deployed after what it references
+
+    - Dependencies come from the source database (sys.sql_expression_dependencies and foreign keys),
+      or from parsing the scripts when the database can't give them
+    - get_levels() groups objects into levels: nothing in a level depends on anything in the same or a later level,
+      so a level can be deployed all at once
+    - Objects in (or depending on) a dependency cycle can't be ordered, and are deployed one at a time at the end
+    """
+
+    # Strings and comments, to take out before looking for object names
+    __strip = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/", re.DOTALL)
+    # [schema].[name], schema.name, or a single name
+    __name = re.compile(r'(?:(\[[^\]]+\]|[A-Za-z_#@][\w@$#]*)\s*\.\s*)?(\[[^\]]+\]|[A-Za-z_#@][\w@$#]*)')
+
+    def __init__(self,
+                 objects: [],
+                 dependencies: [],
+                 logger: logging.Logger = None):
+        """
+        :param objects: names (schema.name) of the objects being deployed
+        :type objects: []
+        :param dependencies: (referencing name, referenced name) pairs. Pairs that aren't both in objects are ignored
+        :type dependencies: []
+        """
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self.objects = OrderedDict()
+        for name in objects or []:
+            self.objects.setdefault(MssqlDatabase.get_unquoted_object_name(name), name)
+
+        # key -> keys of the objects it references
+        self.references = OrderedDict([(key, set()) for key in self.objects])
+        for referencing, referenced in dependencies or []:
+            referencing = MssqlDatabase.get_unquoted_object_name(referencing)
+            referenced = MssqlDatabase.get_unquoted_object_name(referenced)
+
+            if referencing == referenced or referencing not in self.objects or referenced not in self.objects:
+                continue
+
+            self.references[referencing].add(referenced)
+
+    @staticmethod
+    def from_database(database, objects: [], scripts: dict = None, logger: logging.Logger = None):
+        """
+        Planner with the dependencies in database. Falls back to parsing scripts if they can't be read
+
+        :param database: source database. See Database.get_object_dependencies()
+        :type database: Database
+        :param scripts: name -> script of each object, for the fallback
+        :type scripts: dict
+        :return:
+        :rtype: DeploymentPlanner
+        """
+        logger = logger if logger else logging.getLogger(__name__)
+
+        try:
+            dependencies = [(row[0], row[1]) for row in database.get_object_dependencies()]
+        except Exception as e:
+            if scripts is None:
+                raise e
+            logger.warning('Unable to read object dependencies from the database. '
+                           'Parsing scripts instead: {}'.format(e))
+            dependencies = DeploymentPlanner.get_dependencies_from_scripts(scripts)
+
+        return DeploymentPlanner(objects, dependencies, logger=logger)
+
+    @staticmethod
+    def get_dependencies_from_scripts(scripts: dict, default_schema: str = 'dbo'):
+        """
+        Which of the scripted objects each script mentions, outside strings and comments
+
+        :param scripts: name (schema.name) -> script
+        :type scripts: dict
+        :param default_schema: schema of names used without one
+        :type default_schema: str
+        :return: (referencing name, referenced name) pairs
+        :rtype: []
+        """
+        keys = set([MssqlDatabase.get_unquoted_object_name(name) for name in scripts])
+        dependencies = []
+
+        for name, script in scripts.items():
+            key = MssqlDatabase.get_unquoted_object_name(name)
+            sql = DeploymentPlanner.__strip.sub(' ', script or '')
+
+            found = set()
+            for schema, obj in DeploymentPlanner.__name.findall(sql):
+                referenced = MssqlDatabase.get_unquoted_object_name('{}.{}'.format(schema or default_schema, obj))
+                if referenced in keys and referenced != key:
+                    found.add(referenced)
+
+            dependencies += [(key, referenced) for referenced in sorted(found)]
+
+        return dependencies
+
+    def get_levels(self):
+        """
+        Kahn's algorithm, a level at a time
+
+        :return: names of the objects of each level, in the order to deploy the levels.
+            Objects in or depending on a cycle each get their own level at the end
+        :rtype: [[]]
+        """
+        remaining = OrderedDict([(key, set(refs)) for key, refs in self.references.items()])
+        levels = []
+
+        while remaining:
+            level = sorted([key for key, refs in remaining.items() if not refs])
+            if not level:
+                break
+
+            levels.append([self.objects[key] for key in level])
+
+            for key in level:
+                del remaining[key]
+            for refs in remaining.values():
+                refs.difference_update(level)
+
+        if remaining:
+            self.logger.warning('{} objects are in or depend on a dependency cycle. '
+                                'Deploying them one at a time last: {}'.format(len(remaining),
+                                                                               ', '.join([self.objects[key]
+                                                                                          for key in remaining])))
+            levels += [[self.objects[key]] for key in sorted(remaining)]
+
+        return levels
+
+    def get_order(self):
+        """
+        :return: every object, in an order it can be deployed in one at a time
+        :rtype: []
+        """
+        return [name for level in self.get_levels() for name in level]
+
+    def deploy(self, database, scripts: dict, max_workers: int = 4, is_transaction: bool = True):
+        """
+        Deploy a level at a time. Objects in a level are deployed at the same time, each over its own pooled
+        connection, max_workers at once. A level is only started once everything before it was deployed
+
+        With is_transaction, each object's scripts are all or nothing. Objects deployed before a failure stay
+        deployed, since they were committed on other connections
+
+        :param database: destination. See MssqlDatabase.execute_scripts()
+        :type database: MssqlDatabase
+        :param scripts: name -> file paths (or (name, sql) tuples) of each object
+        :type scripts: dict
+        :param max_workers: objects deployed at once
+        :type max_workers: int
+        :param is_transaction: see MssqlDatabase.execute_scripts()
+        :type is_transaction: bool
+        :return: number of batches run
+        :rtype: int
+        """
+        max_workers = max_workers if max_workers and max_workers > 0 else 1
+        scripts = dict([(MssqlDatabase.get_unquoted_object_name(k), v) for k, v in scripts.items()])
+        levels = self.get_levels()
+        count = 0
+
+        def deploy_object(name):
+            return database.execute_scripts(scripts.get(MssqlDatabase.get_unquoted_object_name(name)) or [],
+                                            is_transaction=is_transaction)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for i, level in enumerate(levels, 1):
+                self.logger.info('Deploying level {} of {}: {} objects'.format(i, len(levels), len(level)))
+
+                futures = [executor.submit(deploy_object, name) for name in level]
+                # Let the rest of the level finish before stopping, so nothing is left running
+                errors = []
+                for name, future in zip(level, futures):
+                    try:
+                        count += future.result()
+                    except Exception as e:
+                        self.logger.error('Failed to deploy {}: {}'.format(name, e))
+                        errors.append(e)
+
+                if errors:
+                    raise errors[0]
+
+        return count
+
+    @staticmethod
+    def get_object_name_from_file(file: str):
+        """
+        schema.name of a file mssql-scripter wrote, e.g. dbo.MyProc.StoredProcedure.sql -> dbo.MyProc
+        """
+        return '.'.join(os.path.basename(file).split('.')[0:2])
@@ -0,0 +1,227 @@
+import logging
+import os
+import shutil
+import zipfile
+
+from DatabaseUtils.MssqlUtils.BackupManifest import BackupManifest
+from DatabaseUtils.MssqlUtils.BackupStore import BackupStore
+
+
+class BackupArchive(object):
+    """
+    Backup folder in one compressed zip file
+
+    - Each script is its own deflate-compressed member, so one object is read without decompressing the rest
+      (the zip's central directory is the index)
+    - Members are named like the files in the backup path (e.g. procedures/dbo.MyProc.StoredProcedure.sql)
+    - Scripts are streamed in and out in blocks, never held in memory whole
+    """
+
+    DEFAULT_COMPRESS_LEVEL = 6
+
+    # Bytes copied at a time when streaming into or out of the archive
+    __block_size = 1024 * 1024
+
+    def __init__(self,
+                 path: str,
+                 compress_level: int = DEFAULT_COMPRESS_LEVEL,
+                 logger: logging.Logger = None):
+        """
+        :param path: zip file
+        :type path: str
+        :param compress_level: zlib level, 1 (fastest) to 9 (smallest)
+        :type compress_level: int
+        """
+        if not path:
+            raise ValueError('Need a path for the backup archive')
+
+        self.path = os.path.abspath(path)
+        self.compress_level = compress_level
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self._zip = None
+        self.__names = None
+
+    @staticmethod
+    def is_archive(path: str):
+        return bool(path) and os.path.isfile(path) and zipfile.is_zipfile(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def open(self, mode: str = 'r'):
+        """
+        :param mode: 'r' to read, 'w' to write a new archive, 'a' to add to one
+        :type mode: str
+        :return: self
+        :rtype: BackupArchive
+        """
+        self.close()
+
+        if mode != 'r':
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._zip = zipfile.ZipFile(self.path,
+                                    mode=mode,
+                                    compression=zipfile.ZIP_DEFLATED,
+                                    compresslevel=self.compress_level,
+                                    allowZip64=True)
+        self.__names = None
+
+        return self
+
+    def close(self):
+        if self._zip:
+            self._zip.close()
+            self._zip = None
+
+    def __get_zip(self):
+        if not self._zip:
+            self.open('r')
+
+        return self._zip
+
+    @staticmethod
+    def get_member_name(name: str):
+        return str(name).replace(os.sep, '/').lstrip('/')
+
+    def open_member(self, name: str):
+        """
+        Writable file object for a new script in the archive. Write to it in pieces and close it
+
+        :param name: e.g. procedures/dbo.MyProc.StoredProcedure.sql
+        :type name: str
+        """
+        self.__names = None
+        # force_zip64, as the size isn't known up front
+        return self.__get_zip().open(BackupArchive.get_member_name(name), mode='w', force_zip64=True)
+
+    def add_stream(self, name: str, stream):
+        """
+        Copy a readable binary file object (e.g. a process' stdout) into the archive
+
+        :return: bytes written
+        :rtype: int
+        """
+        with self.open_member(name) as member:
+            shutil.copyfileobj(stream, member, self.__block_size)
+            return member.tell()
+
+    def add_bytes(self, name: str, content: bytes):
+        self.__names = None
+        self.__get_zip().writestr(BackupArchive.get_member_name(name), content)
+
+    def add_folder(self, path: str, folders: [] = None):
+        """
+        Add the .sql files under path, keeping their path relative to it
+
+        :param folders: only these top-level folders. None for every file
+        :type folders: []
+        :return: number of files added
+        :rtype: int
+        """
+        folders = set([f.strip('/').lower() for f in folders]) if folders else None
+        count = 0
+
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file in sorted(files):
+                if not file.lower().endswith('.sql'):
+                    continue
+
+                file_path = os.path.join(root, file)
+                name = BackupArchive.get_member_name(os.path.relpath(file_path, path))
+                if folders is not None and name.split('/')[0].lower() not in folders:
+                    continue
+
+                with open(file_path, 'rb') as f:
+                    self.add_stream(name, f)
+                count += 1
+
+        return count
+
+    def get_names(self):
+        """
+        :return: name of every script, in the order they were added
+        :rtype: []
+        """
+        if self.__names is None:
+            self.__names = [n for n in self.__get_zip().namelist() if not n.endswith('/')]
+
+        return self.__names
+
+    def read(self, name: str):
+        """
+        :return: one script, without decompressing the others
+        :rtype: bytes
+        """
+        return self.__get_zip().read(BackupArchive.get_member_name(name))
+
+    def open_script(self, name: str):
+        """
+        Readable file object for one script, for scripts too big to read at once
+        """
+        return self.__get_zip().open(BackupArchive.get_member_name(name), mode='r')
+
+    def find_object(self, full_name: str):
+        """
+        :param full_name: schema.name or [schema].[name]
+        :type full_name: str
+        :return: names of the scripts for the object (usually one)
+        :rtype: []
+        """
+        pattern = BackupManifest.get_file_name_pattern(full_name)
+        return [n for n in self.get_names() if pattern.match(n.rsplit('/', 1)[-1])]
+
+    def read_object(self, full_name: str):
+        """
+        :return: script of an object, None if it isn't in the archive
+        :rtype: bytes
+        """
+        names = self.find_object(full_name)
+        if not names:
+            return
+
+        return self.read(names[0])
+
+    def iter_scripts(self, folders: [] = None):
+        """
+        Yields (name, content) of each script, one at a time
+
+        :param folders: only these top-level folders, in this order. None for every script, in archive order
+        :type folders: []
+        :return:
+        :rtype: generator
+        """
+        names = self.get_names()
+
+        if folders is not None:
+            ordered = []
+            for folder in folders:
+                prefix = '{}/'.format(folder.strip('/').lower())
+                ordered += sorted([n for n in names if n.lower().startswith(prefix)])
+            names = ordered
+
+        for name in names:
+            yield name, self.read(name)
+
+    def extract(self, target_path: str):
+        """
+        Write every script to target_path, laid out like the backup path
+
+        :return: number of files written
+        :rtype: int
+        :raises ValueError: before writing anything, when a member name resolves outside target_path
+        """
+        # Check every name first, so a bad archive writes nothing
+        file_paths = [(name, BackupStore.get_target_file_path(target_path, name)) for name in self.get_names()]
+
+        for name, file_path in file_paths:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with self.open_script(name) as src, open(file_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, self.__block_size)
+
+        return len(file_paths)
@@ -0,0 +1,196 @@
+import json
+import logging
+import os
+import re
+from datetime import datetime
+
+from DatabaseUtils.Database import MssqlDatabase
+
+
+class BackupManifest(object):
+    """
+    What every object looked like at the last successful backup: its modify_date and a hash of its definition
+
+    Diffing the manifest against the database (get_delta()) gives exactly which objects to script again
+    and which were dropped, instead of everything changed since a date
+    Definitions are only hashed for objects whose modify_date moved (see merge_definition_hashes()),
+    so an object altered without changing its definition isn't scripted again
+    Saved as JSON in the backup folder
+    """
+
+    __version = 1
+
+    def __init__(self,
+                 path: str,
+                 server: str = None,
+                 database: str = None,
+                 objects: dict = None,
+                 saved_at: str = None,
+                 logger: logging.Logger = None):
+        """
+        :param path: manifest file
+        :type path: str
+        :param objects: MssqlDatabase.get_unquoted_object_name(name) -> entry. See get_entry()
+        :type objects: dict
+        """
+        self.path = path
+        self.server = server
+        self.database = database
+        self.objects = objects or {}
+        self.saved_at = saved_at
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+    def __len__(self):
+        return len(self.objects)
+
+    def is_empty(self):
+        return len(self.objects) == 0
+
+    @staticmethod
+    def get_file_name_pattern(name: str):
+        """
+        Regex for the file name mssql-scripter gives an object: <schema>.<name>.<type>.sql
+        """
+        return re.compile(r'^{}(\.[a-z]+)?\.sql$'.format(re.escape(MssqlDatabase.get_unquoted_object_name(name))),
+                          re.IGNORECASE)
+
+    @staticmethod
+    def get_entry(row):
+        """
+        Entry for a row of Database.get_object_states()
+        (object_id, type, FullName, FullNameQuoted, modify_date). The definition hash is filled in later
+        """
+        modify_date = row[4]
+        if isinstance(modify_date, datetime):
+            modify_date = modify_date.isoformat()
+
+        return {
+            'object_id': int(row[0]),
+            'type': str(row[1]).strip() if row[1] is not None else None,
+            'full_name': row[2],
+            'full_name_quoted': row[3],
+            'modify_date': str(modify_date) if modify_date is not None else None,
+            'definition_hash': None,
+        }
+
+    @staticmethod
+    def from_rows(path: str, server: str, database: str, rows, logger: logging.Logger = None):
+        """
+        Manifest of the database as it is now
+
+        :param rows: Database.get_object_states()
+        :type rows:
+        :return:
+        :rtype: BackupManifest
+        """
+        objects = {}
+        for row in rows:
+            entry = BackupManifest.get_entry(row)
+            objects[MssqlDatabase.get_unquoted_object_name(entry['full_name'])] = entry
+
+        return BackupManifest(path=path, server=server, database=database, objects=objects, logger=logger)
+
+    @staticmethod
+    def load(path: str, server: str, database: str, logger: logging.Logger = None):
+        """
+        Read the manifest at path. An empty manifest is returned when there isn't one,
+        it can't be read, or it was written for another server/database
+
+        :return:
+        :rtype: BackupManifest
+        """
+        logger = logger if logger else logging.getLogger(__name__)
+        manifest = BackupManifest(path=path, server=server, database=database, logger=logger)
+
+        if not path or not os.path.isfile(path):
+            return manifest
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning('Unable to read backup manifest {}. Doing a full backup: {}'.format(path, e))
+            return manifest
+
+        if str(data.get('server')).lower() != str(server).lower() \
+                or str(data.get('database')).lower() != str(database).lower():
+            logger.warning('Backup manifest {} is for another database. Doing a full backup'.format(path))
+            return manifest
+
+        manifest.objects = data.get('objects') or {}
+        manifest.saved_at = data.get('saved_at')
+
+        return manifest
+
+    def save(self, path: str = None):
+        """
+        Write the manifest. Written to a temp file first, so a failed save doesn't leave half a manifest
+        """
+        path = path or self.path
+        if not path:
+            raise ValueError('Need a path to save the backup manifest to')
+
+        self.saved_at = datetime.now().isoformat()
+        data = {
+            'version': self.__version,
+            'server': self.server,
+            'database': self.database,
+            'saved_at': self.saved_at,
+            'objects': self.objects,
+        }
+
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+
+        os.replace(tmp_path, path)
+        self.path = path
+
+    def merge_definition_hashes(self, current):
+        """
+        Copy the definition hash of every object whose modify_date didn't move into current
+
+        :param current: manifest of the database now. See from_rows()
+        :type current: BackupManifest
+        :return: entries of current to hash: objects whose modify_date moved.
+            New objects are scripted either way, so they aren't hashed until they change again
+        :rtype: []
+        """
+        to_hash = []
+        for key, entry in current.objects.items():
+            previous = self.objects.get(key)
+            if not previous:
+                continue
+
+            if previous.get('modify_date') == entry.get('modify_date'):
+                entry['definition_hash'] = previous.get('definition_hash')
+            else:
+                to_hash.append(entry)
+
+        return to_hash
+
+    def get_delta(self, current):
+        """
+        Objects in current that are new, or whose modify_date moved and whose definition changed (or can't be
+        compared, e.g. tables), and objects in this manifest that aren't in current anymore
+
+        :param current: manifest of the database now. See from_rows()
+        :type current: BackupManifest
+        :return: (changed entries, dropped entries), each sorted by name
+        :rtype: tuple
+        """
+        changed = []
+        for key in sorted(current.objects):
+            entry = current.objects[key]
+            previous = self.objects.get(key)
+
+            if not previous:
+                changed.append(entry)
+            elif previous.get('modify_date') != entry.get('modify_date'):
+                # Altered with the same definition: nothing to script
+                if not entry.get('definition_hash') or entry.get('definition_hash') != previous.get('definition_hash'):
+                    changed.append(entry)
+
+        dropped = [self.objects[key] for key in sorted(self.objects) if key not in current.objects]
+
+        return changed, dropped
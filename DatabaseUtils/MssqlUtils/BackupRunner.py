@@ -0,0 +1,245 @@
+import json
+import logging
+import os
+import time
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+
+class BackupResult(object):
+    """
+    Outcome of backing up one database. See BackupRunner
+    """
+
+    def __init__(self, server: str, database: str, path: str):
+        self.server = server
+        self.database = database
+        self.path = path
+        self.is_success = False
+        self.attempts = 0
+        self.started_at = None
+        # Seconds, of the last attempt
+        self.duration = None
+        # .sql files and bytes written to the backup path by the last attempt
+        self.objects_written = 0
+        self.bytes_written = 0
+        self.error = None
+
+    def to_dict(self):
+        return OrderedDict([
+            ('server', self.server),
+            ('database', self.database),
+            ('path', self.path),
+            ('is_success', self.is_success),
+            ('attempts', self.attempts),
+            ('started_at', self.started_at.isoformat() if self.started_at else None),
+            ('duration', round(self.duration, 3) if self.duration is not None else None),
+            ('objects_written', self.objects_written),
+            ('bytes_written', self.bytes_written),
+            ('error', str(self.error) if self.error else None),
+        ])
+
+
+class BackupRunner(object):
+    """
+    Runs MssqlDatabaseBackup's concurrently
+
+    - At most max_workers backups at once, and at most max_per_server against the same server
+    - A failed backup is retried after backoff seconds, doubling each time up to max_backoff.
+      Waiting for a retry doesn't hold up a worker
+    - run() returns a BackupResult per database, in the order the backups were given
+    """
+
+    def __init__(self,
+                 backups: [],
+                 max_workers: int = 4,
+                 max_per_server: int = 2,
+                 retries: int = 2,
+                 backoff: float = 30,
+                 max_backoff: float = 600,
+                 is_changed_objects_only: bool = True,
+                 logger: logging.Logger = None):
+        """
+        :param backups: MssqlDatabaseBackup of each database
+        :type backups: []
+        :param max_workers: backups run at once
+        :type max_workers: int
+        :param max_per_server: backups run at once against one server
+        :type max_per_server: int
+        :param retries: times a failed backup is tried again
+        :type retries: int
+        :param backoff: seconds before the first retry
+        :type backoff: float
+        :param max_backoff: most seconds between retries
+        :type max_backoff: float
+        :param is_changed_objects_only: passed to do_full_backup()
+        :type is_changed_objects_only: bool
+        """
+        self.backups = list(backups or [])
+        self.max_workers = max_workers if max_workers and max_workers > 0 else 1
+        self.max_per_server = max_per_server if max_per_server and max_per_server > 0 else 1
+        self.retries = retries if retries and retries > 0 else 0
+        self.backoff = backoff if backoff and backoff > 0 else 0
+        self.max_backoff = max_backoff
+        self.is_changed_objects_only = is_changed_objects_only
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self.results = []
+
+    @staticmethod
+    def get_server_key(backup):
+        return str(backup.get_database().server).strip().lower()
+
+    def get_retry_delay(self, attempts: int):
+        """
+        Seconds to wait before the next try, after attempts tries
+        """
+        return min(self.backoff * (2 ** (attempts - 1)), self.max_backoff)
+
+    def run(self):
+        """
+        Back up every database
+
+        :return: result of each backup, in the order of backups
+        :rtype: [BackupResult]
+        """
+        results = [BackupResult(server=b.get_database().server, database=b.get_database().database, path=b.path)
+                   for b in self.backups]
+
+        # (index, time it can start)
+        pending = deque([(i, 0) for i in range(len(self.backups))])
+        running = {}
+        running_per_server = {}
+
+        self.logger.info('Backing up {} databases, {} at a time ({} per server)'.format(len(self.backups),
+                                                                                      self.max_workers,
+                                                                                      self.max_per_server))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                now = time.monotonic()
+
+                # Start whatever is due and has room on its server, in order
+                for _ in range(len(pending)):
+                    if len(running) >= self.max_workers:
+                        break
+
+                    i, not_before = pending.popleft()
+                    server = BackupRunner.get_server_key(self.backups[i])
+
+                    if not_before > now or running_per_server.get(server, 0) >= self.max_per_server:
+                        pending.append((i, not_before))
+                        continue
+
+                    running_per_server[server] = running_per_server.get(server, 0) + 1
+                    running[executor.submit(self.__run_backup, self.backups[i], results[i])] = (i, server)
+
+                if not running:
+                    # Only retries that aren't due yet
+                    time.sleep(max(0, min(t for _, t in pending) - now))
+                    continue
+
+                # Wake up for the next retry that's due, if any
+                due = [t for _, t in pending if t > now]
+                timeout = max(0, min(due) - now) if due else None
+
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i, server = running.pop(future)
+                    running_per_server[server] -= 1
+
+                    result = results[i]
+                    if result.is_success:
+                        continue
+
+                    if result.attempts <= self.retries:
+                        delay = self.get_retry_delay(result.attempts)
+                        self.logger.warning('Backup of {}.{} failed (attempt {} of {}). Retrying in {}s: {}'.format(
+                            result.server, result.database, result.attempts, self.retries + 1, delay, result.error))
+                        pending.append((i, time.monotonic() + delay))
+                    else:
+                        self.logger.error('Backup of {}.{} failed after {} attempts: {}'.format(
+                            result.server, result.database, result.attempts, result.error))
+
+        self.results = results
+        self.log_summary()
+
+        return results
+
+    def __run_backup(self, backup, result: BackupResult):
+        """
+        One attempt at backing up a database. Errors are kept on result, not raised
+        """
+        result.attempts += 1
+        result.started_at = datetime.now()
+        result.error = None
+        start = time.monotonic()
+        start_time = time.time()
+
+        try:
+            backup.do_full_backup(is_changed_objects_only=self.is_changed_objects_only)
+            result.is_success = True
+        except Exception as e:
+            result.is_success = False
+            result.error = e
+        finally:
+            result.duration = time.monotonic() - start
+            result.objects_written, result.bytes_written = BackupRunner.get_files_written(backup.path, start_time)
+
+        return result
+
+    @staticmethod
+    def get_files_written(path: str, since: float):
+        """
+        .sql files under path modified at or after since (a time.time())
+
+        :return: (number of files, total bytes)
+        :rtype: tuple
+        """
+        count = 0
+        size = 0
+
+        for root, _, files in os.walk(path):
+            for file in files:
+                if not file.lower().endswith('.sql'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, file))
+                except OSError:
+                    continue
+                if stat.st_mtime >= since:
+                    count += 1
+                    size += stat.st_size
+
+        return count, size
+
+    def get_summary(self):
+        """
+        :return: table of the results of the last run()
+        :rtype: str
+        """
+        lines = ['{:<30} {:<30} {:<8} {:>8} {:>10} {:>8} {:>14}'.format('Server', 'Database', 'Status', 'Attempts',
+                                                                          'Seconds', 'Objects', 'Bytes')]
+        for r in self.results:
+            lines.append('{:<30} {:<30} {:<8} {:>8} {:>10.1f} {:>8} {:>14}'.format(
+                str(r.server)[:30], str(r.database)[:30], 'OK' if r.is_success else 'FAILED', r.attempts,
+                r.duration or 0, r.objects_written, r.bytes_written))
+
+        failed = len([r for r in self.results if not r.is_success])
+        lines.append('{} databases, {} failed, {} objects, {} bytes'.format(
+            len(self.results), failed,
+            sum([r.objects_written for r in self.results]),
+            sum([r.bytes_written for r in self.results])))
+
+        return '\n'.join(lines)
+
+    def log_summary(self):
+        self.logger.info('Backup summary:\n{}'.format(self.get_summary()))
+
+    def save_summary(self, path: str):
+        """
+        Write the results of the last run() as JSON
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump([r.to_dict() for r in self.results], f, indent=1)
@@ -0,0 +1,279 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+
+
+class BackupStore(object):
+    """
+    Content-addressed store for scripted objects
+
+    <path>/objects/ab/abcdef....sql    each distinct script, stored once under its SHA-256
+    <path>/runs/<run id>.json          which script each object file pointed to in a backup run
+
+    A run that scripts the same thing as the last one only adds a small run manifest
+    Files are named like mssql-scripter's output, relative to the backup path (e.g. procedures/dbo.MyProc.StoredProcedure.sql)
+    """
+
+    __objects_dir = 'objects'
+    __runs_dir = 'runs'
+    __staging_dir = '.staging'
+
+    def __init__(self, path: str, logger: logging.Logger = None):
+        """
+        :param path: folder of the store, usually the backup path
+        :type path: str
+        """
+        if not path:
+            raise ValueError('Need a path for the backup store')
+
+        self.path = os.path.abspath(path)
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+    @staticmethod
+    def is_store(path: str):
+        """
+        Whether there's a store with at least one run at path
+        """
+        runs_path = os.path.join(path, BackupStore.__runs_dir)
+        if not os.path.isdir(runs_path):
+            return False
+
+        return any(name.endswith('.json') for name in os.listdir(runs_path))
+
+    @staticmethod
+    def get_hash(content: bytes):
+        return hashlib.sha256(content).hexdigest()
+
+    @staticmethod
+    def get_target_file_path(target_path: str, name: str):
+        """
+        Where a backup file name (e.g. procedures/dbo.MyProc.StoredProcedure.sql) goes under target_path
+
+        :param name: file name from a run manifest or archive, / separated
+        :type name: str
+        :return: resolved path of the file
+        :rtype: str
+        :raises ValueError: when the name resolves outside target_path (.., absolute paths, other drives)
+        """
+        target_path = os.path.realpath(target_path)
+        file_path = os.path.realpath(os.path.join(target_path, *name.split('/')))
+
+        try:
+            is_inside = file_path != target_path and os.path.commonpath([target_path, file_path]) == target_path
+        except ValueError:
+            is_inside = False  # Different drives
+
+        if not is_inside:
+            raise ValueError('Backup file {} is outside of {}'.format(name, target_path))
+
+        return file_path
+
+    def get_object_path(self, content_hash: str):
+        return os.path.join(self.path, self.__objects_dir, content_hash[:2], '{}.sql'.format(content_hash))
+
+    def put(self, content: bytes):
+        """
+        Store content if it isn't stored yet
+
+        :return: hash of content
+        :rtype: str
+        """
+        content_hash = BackupStore.get_hash(content)
+        object_path = self.get_object_path(content_hash)
+
+        if not os.path.isfile(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(object_path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, object_path)
+
+        return content_hash
+
+    def get(self, content_hash: str):
+        """
+        :return: content stored under content_hash
+        :rtype: bytes
+        """
+        with open(self.get_object_path(content_hash), 'rb') as f:
+            return f.read()
+
+    def create_staging_dir(self):
+        """
+        Empty folder to script a run to. ingest() moves it into the store
+        """
+        path = os.path.join(self.path, self.__staging_dir, datetime.now().strftime('%Y%m%d_%H%M%S_%f'))
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def ingest(self,
+               staging_path: str,
+               base_objects: dict = None,
+               removed_patterns: [] = None,
+               info: dict = None,
+               is_remove_staging: bool = True):
+        """
+        Store every file under staging_path and save a run that points to them
+
+        :param staging_path: folder of scripts, laid out like the backup path
+        :type staging_path: str
+        :param base_objects: files of an earlier run to carry over, for runs that only scripted changed objects
+        :type base_objects: dict
+        :param removed_patterns: compiled regexes of file names (without folder) to leave out of the run,
+            e.g. objects that were dropped
+        :type removed_patterns: []
+        :param info: anything else to save in the run, e.g. server and database
+        :type info: dict
+        :param is_remove_staging: delete staging_path afterwards
+        :type is_remove_staging: bool
+        :return: the run. See get_run()
+        :rtype: dict
+        """
+        objects = dict(base_objects or {})
+
+        if removed_patterns:
+            for name in list(objects):
+                if any(p.match(os.path.basename(name)) for p in removed_patterns):
+                    del objects[name]
+
+        new_objects = 0
+        for root, _, files in os.walk(staging_path):
+            for file in files:
+                file_path = os.path.join(root, file)
+                name = os.path.relpath(file_path, staging_path).replace(os.sep, '/')
+
+                with open(file_path, 'rb') as f:
+                    content_hash = self.put(f.read())
+
+                if objects.get(name) != content_hash:
+                    new_objects += 1
+                objects[name] = content_hash
+
+        run = self.save_run(objects, info)
+        self.logger.info('Backup run {}: {} files, {} changed'.format(run['run_id'], len(objects), new_objects))
+
+        if is_remove_staging:
+            shutil.rmtree(staging_path, ignore_errors=True)
+
+        return run
+
+    def save_run(self, objects: dict, info: dict = None):
+        run_id = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        run = dict(info or {})
+        run['run_id'] = run_id
+        run['created_at'] = datetime.now().isoformat()
+        run['objects'] = objects
+
+        runs_path = os.path.join(self.path, self.__runs_dir)
+        os.makedirs(runs_path, exist_ok=True)
+
+        run_path = os.path.join(runs_path, '{}.json'.format(run_id))
+        tmp_path = '{}.tmp'.format(run_path)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(run, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, run_path)
+
+        return run
+
+    def get_run_ids(self):
+        """
+        :return: ids of every run, oldest first
+        :rtype: []
+        """
+        runs_path = os.path.join(self.path, self.__runs_dir)
+        if not os.path.isdir(runs_path):
+            return []
+
+        return sorted([name[:-len('.json')] for name in os.listdir(runs_path) if name.endswith('.json')])
+
+    def get_run(self, run_id: str = None):
+        """
+        :param run_id: None for the latest run
+        :type run_id: str
+        :return: run_id, created_at, objects (file name -> hash), plus the info it was saved with.
+            None when there are no runs
+        :rtype: dict
+        """
+        if not run_id:
+            run_ids = self.get_run_ids()
+            if not run_ids:
+                return
+            run_id = run_ids[-1]
+
+        with open(os.path.join(self.path, self.__runs_dir, '{}.json'.format(run_id)), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def iter_scripts(self, run_id: str = None, folders: [] = None):
+        """
+        Yields (file name, content) of each file in a run, sorted by folder (in the order of folders) then name
+
+        :param run_id: None for the latest run
+        :type run_id: str
+        :param folders: only these top-level folders, in this order. None for every file, by name
+        :type folders: []
+        :return:
+        :rtype: generator
+        """
+        run = self.get_run(run_id)
+        if not run:
+            return
+
+        objects = run['objects']
+
+        if folders is None:
+            names = sorted(objects)
+        else:
+            names = []
+            for folder in folders:
+                prefix = '{}/'.format(folder.strip('/').lower())
+                names += sorted([name for name in objects if name.lower().startswith(prefix)])
+
+        for name in names:
+            yield name, self.get(objects[name])
+
+    def restore(self, target_path: str, run_id: str = None):
+        """
+        Write the files of a run to target_path, laid out like the backup path
+
+        :return: number of files written
+        :raises ValueError: before writing anything, when a file name in the run resolves outside target_path
+        :rtype: int
+        """
+        run = self.get_run(run_id)
+        if not run:
+            return 0
+
+        # Check every name first, so a bad manifest writes nothing
+        file_paths = [(BackupStore.get_target_file_path(target_path, name), content_hash)
+                      for name, content_hash in sorted(run['objects'].items())]
+
+        for file_path, content_hash in file_paths:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'wb') as f:
+                f.write(self.get(content_hash))
+
+        return len(file_paths)
+
+    def remove_unreferenced(self):
+        """
+        Delete stored scripts that no run points to anymore (e.g. after deleting old runs)
+
+        :return: number of scripts deleted
+        :rtype: int
+        """
+        referenced = set()
+        for run_id in self.get_run_ids():
+            referenced.update(self.get_run(run_id)['objects'].values())
+
+        count = 0
+        objects_path = os.path.join(self.path, self.__objects_dir)
+        for root, _, files in os.walk(objects_path):
+            for file in files:
+                if file.endswith('.sql') and file[:-len('.sql')] not in referenced:
+                    os.remove(os.path.join(root, file))
+                    count += 1
+
+        return count
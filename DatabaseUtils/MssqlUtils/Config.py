@@ -85,7 +85,11 @@ def get_databases(db_name: str=None):
         if db_name:
             if conn.host.strip().lower() != db_name.strip().lower():
                 continue
-        databases.append(MssqlDatabase(connection=conn))
+        databases.append(MssqlDatabase(server=conn.host,
+                                       database=conn.database,
+                                       username=conn.username,
+                                       password=conn.password,
+                                       port=conn.port))
 
     return databases
 
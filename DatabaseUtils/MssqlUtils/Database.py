@@ -1,11 +1,16 @@
 # import pymssql
 import pyodbc
 import os
-import codecs
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import DatabaseUtils.Database
 from DatabaseUtils.MssqlUtils.Connection import MssqlConnection
 from DatabaseUtils.MssqlUtils.mssql_objects.MssqlObjects import Column
 from DatabaseUtils.MssqlUtils.SqlObjectType import MssqlScripterObjectType
+from DatabaseUtils.MssqlUtils.BackupStore import BackupStore
+from DatabaseUtils.MssqlUtils.BackupArchive import BackupArchive
 
 
 class Database(object):
@@ -25,7 +30,25 @@ class Database(object):
 
 
 class DatabaseBackupCollection:
-    def __init__(self, path: str):
+    # Order scripts are read in, so objects are created before what depends on them
+    _folders = ['database', 'other', 'tables', 'functions', 'views', 'procedures']
+
+    # Scripts already read from backup folders, shared by every collection: path -> (mtime_ns, size, script)
+    _script_cache = {}
+    _script_cache_lock = threading.Lock()
+
+    # A USE statement of any database, alone on its line
+    __use_database = re.compile(DatabaseUtils.Database.MssqlDatabase.get_use_database_pattern(), re.IGNORECASE)
+
+    def __init__(self, path: str, is_preload: bool = True, max_workers: int = 8):
+        """
+        :param path: backup folder, BackupStore or BackupArchive (.zip)
+        :type path: str
+        :param is_preload: read every script now. Otherwise scripts are read one at a time by iter_scripts()
+        :type is_preload: bool
+        :param max_workers: files read at once from a backup folder
+        :type max_workers: int
+        """
         if not path:
             raise ValueError('Need a value for path')
         if not os.path.exists(path):
@@ -33,52 +56,159 @@ class DatabaseBackupCollection:
 
         self._path = path
         self._all_scripts = []
-        self.read_files_from_backup_path()
+        self.is_preloaded = is_preload
+        self.max_workers = max_workers if max_workers and max_workers > 0 else 1
+
+        if not is_preload:
+            return
+
+        if BackupArchive.is_archive(path):
+            self._all_scripts = list(self.__iter_archive_scripts())
+        elif BackupStore.is_store(path):
+            self.read_files_from_backup_store()
+        else:
+            self.read_files_from_backup_path()
 
     def get_script(self):
-        return '\nGO\n'.join(self._all_scripts)
+        return '\nGO\n'.join(self._all_scripts if self.is_preloaded else self.iter_scripts())
+
+    def iter_scripts(self):
+        """
+        Yields each script, in folder order. Only one is held in memory at a time unless preloaded
+        """
+        if self.is_preloaded:
+            yield from self._all_scripts
+        elif BackupArchive.is_archive(self._path):
+            yield from self.__iter_archive_scripts()
+        elif BackupStore.is_store(self._path):
+            yield from self.__iter_store_scripts()
+        else:
+            for file in self.__scan_backup_path(self._folders):
+                yield self.__read_script_file(file)
+
+    def write_script(self, out):
+        """
+        Write get_script() to out one script at a time, instead of building it as one string
+
+        :param out: file path, or writable text file object
+        :type out:
+        """
+        if isinstance(out, str):
+            with open(out, 'w', encoding='utf-8') as f:
+                return self.write_script(f)
+
+        for i, script in enumerate(self.iter_scripts()):
+            if i > 0:
+                out.write('\nGO\n')
+            out.write(script)
+
+    @staticmethod
+    def get_script_text(content: bytes):
+        """
+        Script as text, without its BOM and USE statements
+        """
+        lines = []
+        for line in content.decode('utf-8-sig').splitlines(keepends=True):
+            if DatabaseBackupCollection.__use_database.match(line):
+                continue
+            lines.append(line)
+
+        return ''.join(lines)
 
     def get_files_by_dir_name(self, dir_name: str):
         if not dir_name:
             return
 
-        scripts = []
+        return self.__read_script_files(self.__scan_backup_path([dir_name]))
 
-        for dir in os.listdir(self._path):
-            new_path = os.path.abspath(os.path.join(self._path, dir))
-            if not os.path.isdir(new_path):
-                continue
+    def read_files_from_backup_path(self):
+        """
+        Read every script in the backup folders: one scan of the folders, then the files are read
+        max_workers at a time. Files unchanged since they were last read come from the cache
+        """
+        self._all_scripts += self.__read_script_files(self.__scan_backup_path(self._folders))
+
+    def __scan_backup_path(self, dir_names: []):
+        """
+        List the files in the backup path's folders in one pass
 
-            if not dir.strip().lower() == dir_name:
+        :param dir_names: folders, in the order their files are returned
+        :type dir_names: []
+        :return: os.DirEntry of each file, by folder order then name
+        :rtype: []
+        """
+        dir_names = [d.strip().lower() for d in dir_names]
+        dirs = {}
+
+        with os.scandir(self._path) as entries:
+            for entry in entries:
+                if entry.is_dir() and entry.name.strip().lower() in dir_names:
+                    dirs[entry.name.strip().lower()] = entry.path
+
+        files = []
+        for dir_name in dir_names:
+            if dir_name not in dirs:
                 continue
 
-            for file in os.listdir(new_path):
-                try:
-                    scripts.append(
-                        MssqlDatabase.read_script(os.path.abspath(file), is_remove_use_database_statement=True))
-                except Exception as e:
-                    raise e
+            with os.scandir(dirs[dir_name]) as entries:
+                files += sorted([e for e in entries if e.is_file()], key=lambda e: e.name)
 
-        return scripts
+        return files
 
-    def read_files_from_backup_path(self):
-        for file in self.get_files_by_dir_name('database'):
-            self._all_scripts.append(file)
+    def __read_script_files(self, files: []):
+        """
+        :param files: os.DirEntry of each file. See __scan_backup_path()
+        :type files: []
+        :return: script of each file, in the same order
+        :rtype: []
+        """
+        if len(files) <= 1 or self.max_workers == 1:
+            return [self.__read_script_file(f) for f in files]
 
-        for file in self.get_files_by_dir_name('other'):
-            self._all_scripts.append(file)
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(files))) as executor:
+            return list(executor.map(self.__read_script_file, files))
 
-        for file in self.get_files_by_dir_name('tables'):
-            self._all_scripts.append(file)
+    def __read_script_file(self, file):
+        """
+        Script of a file, without USE statements. Read from the cache if its mtime and size haven't changed
+        """
+        path = os.path.abspath(file.path)
+        stat = file.stat()
+        key = (stat.st_mtime_ns, stat.st_size)
+
+        with DatabaseBackupCollection._script_cache_lock:
+            cached = DatabaseBackupCollection._script_cache.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        script = ''.join(MssqlDatabase.read_script(path, is_remove_use_database_statement=True))
+
+        with DatabaseBackupCollection._script_cache_lock:
+            DatabaseBackupCollection._script_cache[path] = (key, script)
+
+        return script
+
+    @staticmethod
+    def clear_script_cache():
+        with DatabaseBackupCollection._script_cache_lock:
+            DatabaseBackupCollection._script_cache.clear()
+
+    def read_files_from_backup_store(self, run_id: str = None):
+        """
+        Read the scripts of a BackupStore run (the latest by default), in the same folder order as the backup path
+        """
+        self._all_scripts += list(self.__iter_store_scripts(run_id))
 
-        for file in self.get_files_by_dir_name('functions'):
-            self._all_scripts.append(file)
+    def __iter_store_scripts(self, run_id: str = None):
+        store = BackupStore(self._path)
 
-        for file in self.get_files_by_dir_name('views'):
-            self._all_scripts.append(file)
+        for name, content in store.iter_scripts(run_id=run_id, folders=self._folders):
+            yield DatabaseBackupCollection.get_script_text(content)
 
-        for file in self.get_files_by_dir_name('procedures'):
-            self._all_scripts.append(file)
+    def __iter_archive_scripts(self):
+        with BackupArchive(self._path) as archive:
+            for name, content in archive.iter_scripts(folders=self._folders):
+                yield DatabaseBackupCollection.get_script_text(content)
 
 
 class MssqlDatabase(Database):
@@ -191,10 +321,11 @@ class MssqlDatabase(Database):
 
         try:
             lines = []
-            with codecs.open(path, 'r', encoding='utf8') as f:
-                for line in f.readlines():
+            # utf-8-sig drops the BOM mssql-scripter writes
+            with open(path, 'r', encoding='utf-8-sig') as f:
+                for line in f:
                     if is_remove_use_database_statement:
-                        if line.strip().lower().startswith('use') or ord(line.strip().lower()[0]) == 65279:
+                        if line.strip().lower().startswith('use'):
                             continue
                     lines.append(line)
             return lines
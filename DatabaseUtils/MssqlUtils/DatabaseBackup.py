@@ -1,15 +1,39 @@
 import os
+import re
+import shutil
 import subprocess
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 
 from logging import Logger
 
 from DatabaseUtils.MssqlUtils.SqlObjectType import MssqlScripterObjectType
 from DatabaseUtils.MssqlUtils.MssqlScripterOptions import MssqlScripterArguments
-# from DatabaseUtils.Database import MssqlDatabase
+from DatabaseUtils.MssqlUtils.MssqlScripterShards import MssqlScripterShards
+from DatabaseUtils.MssqlUtils.BackupManifest import BackupManifest
+from DatabaseUtils.MssqlUtils.BackupStore import BackupStore
+from DatabaseUtils.MssqlUtils.BackupArchive import BackupArchive
+from DatabaseUtils.ScriptDirectoryIndex import ScriptDirectoryIndex
+from DatabaseUtils.Database import MssqlDatabase
 
 from DatabaseUtils.MssqlUtils import Config
 
 
+class DatabaseBackupError(Exception):
+    """
+    One or more mssql-scripter runs failed
+    errors is the exception of each failed run, by name (e.g. the folder it was scripting to)
+    """
+
+    def __init__(self, errors: dict):
+        self.errors = errors
+        super(DatabaseBackupError, self).__init__(
+            '{} mssql-scripter run(s) failed: {}'.format(len(errors),
+                                                          '; '.join(['{}: {}'.format(k, v) for k, v in errors.items()])))
+
+
 class DatabaseBackup(object):
     def __int__(self,
                 path: str):
@@ -33,14 +57,38 @@ class MssqlDatabaseBackup(DatabaseBackup):
     ]
 
     __path_for_other_objects = 'other'
+    # Folders NativeScripter writes to when is_native_scripter is set
+    __native_sub_folders = ['tables', 'views', 'functions', 'procedures']
+    # modify_date and definition hash of every object at the last successful backup. See BackupManifest
+    __manifest_file_name = '.backup_manifest.json'
 
     def __init__(self,
                  path: str,
                  database: MssqlDatabase,
-                 logger: Logger):
+                 logger: Logger,
+                 max_concurrency: int = 4,
+                 is_native_scripter: bool = False,
+                 is_content_store: bool = False):
+        """
+        :param max_concurrency: mssql-scripter processes run at once against the database
+        :type max_concurrency: int
+        :param is_native_scripter: script tables, views, functions and procedures in-process with NativeScripter.
+            mssql-scripter is still used for the database and other objects
+        :type is_native_scripter: bool
+        :param is_content_store: keep scripts in a BackupStore in the backup path (each distinct script stored once,
+            plus a manifest per run) instead of rewriting the .sql files in the folders
+        :type is_content_store: bool
+        """
         self.__logger = logger
         self.__database = database
         self.path = path
+        self.max_concurrency = max_concurrency if max_concurrency and max_concurrency > 0 else 1
+        self.is_native_scripter = is_native_scripter
+        self.is_content_store = is_content_store
+        # Where scripts are written. The backup path, or a staging folder of the store while a run is scripted
+        self.__output_path = None
+        # Seconds each scripter run took in the last script_objects_to_folders(), by folder
+        self.last_timings = OrderedDict()
 
         # Initialize
         self.__make_dirs()
@@ -79,6 +127,19 @@ class MssqlDatabaseBackup(DatabaseBackup):
 
         self._path = os.path.abspath(value)
 
+    def get_database(self):
+        return self.__database
+
+    def get_output_path(self):
+        return self.__output_path or self._path
+
+    def get_store(self):
+        """
+        :return: content-addressed store in the backup path
+        :rtype: BackupStore
+        """
+        return BackupStore(self._path, self.__logger)
+
     def __get_subfolders(self):
         return self.__sub_folders.keys()
 
@@ -91,7 +152,7 @@ class MssqlDatabaseBackup(DatabaseBackup):
         :rtype:
         """
         for folder in self.__get_subfolders():
-            path = os.path.join(self.path, folder)
+            path = os.path.join(self.get_output_path(), folder)
             if not os.path.exists(path):
                 self.__logger.info('Making path {}'.format(path))
                 try:
@@ -144,7 +205,7 @@ class MssqlDatabaseBackup(DatabaseBackup):
             return
 
         if is_abspath:
-            return os.path.join(self.path, path)
+            return os.path.join(self.get_output_path(), path)
         else:
             return path
 
@@ -224,7 +285,7 @@ class MssqlDatabaseBackup(DatabaseBackup):
         if file_path and not file_path.strip() == '':
             path = ''
             if os.path.abspath(path).strip().lower() != path.strip().lower():
-                path = os.path.join(self._path, file_path)
+                path = os.path.join(self.get_output_path(), file_path)
             else:
                 path = file_path
 
@@ -333,7 +394,7 @@ class MssqlDatabaseBackup(DatabaseBackup):
 
         return current_list
 
-    def __do_mssqlscripter_action(self, args, is_include_default_options: bool = True):
+    def __do_mssqlscripter_action(self, args, is_include_default_options: bool = True, is_raise_errors: bool = False):
         from platform import system as platform_system
 
         """
@@ -344,41 +405,101 @@ class MssqlDatabaseBackup(DatabaseBackup):
         :type args:
         :param is_include_default_options:
         :type is_include_default_options:
+        :param is_raise_errors: raise the error after logging it, instead of returning None
+        :type is_raise_errors: bool
         :return:
         :rtype:
         """
         try:
-            if type(args) not in [tuple, list, dict]:
-                raise TypeError('Arguments must type of be list, tuple, or dict')
+            all_args = self.__get_mssqlscripter_command(args, is_include_default_options)
 
-            all_args = self.__get_default_mssqlscripter_args()
+            if platform_system().lower() == 'windows':
+                return subprocess.check_output(all_args, shell=True)  # For Windows: shell=True
+            else:
+                return subprocess.check_output(all_args)
 
-            if is_include_default_options:
-                current_args = [x.strip().lower() for x in args]
+        except Exception as e:
+            if isinstance(e, subprocess.CalledProcessError):
+                e.cmd = self.__get_masked_command(e.cmd)
+            self.__logger.error('Unable to perform mssql-scripter action: {}\nargs: {}'.format(e, args))
+            if is_raise_errors:
+                raise e
+
+    def __get_mssqlscripter_command(self, args, is_include_default_options: bool = True):
+        """
+        Full mssql-scripter command line: connection, default options and args
+        """
+        if type(args) not in [tuple, list, dict]:
+            raise TypeError('Arguments must type of be list, tuple, or dict')
 
-                for arg in self.__default_mssqlscripter_options:
-                    if arg.strip().lower() not in current_args:
-                        all_args.append(arg)
+        all_args = self.__get_default_mssqlscripter_args()
 
-            if type(args) in [tuple, list]:
-                for arg in args:
+        if is_include_default_options:
+            current_args = [x.strip().lower() for x in args]
+
+            for arg in self.__default_mssqlscripter_options:
+                if arg.strip().lower() not in current_args:
                     all_args.append(arg)
 
-            if type(args) == dict:
-                for k, v in args:
-                    all_args.append(k)
-                    all_args.append(v)
+        if type(args) in [tuple, list]:
+            for arg in args:
+                all_args.append(arg)
 
-            self.__logger.info('Executing command: {}'.format(all_args))
-            print(' '.join(all_args))
+        if type(args) == dict:
+            for k, v in args:
+                all_args.append(k)
+                all_args.append(v)
 
-            if platform_system().lower() == 'windows':
-                return subprocess.check_output(all_args, shell=True)  # For Windows: shell=True
-            else:
-                return subprocess.check_output(all_args)
+        self.__logger.info('Executing command: {}'.format(' '.join(self.__get_masked_command(all_args))))
 
-        except Exception as e:
-            self.__logger.error('Unable to perform mssql-scripter action: {}\nargs: {}'.format(e, args))
+        return all_args
+
+    @staticmethod
+    def __get_masked_command(all_args):
+        """
+        Copy of a mssql-scripter command with the password replaced, for logging and errors
+
+        :param all_args: command from __get_mssqlscripter_command
+        :type all_args: list
+        :return: the command with **** after --password
+        :rtype: list
+        """
+        masked = list(all_args)
+
+        for i in range(1, len(masked)):
+            if masked[i - 1] == MssqlScripterArguments.PASSWORD.value:
+                masked[i] = '****'
+
+        return masked
+
+    def __stream_mssqlscripter_action(self, args, out, is_include_default_options: bool = True, line_filter=None):
+        """
+        Run mssql-scripter and write its output to out as it comes, instead of holding it all in memory
+
+        :param out: writable binary file object
+        :type out:
+        :param line_filter: function(line: bytes) that returns False for lines to leave out
+        :type line_filter: callable
+        :return: bytes written
+        :rtype: int
+        """
+        from platform import system as platform_system
+
+        all_args = self.__get_mssqlscripter_command(args, is_include_default_options)
+        is_shell = platform_system().lower() == 'windows'  # For Windows: shell=True
+
+        written = 0
+        with subprocess.Popen(all_args, stdout=subprocess.PIPE, shell=is_shell) as process:
+            for line in process.stdout:
+                if line_filter and not line_filter(line):
+                    continue
+                out.write(line)
+                written += len(line)
+
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, self.__get_masked_command(all_args))
+
+        return written
 
     def __get_log_name(self):
         return Config.get_log_filename()
@@ -401,7 +522,7 @@ class MssqlDatabaseBackup(DatabaseBackup):
             args.append(MssqlScripterArguments.FILE_PER_OBJECT.value)
 
         if not path or path.strip() == '':
-            path = self._path
+            path = self.get_output_path()
         else:
             self.__create_path(path)
 
@@ -414,7 +535,8 @@ class MssqlDatabaseBackup(DatabaseBackup):
                                          object_type: MssqlScripterObjectType,
                                          is_script_drop_create: bool = True,
                                          is_file_per_object: bool = True,
-                                         include_objects: [] = None):
+                                         include_objects: [] = None,
+                                         is_raise_errors: bool = False):
         """
         Pass a specific object type (Enum) and script out those objects to the appropriate path
         Objects and their paths are defined in __sub_folders
@@ -432,9 +554,11 @@ class MssqlDatabaseBackup(DatabaseBackup):
 
         if not path:
             self.__logger.error('Unable to map path for object: {}'.format(object_type))
+            if is_raise_errors:
+                raise ValueError('Unable to map path for object: {}'.format(object_type))
             return
 
-        path = os.path.join(self.path, path)
+        path = os.path.join(self.get_output_path(), path)
 
         args = self.__get_mssqlscripter_args(is_add_default_options=True,
                                              is_script_drop_create=is_script_drop_create,
@@ -442,7 +566,7 @@ class MssqlDatabaseBackup(DatabaseBackup):
                                              file_path=path,
                                              include_types=object_type.value,
                                              include_objects=include_objects)
-        self.__do_mssqlscripter_action(args=args, is_include_default_options=True)
+        self.__do_mssqlscripter_action(args=args, is_include_default_options=True, is_raise_errors=is_raise_errors)
     def __get_sql_full_scripted_database(self):
         # path = '{}.{}'.format(self.__database.database, 'sql')
 
@@ -462,36 +586,12 @@ class MssqlDatabaseBackup(DatabaseBackup):
                                              is_append=False)
         return self.__do_mssqlscripter_action(args=args, is_include_default_options=True)
 
-    # TODO: when getting last run time, get the time and not just the date
-    def __get_last_run_time(self):
-        if not os.path.isfile(self.__get_log_name()):
-            return None
-
-        log_file = self.__get_log_name()
-
-        log_date = None
-        try:
-            with open(log_file, 'r') as f:
-                for line in f.readlines():
-                    if not line.find('mssql-scripter'):
-                        continue
-                    if log_date:
-                        break
-
-                    log_date = line.split(' ')[0]
-        except Exception as e:
-            self.__logger.error('Unable to parse date from log file {}:\n{}'.format(log_file, e))
-
-        return log_date
-
-    def __get_list_of_objects(self, from_date: str = None):
-        return self.__database.get_objects(from_date, as_dict=True)
-
     def script_other_objects(self,
                              path: str,
                              is_script_drop_create: bool = True,
                              is_file_per_object: bool = True,
-                             included_objects: [] = None):
+                             included_objects: [] = None,
+                             is_raise_errors: bool = False):
         """
         This scripts any object whose type is not defined in __sub_folders
 
@@ -508,7 +608,7 @@ class MssqlDatabaseBackup(DatabaseBackup):
             if not path:
                 raise ValueError('Path cannot be null for scripting other objects')
 
-            path = os.path.abspath(os.path.join(self._path, path))
+            path = os.path.abspath(os.path.join(self.get_output_path(), path))
 
             args = self.__get_mssqlscripter_args(file_path=path,
                                                  is_script_drop_create=is_script_drop_create,
@@ -521,25 +621,138 @@ class MssqlDatabaseBackup(DatabaseBackup):
                                                  is_schema_and_data=False,
                                                  is_append=False
                                                  )
-            self.__do_mssqlscripter_action(args=args, is_include_default_options=True)
+            self.__do_mssqlscripter_action(args=args, is_include_default_options=True, is_raise_errors=is_raise_errors)
         except Exception as e:
             self.__logger.error('Unable to script other objects: {}'.format(e))
+            if is_raise_errors:
+                raise e
 
     def script_objects_to_folders(self,
-                                  include_objects: [] = None):
+                                  include_objects: [] = None,
+                                  is_include_other_objects: bool = False,
+                                  max_concurrency: int = None):
         """
         For each path and object type in __sub_folders,
             script them to their folder
-
-        :return:
-        :rtype:
+        Each type is its own mssql-scripter process, and up to max_concurrency of them run at once
+        A long include_objects is split into MssqlScripterShards, with a process per type and shard
+
+        :param include_objects: only script these objects
+        :type include_objects: []
+        :param is_include_other_objects: also run script_other_objects() alongside the other types
+        :type is_include_other_objects: bool
+        :param max_concurrency: scripter processes at once. Defaults to the max_concurrency of the backup
+        :type max_concurrency: int
+        :return: seconds each run took, by folder (and shard)
+        :rtype: OrderedDict
+        :raises DatabaseBackupError: once every run has finished, if any of them failed
         """
         # TODO: Be able to script multiple types
+        shards = self.__get_object_shards(include_objects)
+
+        tasks = OrderedDict()
         for k, v in self.__sub_folders.items():
-            self.__script_objects_by_type_to_path(object_type=v,
-                                                  is_script_drop_create=True,
-                                                  is_file_per_object=True,
-                                                  include_objects=include_objects)
+            if self.is_native_scripter and k in self.__native_sub_folders:
+                continue
+
+            for i, shard in enumerate(shards, 1):
+                tasks[MssqlDatabaseBackup.__get_task_name(k, i, len(shards))] = partial(
+                    self.__script_objects_by_type_to_path,
+                    object_type=v,
+                    is_script_drop_create=True,
+                    is_file_per_object=True,
+                    include_objects=shard,
+                    is_raise_errors=True)
+
+        # NativeScripter doesn't go through the command line, so it takes the whole list
+        if self.is_native_scripter:
+            tasks['native'] = partial(self.__script_objects_natively, include_objects=include_objects)
+
+        if is_include_other_objects:
+            for i, shard in enumerate(shards, 1):
+                tasks[MssqlDatabaseBackup.__get_task_name(self.__path_for_other_objects, i, len(shards))] = partial(
+                    self.script_other_objects,
+                    path=self.__path_for_other_objects,
+                    included_objects=shard,
+                    is_raise_errors=True)
+
+        return self.__run_scripter_tasks(tasks, max_concurrency)
+
+    def __get_object_shards(self, include_objects: [] = None):
+        """
+        include_objects split so each scripter run's command line fits. See MssqlScripterShards
+
+        :return: lists of objects. [None] (one run of everything) without include_objects
+        :rtype: [[]]
+        """
+        if not include_objects:
+            return [None]
+
+        # Longest run without its objects: script_other_objects() excludes every type in __sub_folders.
+        # Every flag is counted, so the length is never under what a run uses
+        base_args = self.__get_default_mssqlscripter_args() + \
+            self.__default_mssqlscripter_options + \
+            [a.value for a in MssqlScripterArguments] + \
+            [os.path.join(self.get_output_path(), self.__path_for_other_objects)] + \
+            [v.value for v in self.__sub_folders.values()]
+
+        shards = MssqlScripterShards(max_workers=self.max_concurrency, logger=self.__logger)
+        return shards.get_shards(include_objects, MssqlScripterShards.get_command_length(base_args))
+
+    @staticmethod
+    def __get_task_name(name: str, shard_number: int, shard_count: int):
+        if shard_count == 1:
+            return name
+
+        return '{} ({} of {})'.format(name, shard_number, shard_count)
+
+    def __script_objects_natively(self, include_objects: [] = None):
+        scripter = self.__database.get_native_scripter(include_objects)
+        scripter.write_to_path(self.get_output_path(), include_objects, is_use_folders=True)
+
+    @staticmethod
+    def __run_timed(task):
+        start = time.monotonic()
+        try:
+            task()
+            return time.monotonic() - start, None
+        except Exception as e:
+            return time.monotonic() - start, e
+
+    def __run_scripter_tasks(self, tasks: OrderedDict, max_concurrency: int = None):
+        """
+        Run each task (a function with no arguments) in a pool of max_concurrency threads
+        Each one blocks on its own mssql-scripter process, so threads are enough
+        """
+        max_concurrency = max_concurrency if max_concurrency and max_concurrency > 0 else self.max_concurrency
+
+        timings = OrderedDict([(name, None) for name in tasks])
+        errors = OrderedDict()
+        start = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(tasks)))) as executor:
+            futures = {executor.submit(MssqlDatabaseBackup.__run_timed, task): name for name, task in tasks.items()}
+
+            for future in as_completed(futures):
+                name = futures[future]
+                elapsed, error = future.result()
+                timings[name] = elapsed
+
+                if error:
+                    errors[name] = error
+                    self.__logger.error('Scripting {} failed after {:.1f}s: {}'.format(name, elapsed, error))
+                else:
+                    self.__logger.info('Scripted {} in {:.1f}s'.format(name, elapsed))
+
+        self.last_timings = timings
+        self.__logger.info('Scripted {} object types in {:.1f}s ({} at a time)'.format(len(tasks),
+                                                                                      time.monotonic() - start,
+                                                                                      max_concurrency))
+
+        if errors:
+            raise DatabaseBackupError(errors)
+
+        return timings
 
     def do_full_backup(self,
                        is_changed_objects_only: bool = True,
@@ -547,23 +760,96 @@ class MssqlDatabaseBackup(DatabaseBackup):
         """
         1) Script out all object types in __sub_folders to their corresponding folder
         2) Script out all object types not defined in __sub_folders
+        Both run at the same time, up to max_concurrency scripter processes at once
+
+        With is_changed_objects_only, only objects that changed since the last successful backup
+        (by the manifest in the backup path) are scripted, and files of dropped objects are deleted
+
+        With is_content_store, scripts go to a staging folder and are then added to the store as a new run
 
         :return:
         :rtype:
         """
+        if self.is_content_store:
+            return self.__do_store_backup(is_changed_objects_only)
 
-        if is_changed_objects_only:
-            include_objects = self.get_changes_from_last_run()
-            if len(include_objects) > 0:
-                self.script_objects_to_folders(include_objects=include_objects)
-                self.script_other_objects(path=self.__path_for_other_objects, included_objects=include_objects)
-            else:
+        manifest, current, changed, dropped = self.__get_object_changes()
+
+        if is_changed_objects_only and not manifest.is_empty():
+            if changed:
+                self.__logger.info('Scripting {} changed objects'.format(len(changed)))
+                self.script_objects_to_folders(include_objects=[e['full_name'] for e in changed],
+                                               is_include_other_objects=True)
+
+            if dropped:
+                self.__delete_object_files(dropped)
+
+            if not changed and not dropped:
                 self.__logger.warning('No object changes')
         else:
-            self.script_objects_to_folders()
-            self.script_other_objects(path=self.__path_for_other_objects)
+            if is_changed_objects_only:
+                self.__logger.info('No backup manifest in {}. Doing a full backup'.format(self._path))
+
+            self.script_objects_to_folders(is_include_other_objects=True)
+
+        # Only after everything was scripted, so failed objects are picked up again next time
+        current.save()
+
+    def __do_store_backup(self, is_changed_objects_only: bool = True):
+        """
+        do_full_backup() into the BackupStore
+        An incremental run starts from the files of the last run, so only changed objects are scripted and stored
+        """
+        store = self.get_store()
+        last_run = store.get_run()
+        manifest, current, changed, dropped = self.__get_object_changes()
+
+        is_incremental = is_changed_objects_only and last_run and not manifest.is_empty()
+        if is_changed_objects_only and not is_incremental:
+            self.__logger.info('No earlier backup run in {}. Doing a full backup'.format(self._path))
+
+        if is_incremental and not changed and not dropped:
+            self.__logger.warning('No object changes')
+            current.save()
+            return
+
+        self.__output_path = store.create_staging_dir()
+        try:
+            if is_incremental:
+                if changed:
+                    self.__logger.info('Scripting {} changed objects'.format(len(changed)))
+                    self.script_objects_to_folders(include_objects=[e['full_name'] for e in changed],
+                                                   is_include_other_objects=True)
+            else:
+                self.script_objects_to_folders(is_include_other_objects=True)
+
+            staging_path = self.__output_path
+        except Exception:
+            shutil.rmtree(self.__output_path, ignore_errors=True)
+            raise
+        finally:
+            self.__output_path = None
+
+        store.ingest(staging_path,
+                     base_objects=last_run['objects'] if is_incremental else None,
+                     removed_patterns=[BackupManifest.get_file_name_pattern(e['full_name']) for e in dropped],
+                     info={
+                         'server': self.__database.server,
+                         'database': self.__database.database,
+                         'is_incremental': bool(is_incremental),
+                     })
+
+        current.save()
+
+    def get_script_objects(self, object_names: [], file_path: str=None, chunk_size: int=None):
+        """
+        Script object_names to file_path, one file per object, then combine them into one script
+        Long lists are split into shards of chunk_size objects, up to max_concurrency at a time
+        (see MssqlScripterShards)
 
-    def get_script_objects(self, object_names: [], file_path: str=None):
+        :param chunk_size: most objects per mssql-scripter run
+        :type chunk_size: int
+        """
         from StringUtil import StringUtil
         from DatabaseUtils import Database
         from DirectoryCollection import DirectoryCollection
@@ -579,10 +865,20 @@ class MssqlDatabaseBackup(DatabaseBackup):
                                              is_script_drop_create=True,
                                              is_file_per_object=True,
                                              file_path=file_path,
-                                             include_types=[],
-                                             include_objects=object_names)
-
-        self.__do_mssqlscripter_action(args=args, is_include_default_options=True)
+                                             include_types=[])
+        args.append(MssqlScripterArguments.INCLUDE_OBJECTS.value)
+
+        shards = MssqlScripterShards(chunk_size=chunk_size,
+                                     max_workers=self.max_concurrency,
+                                     logger=self.__logger)
+        base_length = MssqlScripterShards.get_command_length(self.__get_default_mssqlscripter_args() +
+                                                             self.__default_mssqlscripter_options +
+                                                             args)
+        shards.run(lambda shard: self.__do_mssqlscripter_action(args=args + shard,
+                                                                is_include_default_options=True,
+                                                                is_raise_errors=True),
+                   object_names,
+                   base_length)
 
         new_items_in_path = DirectoryCollection.get_files_and_hashes(file_path, False, True)
 
@@ -606,18 +902,78 @@ class MssqlDatabaseBackup(DatabaseBackup):
 
 
 
+    def __get_manifest_path(self):
+        return os.path.join(self._path, self.__manifest_file_name)
+
+    def __get_object_changes(self):
+        """
+        Diff the database against the manifest of the last successful backup
+
+        :return: (last manifest, current manifest, changed entries, dropped entries)
+        :rtype: tuple
+        """
+        path = self.__get_manifest_path()
+        manifest = BackupManifest.load(path, self.__database.server, self.__database.database, self.__logger)
+        current = BackupManifest.from_rows(path,
+                                           self.__database.server,
+                                           self.__database.database,
+                                           self.__database.get_object_states(),
+                                           self.__logger)
+
+        # Only objects whose modify_date moved since the last backup are hashed (none without a manifest)
+        to_hash = manifest.merge_definition_hashes(current)
+        if to_hash:
+            hashes = self.__database.get_definition_hashes([e['object_id'] for e in to_hash])
+            for entry in to_hash:
+                entry['definition_hash'] = hashes.get(entry['object_id'])
+
+        changed, dropped = manifest.get_delta(current)
+
+        return manifest, current, changed, dropped
+
     def get_changes_from_last_run(self):
-        o = self.__get_list_of_objects(self.__get_last_run_time())
-        changed_objects = []
-        for obj in o:
-            changed_objects.append(obj['FullName'])
+        """
+        :return: names of objects that are new or changed since the last successful backup
+        :rtype: []
+        """
+        _, _, changed, _ = self.__get_object_changes()
+
+        return [e['full_name'] for e in changed]
+
+    def __delete_object_files(self, dropped: []):
+        """
+        Delete the scripts of dropped objects from the backup folders
+        mssql-scripter names each file <schema>.<name>.<type>.sql
+        """
+        folders = list(self.__get_subfolders()) + [self.__path_for_other_objects]
+        for folder in folders:
+            path = os.path.join(self._path, folder)
+            if not os.path.isdir(path):
+                continue
 
-        return changed_objects
+            index = ScriptDirectoryIndex.get_index(path)
+            for e in dropped:
+                pattern = BackupManifest.get_file_name_pattern(e['full_name'])
+                for file_path in index.get_paths(e['full_name']):
+                    if pattern.match(os.path.basename(file_path)):
+                        self.__logger.info('Deleting script of dropped object: {}'.format(file_path))
+                        os.remove(file_path)
 
 
 
 
-    def get_scripted_database(self):
+    def get_scripted_database(self, archive: BackupArchive = None):
+        """
+        Script the whole database to one file, <database>.sql in the backup path,
+        or to a member of the same name in archive
+        The output is streamed from mssql-scripter, so the script is never held in memory
+
+        :param archive: open (writable) archive to script into
+        :type archive: BackupArchive
+        :return: path of the file, or name of the member in archive
+        :rtype: str
+        :raises Exception: if scripting fails. A partly written file is deleted
+        """
         args = self.__get_mssqlscripter_args(is_add_default_options=True,
                                              is_script_drop_create=True,
                                              is_file_per_object=False,
@@ -631,15 +987,65 @@ class MssqlDatabaseBackup(DatabaseBackup):
                                              is_data_only=False,
                                              is_schema_and_data=False,
                                              is_append=False)
-        script = self.__do_mssqlscripter_action(args=args, is_include_default_options=True).decode('ascii', 'ignore')
-        script = MssqlDatabase.remove_use_database_from_sql_script(script, self.__database.database)
-        path = os.path.join(self.path, '{}.{}'.format(self.__database.database, 'sql'))
-        print(path)
-        print(script)
+
+        use_database = re.compile(MssqlDatabase.get_use_database_pattern(self.__database.database).encode(),
+                                  re.IGNORECASE)
+        line_filter = lambda line: not use_database.match(line)
+
+        name = '{}.{}'.format(self.__database.database, 'sql')
+        path = None
         try:
-            with open(path, 'w+') as f:
-                f.write(script)
+            if archive:
+                with archive.open_member(name) as f:
+                    self.__stream_mssqlscripter_action(args, f, line_filter=line_filter)
+                return name
+
+            path = os.path.join(self.path, name)
+            with open(path, 'wb') as f:
+                self.__stream_mssqlscripter_action(args, f, line_filter=line_filter)
+            return path
         except Exception as e:
             self.__logger.error('Failed to create scripted database backup: {}'.format(e))
+            if path and os.path.isfile(path):
+                os.remove(path)
+            raise e
+
+    def write_archive(self, archive_path: str = None, is_include_scripted_database: bool = False):
+        """
+        Compress the backup into one zip file. See BackupArchive
+        Reads the latest run when the backup path is a BackupStore, otherwise the backup folders
+
+        :param archive_path: defaults to <backup path>.zip
+        :type archive_path: str
+        :param is_include_scripted_database: also stream the whole database, scripted as one file, into the archive
+        :type is_include_scripted_database: bool
+        :return: path of the archive
+        :rtype: str
+        :raises Exception: if anything can't be added. No archive is written then
+        """
+        archive_path = archive_path or '{}.zip'.format(self._path.rstrip(os.sep))
+        folders = list(self.__get_subfolders()) + [self.__path_for_other_objects]
+
+        tmp_path = '{}.tmp'.format(archive_path)
+        try:
+            with BackupArchive(tmp_path, logger=self.__logger).open('w') as archive:
+                if BackupStore.is_store(self._path):
+                    count = 0
+                    for name, content in self.get_store().iter_scripts(folders=folders):
+                        archive.add_bytes(name, content)
+                        count += 1
+                else:
+                    count = archive.add_folder(self._path, folders=folders)
+
+                if is_include_scripted_database:
+                    self.get_scripted_database(archive=archive)
+        except Exception:
+            # Don't leave half an archive behind
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            raise
 
+        os.replace(tmp_path, archive_path)
+        self.__logger.info('Wrote {} scripts to {}'.format(count, archive_path))
 
+        return archive_path
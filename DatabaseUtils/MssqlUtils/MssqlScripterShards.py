@@ -0,0 +1,163 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from platform import system as platform_system
+
+
+class MssqlScripterShards(object):
+    """
+    Splits a long --include-objects list into shards and runs one mssql-scripter process per shard
+
+    - A shard holds at most chunk_size objects, and never makes the command line longer than the OS allows
+    - Shards run at the same time, up to max_workers scripter processes at once
+    - Results come back in shard order, so merged output is the same every run
+    """
+
+    DEFAULT_CHUNK_SIZE = 200
+
+    # Used when the limit can't be read from the OS
+    __default_arg_max = 131072
+    # Left over for anything the OS adds to the command line
+    __arg_max_margin = 2048
+    # cmd.exe limit, and CreateProcess limit without the shell
+    __windows_shell_limit = 8191
+    __windows_limit = 32767
+
+    def __init__(self,
+                 chunk_size: int = None,
+                 max_workers: int = 4,
+                 is_shell: bool = None,
+                 logger: logging.Logger = None):
+        """
+        :param chunk_size: most objects per scripter run
+        :type chunk_size: int
+        :param max_workers: scripter processes run at once
+        :type max_workers: int
+        :param is_shell: whether the command goes through the shell. Defaults to True on Windows,
+            which is how MssqlDatabase runs mssql-scripter
+        :type is_shell: bool
+        """
+        self.chunk_size = chunk_size if chunk_size and chunk_size > 0 else MssqlScripterShards.DEFAULT_CHUNK_SIZE
+        self.max_workers = max_workers if max_workers and max_workers > 0 else 1
+        self.is_shell = MssqlScripterShards.is_windows() if is_shell is None else is_shell
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+    @staticmethod
+    def is_windows():
+        return platform_system().lower() == 'windows'
+
+    @staticmethod
+    def get_command_length_limit(is_shell: bool = False):
+        """
+        Longest command line (in characters) that can be run
+
+        :param is_shell: command is run through the shell (cmd.exe on Windows)
+        :type is_shell: bool
+        :return:
+        :rtype: int
+        """
+        if MssqlScripterShards.is_windows():
+            return MssqlScripterShards.__windows_shell_limit if is_shell else MssqlScripterShards.__windows_limit
+
+        try:
+            arg_max = os.sysconf('SC_ARG_MAX')
+        except (AttributeError, ValueError, OSError):
+            arg_max = -1
+
+        if not arg_max or arg_max <= 0:
+            arg_max = MssqlScripterShards.__default_arg_max
+
+        # The environment is passed in the same space as the arguments
+        env_length = sum([len(k) + len(v) + 2 for k, v in os.environ.items()])
+
+        return max(MssqlScripterShards.__arg_max_margin, arg_max - env_length - MssqlScripterShards.__arg_max_margin)
+
+    @staticmethod
+    def get_command_length(args: []):
+        """
+        Length of the command line for args, counting a space and quotes around each argument
+        """
+        if not args:
+            return 0
+
+        return sum([len(str(arg)) + 3 for arg in args])
+
+    def get_shards(self, objects: [], base_command_length: int = 0):
+        """
+        Split objects into lists of at most chunk_size objects that each fit on the command line
+
+        :param objects: object names
+        :type objects: []
+        :param base_command_length: length of the rest of the command. See get_command_length()
+        :type base_command_length: int
+        :return:
+        :rtype: [[]]
+        """
+        if not objects:
+            return []
+
+        available = MssqlScripterShards.get_command_length_limit(self.is_shell) - base_command_length
+
+        shards = []
+        shard = []
+        shard_length = 0
+
+        for obj in objects:
+            obj_length = MssqlScripterShards.get_command_length([obj])
+
+            if obj_length > available:
+                raise ValueError('Object name is too long for the command line: {}'.format(obj))
+
+            if shard and (len(shard) >= self.chunk_size or shard_length + obj_length > available):
+                shards.append(shard)
+                shard = []
+                shard_length = 0
+
+            shard.append(obj)
+            shard_length += obj_length
+
+        if shard:
+            shards.append(shard)
+
+        return shards
+
+    def run(self, run_shard, objects: [], base_command_length: int = 0):
+        """
+        Call run_shard(objects_in_shard) for every shard, max_workers at a time
+        Each call starts its own mssql-scripter process, so threads are enough to run them in parallel
+
+        :param run_shard: function that scripts a list of objects and returns the output
+        :type run_shard: callable
+        :param objects: object names
+        :type objects: []
+        :param base_command_length: length of the rest of the command. See get_command_length()
+        :type base_command_length: int
+        :return: output of each shard, in shard order
+        :rtype: []
+        """
+        shards = self.get_shards(objects, base_command_length)
+        if not shards:
+            return []
+
+        if len(shards) == 1:
+            return [run_shard(shards[0])]
+
+        self.logger.info('Scripting {} objects in {} shards, {} at a time'.format(len(objects),
+                                                                                   len(shards),
+                                                                                   self.max_workers))
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(shards))) as executor:
+            # map() returns results in the order of shards, whichever finishes first
+            return list(executor.map(run_shard, shards))
+
+    @staticmethod
+    def merge(results: []):
+        """
+        Join the output of each shard, in order. Empty results are skipped
+
+        :param results: output from run()
+        :type results: []
+        :return:
+        :rtype: bytes
+        """
+        return b'\n'.join([r.rstrip(b'\r\n') for r in results if r])
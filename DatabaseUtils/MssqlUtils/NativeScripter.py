@@ -0,0 +1,532 @@
+import json
+import logging
+import os
+from collections import OrderedDict
+
+from DatabaseUtils.MssqlUtils.SqlObjectType import MssqlScripterObjectType
+from DatabaseUtils.MssqlUtils.mssql_objects.MssqlObjects import Column, Table
+
+
+class MssqlCatalogSnapshot(object):
+    """
+    Everything NativeScripter needs from the catalog views, read with one set-based query per view
+    over a single pooled connection
+
+    Can be written to and read from JSON, so scripting can be tested against a recorded catalog
+    """
+
+    # {filter} is replaced with '1 = 1', or an object_id IN (...) filter on o
+    # Objects (and modules) include the triggers of the tables asked for
+    __queries = OrderedDict([
+        ('objects', ("""SELECT
+                            o.object_id
+                            ,schema_name = s.name
+                            ,o.name
+                            ,type = RTRIM(o.type)
+                            ,o.parent_object_id
+                        FROM sys.objects o
+                        JOIN sys.schemas s ON o.schema_id = s.schema_id
+                        WHERE
+                            o.is_ms_shipped = 0
+                            AND o.type IN ('U', 'V', 'P', 'FN', 'IF', 'TF', 'TR')
+                            AND {filter}
+                        ORDER BY
+                            o.object_id""", True)),
+        ('modules', ("""SELECT
+                            m.object_id
+                            ,m.definition
+                        FROM sys.sql_modules m
+                        JOIN sys.objects o ON m.object_id = o.object_id
+                        WHERE
+                            o.is_ms_shipped = 0
+                            AND {filter}
+                        ORDER BY
+                            m.object_id""", True)),
+        ('columns', ("""SELECT
+                            c.object_id
+                            ,c.column_id
+                            ,c.name
+                            ,type_name = t.name
+                            ,c.max_length
+                            ,c.precision
+                            ,c.scale
+                            ,c.is_nullable
+                            ,c.is_identity
+                            ,seed_value = CAST(ic.seed_value AS varchar(40))
+                            ,increment_value = CAST(ic.increment_value AS varchar(40))
+                            ,computed_definition = cc.definition
+                            ,is_persisted = ISNULL(cc.is_persisted, 0)
+                            ,default_name = dc.name
+                            ,default_definition = dc.definition
+                        FROM sys.columns c
+                        JOIN sys.objects o ON c.object_id = o.object_id
+                        JOIN sys.types t ON c.user_type_id = t.user_type_id
+                        LEFT JOIN sys.identity_columns ic ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+                        LEFT JOIN sys.computed_columns cc ON c.object_id = cc.object_id AND c.column_id = cc.column_id
+                        LEFT JOIN sys.default_constraints dc ON c.object_id = dc.parent_object_id
+                            AND c.column_id = dc.parent_column_id
+                        WHERE
+                            o.is_ms_shipped = 0
+                            AND o.type = 'U'
+                            AND {filter}
+                        ORDER BY
+                            c.object_id
+                            ,c.column_id""", False)),
+        ('indexes', ("""SELECT
+                            i.object_id
+                            ,i.index_id
+                            ,i.name
+                            ,i.type_desc
+                            ,i.is_primary_key
+                            ,i.is_unique_constraint
+                            ,i.is_unique
+                            ,i.filter_definition
+                            ,column_name = c.name
+                            ,ic.key_ordinal
+                            ,ic.is_descending_key
+                            ,ic.is_included_column
+                        FROM sys.indexes i
+                        JOIN sys.objects o ON i.object_id = o.object_id
+                        JOIN sys.index_columns ic ON i.object_id = ic.object_id AND i.index_id = ic.index_id
+                        JOIN sys.columns c ON ic.object_id = c.object_id AND ic.column_id = c.column_id
+                        WHERE
+                            o.is_ms_shipped = 0
+                            AND o.type = 'U'
+                            AND i.type > 0
+                            AND i.is_hypothetical = 0
+                            AND {filter}
+                        ORDER BY
+                            i.object_id
+                            ,i.index_id
+                            ,ic.is_included_column
+                            ,ic.key_ordinal
+                            ,ic.index_column_id""", False)),
+        ('foreign_keys', ("""SELECT
+                            object_id = fk.parent_object_id
+                            ,fk.name
+                            ,referenced_schema_name = SCHEMA_NAME(r.schema_id)
+                            ,referenced_table_name = r.name
+                            ,column_name = pc.name
+                            ,referenced_column_name = rc.name
+                            ,delete_action = fk.delete_referential_action_desc
+                            ,update_action = fk.update_referential_action_desc
+                            ,fk.is_disabled
+                        FROM sys.foreign_keys fk
+                        JOIN sys.objects o ON fk.parent_object_id = o.object_id
+                        JOIN sys.objects r ON fk.referenced_object_id = r.object_id
+                        JOIN sys.foreign_key_columns fkc ON fk.object_id = fkc.constraint_object_id
+                        JOIN sys.columns pc ON fkc.parent_object_id = pc.object_id AND fkc.parent_column_id = pc.column_id
+                        JOIN sys.columns rc ON fkc.referenced_object_id = rc.object_id
+                            AND fkc.referenced_column_id = rc.column_id
+                        WHERE
+                            o.is_ms_shipped = 0
+                            AND {filter}
+                        ORDER BY
+                            fk.parent_object_id
+                            ,fk.name
+                            ,fkc.constraint_column_id""", False)),
+        ('check_constraints', ("""SELECT
+                            object_id = cc.parent_object_id
+                            ,cc.name
+                            ,cc.definition
+                            ,cc.is_disabled
+                        FROM sys.check_constraints cc
+                        JOIN sys.objects o ON cc.parent_object_id = o.object_id
+                        WHERE
+                            o.is_ms_shipped = 0
+                            AND {filter}
+                        ORDER BY
+                            cc.parent_object_id
+                            ,cc.name""", False)),
+    ])
+
+    # SQL Server's limit is 2100 parameters, and objects/modules use each id twice
+    __max_ids_per_query = 1000
+
+    def __init__(self, result_sets: dict = None):
+        """
+        :param result_sets: name of each query (objects, modules, columns, ...) -> list of dict rows
+        :type result_sets: dict
+        """
+        self.result_sets = OrderedDict([(name, []) for name in self.__queries])
+        if result_sets:
+            for name, rows in result_sets.items():
+                self.result_sets[name] = list(rows)
+
+    def get_rows(self, name: str):
+        return self.result_sets.get(name, [])
+
+    @staticmethod
+    def read(database, object_ids: [] = None):
+        """
+        Read the catalog from the database
+
+        :param database: MssqlDatabase
+        :type database: MssqlDatabase
+        :param object_ids: only these objects (and the triggers on them). None for every object
+        :type object_ids: []
+        :return:
+        :rtype: MssqlCatalogSnapshot
+        """
+        queries = MssqlCatalogSnapshot.__queries
+
+        if object_ids is None:
+            return MssqlCatalogSnapshot(database.get_result_sets(OrderedDict(
+                [(name, (sql.format(filter='1 = 1'), None)) for name, (sql, _) in queries.items()])))
+
+        snapshot = MssqlCatalogSnapshot()
+        object_ids = [int(x) for x in object_ids]
+
+        for i in range(0, len(object_ids), MssqlCatalogSnapshot.__max_ids_per_query):
+            chunk = object_ids[i:i + MssqlCatalogSnapshot.__max_ids_per_query]
+            in_list = '({})'.format(', '.join(['?'] * len(chunk)))
+
+            chunk_queries = OrderedDict()
+            for name, (sql, is_include_children) in queries.items():
+                if is_include_children:
+                    sql_filter = '(o.object_id IN {0} OR o.parent_object_id IN {0})'.format(in_list)
+                    params = chunk + chunk
+                else:
+                    sql_filter = 'o.object_id IN {}'.format(in_list)
+                    params = chunk
+
+                chunk_queries[name] = (sql.format(filter=sql_filter), params)
+
+            for name, rows in database.get_result_sets(chunk_queries).items():
+                snapshot.result_sets[name] += rows
+
+        return snapshot
+
+    def save(self, path: str):
+        """
+        Record the snapshot as a JSON fixture
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.result_sets, f, indent=1, default=str)
+
+    @staticmethod
+    def load(path: str):
+        with open(path, 'r', encoding='utf-8') as f:
+            return MssqlCatalogSnapshot(json.load(f, object_pairs_hook=OrderedDict))
+
+
+class NativeScripter(object):
+    """
+    Scripts tables, views, functions, procedures and triggers in-process from a MssqlCatalogSnapshot,
+    instead of starting mssql-scripter
+
+    - Programmable objects are scripted from sys.sql_modules.definition
+    - Tables are built from sys.columns with Table/Column, plus their keys, indexes, constraints and triggers
+    - Files use the same folders and names as mssql-scripter (<schema>.<name>.<type>.sql)
+    Other object types (schemas, synonyms, types, ...) still need mssql-scripter
+    """
+
+    # sys.objects type -> (folder, mssql-scripter type name, DROP keyword)
+    __object_types = {
+        'U': ('tables', MssqlScripterObjectType.TABLE.value, 'TABLE'),
+        'V': ('views', MssqlScripterObjectType.VIEW.value, 'VIEW'),
+        'FN': ('functions', MssqlScripterObjectType.USER_DEFINED_FUNCTION.value, 'FUNCTION'),
+        'IF': ('functions', MssqlScripterObjectType.USER_DEFINED_FUNCTION.value, 'FUNCTION'),
+        'TF': ('functions', MssqlScripterObjectType.USER_DEFINED_FUNCTION.value, 'FUNCTION'),
+        'P': ('procedures', MssqlScripterObjectType.STORED_PROCEDURE.value, 'PROCEDURE'),
+        'TR': (None, 'Trigger', 'TRIGGER'),
+    }
+
+    def __init__(self,
+                 snapshot: MssqlCatalogSnapshot,
+                 database_name: str = None,
+                 is_script_drop_create: bool = True,
+                 is_check_for_existence: bool = True,
+                 logger: logging.Logger = None):
+        """
+        :param is_script_drop_create: drop each object before creating it
+        :type is_script_drop_create: bool
+        :param is_check_for_existence: only drop objects that exist
+        :type is_check_for_existence: bool
+        """
+        self.snapshot = snapshot
+        self.database_name = database_name
+        self.is_script_drop_create = is_script_drop_create
+        self.is_check_for_existence = is_check_for_existence
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self._objects = OrderedDict([(row['object_id'], row) for row in snapshot.get_rows('objects')])
+        self._definitions = dict([(row['object_id'], row['definition']) for row in snapshot.get_rows('modules')])
+        self._columns = NativeScripter.__group(snapshot.get_rows('columns'))
+        self._indexes = NativeScripter.__group(snapshot.get_rows('indexes'))
+        self._foreign_keys = NativeScripter.__group(snapshot.get_rows('foreign_keys'))
+        self._check_constraints = NativeScripter.__group(snapshot.get_rows('check_constraints'))
+        self._triggers = NativeScripter.__group([row for row in self._objects.values() if row['type'] == 'TR'],
+                                                key='parent_object_id')
+
+    @staticmethod
+    def __group(rows: [], key: str = 'object_id'):
+        grouped = OrderedDict()
+        for row in rows:
+            grouped.setdefault(row[key], []).append(row)
+        return grouped
+
+    @staticmethod
+    def quote_name(name: str):
+        return '[{}]'.format(str(name).replace(']', ']]'))
+
+    @staticmethod
+    def get_full_name(row: dict, is_quoted: bool = True):
+        if is_quoted:
+            return '{}.{}'.format(NativeScripter.quote_name(row['schema_name']), NativeScripter.quote_name(row['name']))
+
+        return '{}.{}'.format(row['schema_name'], row['name'])
+
+    @staticmethod
+    def get_type_sql(type_name: str, max_length: int, precision: int, scale: int):
+        """
+        [nvarchar](50), [decimal](18, 2), [int], ...
+        """
+        name = str(type_name).lower()
+        sql = NativeScripter.quote_name(type_name)
+
+        if name in ('varchar', 'char', 'varbinary', 'binary'):
+            return '{}({})'.format(sql, 'max' if max_length == -1 else max_length)
+        if name in ('nvarchar', 'nchar'):
+            return '{}({})'.format(sql, 'max' if max_length == -1 else max_length // 2)
+        if name in ('decimal', 'numeric'):
+            return '{}({}, {})'.format(sql, precision, scale)
+        if name in ('datetime2', 'time', 'datetimeoffset'):
+            return '{}({})'.format(sql, scale)
+
+        return sql
+
+    def __get_column(self, row: dict):
+        if row.get('computed_definition'):
+            sql = 'AS {}'.format(row['computed_definition'])
+            if row.get('is_persisted'):
+                sql += ' PERSISTED'
+            return Column(name=row['name'], sql=sql, is_nullable=True)
+
+        sql = NativeScripter.get_type_sql(row['type_name'], row['max_length'], row['precision'], row['scale'])
+
+        if row.get('is_identity'):
+            sql += ' IDENTITY({}, {})'.format(row.get('seed_value') or 1, row.get('increment_value') or 1)
+
+        if row.get('default_name'):
+            sql += ' CONSTRAINT {} DEFAULT {}'.format(NativeScripter.quote_name(row['default_name']),
+                                                      row['default_definition'])
+
+        return Column(name=row['name'], sql=sql, is_nullable=bool(row['is_nullable']))
+
+    def __get_drop_sql(self, row: dict):
+        full_name = NativeScripter.get_full_name(row)
+        drop_type = self.__object_types[row['type']][2]
+
+        if not self.is_check_for_existence:
+            return 'DROP {} {}'.format(drop_type, full_name)
+
+        return "IF OBJECT_ID(N'{}', N'{}') IS NOT NULL\n    DROP {} {}".format(full_name.replace("'", "''"),
+                                                                           row['type'],
+                                                                           drop_type,
+                                                                           full_name)
+
+    def __get_index_sql(self, table_name: str, rows: []):
+        index = rows[0]
+        name = NativeScripter.quote_name(index['name'])
+        index_type = index['type_desc']
+
+        keys = ['{} {}'.format(NativeScripter.quote_name(r['column_name']), 'DESC' if r['is_descending_key'] else 'ASC')
+                for r in rows if not r['is_included_column']]
+        included = [NativeScripter.quote_name(r['column_name']) for r in rows if r['is_included_column']]
+
+        if index['is_primary_key'] or index['is_unique_constraint']:
+            return 'ALTER TABLE {} ADD CONSTRAINT {} {} {} ({})'.format(
+                table_name,
+                name,
+                'PRIMARY KEY' if index['is_primary_key'] else 'UNIQUE',
+                index_type,
+                ', '.join(keys))
+
+        if index_type == 'CLUSTERED COLUMNSTORE':
+            return 'CREATE CLUSTERED COLUMNSTORE INDEX {} ON {}'.format(name, table_name)
+
+        if index_type == 'NONCLUSTERED COLUMNSTORE':
+            return 'CREATE NONCLUSTERED COLUMNSTORE INDEX {} ON {} ({})'.format(
+                name, table_name, ', '.join([NativeScripter.quote_name(r['column_name']) for r in rows]))
+
+        if index_type not in ('CLUSTERED', 'NONCLUSTERED'):
+            return '-- {} index {} is not scripted'.format(index_type, name)
+
+        sql = 'CREATE {}{} INDEX {} ON {} ({})'.format('UNIQUE ' if index['is_unique'] else '',
+                                                        index_type,
+                                                        name,
+                                                        table_name,
+                                                        ', '.join(keys))
+        if included:
+            sql += ' INCLUDE ({})'.format(', '.join(included))
+        if index.get('filter_definition'):
+            sql += ' WHERE {}'.format(index['filter_definition'])
+
+        return sql
+
+    @staticmethod
+    def __get_foreign_key_sql(table_name: str, rows: []):
+        fk = rows[0]
+        name = NativeScripter.quote_name(fk['name'])
+        sql = 'ALTER TABLE {} WITH {} ADD CONSTRAINT {} FOREIGN KEY ({}) REFERENCES {}.{} ({})'.format(
+            table_name,
+            'NOCHECK' if fk['is_disabled'] else 'CHECK',
+            name,
+            ', '.join([NativeScripter.quote_name(r['column_name']) for r in rows]),
+            NativeScripter.quote_name(fk['referenced_schema_name']),
+            NativeScripter.quote_name(fk['referenced_table_name']),
+            ', '.join([NativeScripter.quote_name(r['referenced_column_name']) for r in rows]))
+
+        for action, desc in (('DELETE', fk['delete_action']), ('UPDATE', fk['update_action'])):
+            if desc and desc != 'NO_ACTION':
+                sql += ' ON {} {}'.format(action, desc.replace('_', ' '))
+
+        if fk['is_disabled']:
+            sql += '\nGO\nALTER TABLE {} NOCHECK CONSTRAINT {}'.format(table_name, name)
+
+        return sql
+
+    def __get_table_statements(self, row: dict):
+        object_id = row['object_id']
+        table_name = NativeScripter.get_full_name(row)
+
+        table = Table(name=row['name'],
+                      schema=row['schema_name'],
+                      database=self.database_name,
+                      columns=[self.__get_column(c) for c in self._columns.get(object_id, [])])
+        statements = [table.get_sql_create_table()]
+
+        indexes = NativeScripter.__group(self._indexes.get(object_id, []), key='index_id')
+        for rows in indexes.values():
+            statements.append(self.__get_index_sql(table_name, rows))
+
+        foreign_keys = NativeScripter.__group(self._foreign_keys.get(object_id, []), key='name')
+        for rows in foreign_keys.values():
+            statements.append(NativeScripter.__get_foreign_key_sql(table_name, rows))
+
+        for check in self._check_constraints.get(object_id, []):
+            statements.append('ALTER TABLE {} WITH {} ADD CONSTRAINT {} CHECK {}'.format(
+                table_name,
+                'NOCHECK' if check['is_disabled'] else 'CHECK',
+                NativeScripter.quote_name(check['name']),
+                check['definition']))
+
+        for trigger in self._triggers.get(object_id, []):
+            definition = self._definitions.get(trigger['object_id'])
+            if definition:
+                statements.append(definition.strip())
+
+        return statements
+
+    def script_object(self, object_id: int):
+        """
+        :return: drop (if is_script_drop_create) and create script, with GO after each batch
+            None when the object isn't in the snapshot or can't be scripted
+        :rtype: str
+        """
+        row = self._objects.get(object_id)
+        if not row or row['type'] not in self.__object_types:
+            return
+
+        statements = []
+        if self.is_script_drop_create:
+            statements.append(self.__get_drop_sql(row))
+
+        if row['type'] == 'U':
+            statements += self.__get_table_statements(row)
+        else:
+            definition = self._definitions.get(object_id)
+            if not definition:
+                self.logger.warning('No definition for {} (encrypted?)'.format(NativeScripter.get_full_name(row)))
+                return
+            statements.append(definition.strip())
+
+        return ''.join(['{}\nGO\n'.format(s) for s in statements])
+
+    def get_objects(self):
+        """
+        Objects that are scripted to their own file, i.e. everything but triggers
+        """
+        return [row for row in self._objects.values() if row['type'] != 'TR']
+
+    def get_file_name(self, row: dict):
+        return '{}.{}.sql'.format(NativeScripter.get_full_name(row, is_quoted=False), self.__object_types[row['type']][1])
+
+    def get_folder(self, row: dict):
+        return self.__object_types[row['type']][0]
+
+    def script_objects(self, object_names: [] = None):
+        """
+        :param object_names: schema.name of the objects to script, in order. None for all of them
+        :type object_names: []
+        :return: schema.name -> script
+        :rtype: OrderedDict
+        """
+        rows = self.get_objects()
+
+        if object_names is not None:
+            # Imported here, as DatabaseUtils.Database imports this module
+            from DatabaseUtils.Database import MssqlDatabase
+
+            by_name = dict([(MssqlDatabase.get_unquoted_object_name(NativeScripter.get_full_name(row, is_quoted=False)),
+                             row)
+                            for row in rows])
+            rows = []
+            for name in object_names:
+                key = MssqlDatabase.get_unquoted_object_name(name)
+                if key in by_name:
+                    rows.append(by_name[key])
+                else:
+                    self.logger.warning('Unable to script {}. Not found'.format(name))
+
+        scripts = OrderedDict()
+        for row in rows:
+            script = self.script_object(row['object_id'])
+            if script:
+                scripts[NativeScripter.get_full_name(row, is_quoted=False)] = script
+
+        return scripts
+
+    def write_to_path(self,
+                      path: str,
+                      object_names: [] = None,
+                      is_use_folders: bool = True,
+                      is_file_per_object: bool = True):
+        """
+        Write the scripts to files
+
+        :param path: folder to write to. A file when is_file_per_object is False
+        :type path: str
+        :param object_names: schema.name of the objects to script. None for all of them
+        :type object_names: []
+        :param is_use_folders: put each object in its folder (tables, views, ...) like MssqlDatabaseBackup
+        :type is_use_folders: bool
+        :param is_file_per_object: one file per object, or every script in the file at path
+        :type is_file_per_object: bool
+        :return: paths written
+        :rtype: []
+        """
+        scripts = self.script_objects(object_names)
+
+        if not is_file_per_object:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(''.join(scripts.values()))
+            return [path]
+
+        rows = dict([(NativeScripter.get_full_name(row, is_quoted=False), row) for row in self.get_objects()])
+        paths = []
+
+        for name, script in scripts.items():
+            row = rows[name]
+            folder = os.path.join(path, self.get_folder(row)) if is_use_folders else path
+            os.makedirs(folder, exist_ok=True)
+
+            file_path = os.path.join(folder, self.get_file_name(row))
+            with open(file_path, 'w', encoding='utf-8') as f:
+                f.write(script)
+            paths.append(file_path)
+
+        self.logger.info('Scripted {} objects to {}'.format(len(paths), path))
+
+        return paths
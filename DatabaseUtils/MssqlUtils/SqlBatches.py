@@ -0,0 +1,129 @@
+import re
+from collections import namedtuple
+
+
+class SqlBatch(namedtuple('SqlBatch', ['sql', 'count', 'line'])):
+    """
+    One batch of a script: the SQL between two GO's, how many times to run it (GO n), and the line it starts on
+    """
+    __slots__ = ()
+
+
+class SqlBatchError(Exception):
+    """
+    A batch of a script failed. Everything before it ran; nothing after it did
+    """
+
+    def __init__(self, name: str, batch: SqlBatch, error: Exception):
+        self.name = name
+        self.batch = batch
+        self.error = error
+        super(SqlBatchError, self).__init__('Batch at line {} of {} failed: {}'.format(batch.line, name, error))
+
+
+class SqlBatches(object):
+    """
+    Splits T-SQL scripts into batches on GO, the way sqlcmd does
+
+    GO has to be alone on its line (optionally with a repeat count and a -- comment).
+    GO inside a block comment or a string literal that spans lines isn't a separator
+    """
+
+    __go = re.compile(r'^\s*go(?:\s+(\d+))?\s*(?:--.*)?$', re.IGNORECASE)
+
+    @staticmethod
+    def split(script: str):
+        """
+        :param script: T-SQL script
+        :type script: str
+        :return: non-empty batches, in order
+        :rtype: [SqlBatch]
+        """
+        if not script:
+            return []
+
+        batches = []
+        lines = []
+        start_line = 1
+        # What the previous line left open: None, "'", '"', ']' or '/*' (with nesting depth)
+        state = None
+        depth = 0
+
+        for i, line in enumerate(script.splitlines(), 1):
+            if state is None:
+                match = SqlBatches.__go.match(line)
+                if match:
+                    SqlBatches.__add_batch(batches, lines, int(match.group(1) or 1), start_line)
+                    lines = []
+                    start_line = i + 1
+                    continue
+
+            lines.append(line)
+            state, depth = SqlBatches.__get_state(line, state, depth)
+
+        SqlBatches.__add_batch(batches, lines, 1, start_line)
+
+        return batches
+
+    @staticmethod
+    def __add_batch(batches: [], lines: [], count: int, start_line: int):
+        sql = '\n'.join(lines)
+        if sql.strip() and count > 0:
+            batches.append(SqlBatch(sql=sql, count=count, line=start_line))
+
+    @staticmethod
+    def __get_state(line: str, state: str, depth: int):
+        """
+        Whether line ends inside a string, quoted name or block comment
+
+        :return: (state, block comment depth)
+        :rtype: tuple
+        """
+        i = 0
+        length = len(line)
+
+        while i < length:
+            c = line[i]
+            pair = line[i:i + 2]
+
+            if state == '/*':
+                if pair == '/*':
+                    depth += 1
+                    i += 2
+                    continue
+                if pair == '*/':
+                    depth -= 1
+                    i += 2
+                    if depth == 0:
+                        state = None
+                    continue
+            elif state in ("'", '"', ']'):
+                if c == state:
+                    # Doubled quote is an escaped quote
+                    if line[i + 1:i + 2] == state:
+                        i += 2
+                        continue
+                    state = None
+            elif pair == '--':
+                break
+            elif pair == '/*':
+                state = '/*'
+                depth = 1
+                i += 2
+                continue
+            elif c in ("'", '"'):
+                state = c
+            elif c == '[':
+                state = ']'
+
+            i += 1
+
+        return state, depth
+
+    @staticmethod
+    def read_file(path: str):
+        """
+        Batches of a script file. mssql-scripter's BOM is dropped
+        """
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            return SqlBatches.split(f.read())
@@ -4,19 +4,38 @@ import logging
 # from mssql_objects.MssqlObjects import Column
 from DatabaseUtils.MssqlUtils.mssql_objects.MssqlObjects import *
 from DatabaseUtils.MssqlUtils.Database import DatabaseBackupCollection
+from DatabaseUtils.MssqlUtils.BackupRunner import BackupRunner
 import argparse
 
 
 
-def do_database_backup():
-    for db_backup in Config.get_database_backups(logger=Config.get_logger()):
-        print(db_backup.get_changes_from_last_run())
-        db_backup.do_full_backup(is_changed_objects_only=False)
+def do_database_backup(max_workers: int = 4, max_per_server: int = 2, retries: int = 2):
+    logger = Config.get_logger()
+    runner = BackupRunner(Config.get_database_backups(logger=logger),
+                          max_workers=max_workers,
+                          max_per_server=max_per_server,
+                          retries=retries,
+                          is_changed_objects_only=False,
+                          logger=logger)
+    runner.run()
+    print(runner.get_summary())
+
+    return runner.results
 
 def get_arguments(args):
     parser = argparse.ArgumentParser(description='DatabaseUtils arguments')
     parser.add_argument('-s', '--server', help='Database host/server')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='Databases backed up at once')
+    parser.add_argument('--per-server', type=int, default=2, help='Databases backed up at once on one server')
+    parser.add_argument('-r', '--retries', type=int, default=2, help='Times a failed backup is tried again')
     options = parser.parse_args(args)
     return options
 
 if __name__ == '__main__':
+    import sys
+
+    options = get_arguments(sys.argv[1:])
+    results = do_database_backup(max_workers=options.workers,
+                                 max_per_server=options.per_server,
+                                 retries=options.retries)
+    sys.exit(0 if all(r.is_success for r in results) else 1)
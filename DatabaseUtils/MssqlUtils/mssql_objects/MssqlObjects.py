@@ -129,7 +129,7 @@ class SqlServerObject(DatabaseObject):
         if SqlServerObject.is_value_quoted(val):
             return val
         else:
-            return SqlServerObject.unquote_value(val)
+            return '[{}]'.format(val.strip().replace(']', ']]'))
 
     def get_object_full_name(self,
                              is_quoted: bool,
@@ -220,9 +220,9 @@ class Column(object):
         sql = '{} {}'.format(col_name, self.sql)
 
         if self.is_nullable:
-            return '{} NOT NULL'.format(sql)
-        else:
             return sql
+        else:
+            return '{} NOT NULL'.format(sql)
 
 
 class Table(SqlServerObject):
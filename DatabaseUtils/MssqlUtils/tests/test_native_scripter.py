@@ -0,0 +1,111 @@
+import os
+import tempfile
+import unittest
+
+from DatabaseUtils.MssqlUtils.NativeScripter import MssqlCatalogSnapshot, NativeScripter
+from DatabaseUtils.MssqlUtils.mssql_objects.MssqlObjects import Column
+
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'catalog_snapshot.json')
+
+
+class NativeScripterTest(unittest.TestCase):
+    """
+    Scripts the recorded catalog in fixtures/catalog_snapshot.json: a table (identity, defaults, primary key,
+    filtered index, check constraint), a view and a procedure
+    """
+
+    def setUp(self):
+        self.scripter = NativeScripter(MssqlCatalogSnapshot.load(FIXTURE_PATH))
+
+    def test_table(self):
+        self.assertEqual(self.scripter.script_objects()['dbo.Customer'],
+                         "IF OBJECT_ID(N'[dbo].[Customer]', N'U') IS NOT NULL\n"
+                         "    DROP TABLE [dbo].[Customer]\n"
+                         "GO\n"
+                         "CREATE TABLE [dbo].[Customer] (\n"
+                         "[CustomerId] [int] IDENTITY(1, 1) NOT NULL,\n"
+                         "[Name] [nvarchar](100) NOT NULL,\n"
+                         "[Email] [varchar](255),\n"
+                         "[Balance] [decimal](18, 2) CONSTRAINT [DF_Customer_Balance] DEFAULT ((0)) NOT NULL,\n"
+                         "[IsActive] [bit] CONSTRAINT [DF_Customer_IsActive] DEFAULT ((1)) NOT NULL,\n"
+                         "[CreatedAt] [datetime2](7)\n"
+                         ")\n"
+                         "GO\n"
+                         "ALTER TABLE [dbo].[Customer] ADD CONSTRAINT [PK_Customer] PRIMARY KEY CLUSTERED "
+                         "([CustomerId] ASC)\n"
+                         "GO\n"
+                         "CREATE UNIQUE NONCLUSTERED INDEX [IX_Customer_Email] ON [dbo].[Customer] ([Email] ASC) "
+                         "INCLUDE ([Name]) WHERE ([Email] IS NOT NULL)\n"
+                         "GO\n"
+                         "ALTER TABLE [dbo].[Customer] WITH CHECK ADD CONSTRAINT [CK_Customer_Balance] "
+                         "CHECK ([Balance]>=(0))\n"
+                         "GO\n")
+
+    def test_view(self):
+        self.assertEqual(self.scripter.script_objects()['dbo.ActiveCustomer'],
+                         "IF OBJECT_ID(N'[dbo].[ActiveCustomer]', N'V') IS NOT NULL\n"
+                         "    DROP VIEW [dbo].[ActiveCustomer]\n"
+                         "GO\n"
+                         "CREATE VIEW [dbo].[ActiveCustomer]\n"
+                         "AS\n"
+                         "SELECT CustomerId, Name\n"
+                         "FROM dbo.Customer\n"
+                         "WHERE IsActive = 1\n"
+                         "GO\n")
+
+    def test_procedure(self):
+        self.assertEqual(self.scripter.script_objects()['dbo.GetCustomer'],
+                         "IF OBJECT_ID(N'[dbo].[GetCustomer]', N'P') IS NOT NULL\n"
+                         "    DROP PROCEDURE [dbo].[GetCustomer]\n"
+                         "GO\n"
+                         "CREATE PROCEDURE [dbo].[GetCustomer]\n"
+                         "    @CustomerId int\n"
+                         "AS\n"
+                         "BEGIN\n"
+                         "    SET NOCOUNT ON;\n"
+                         "\n"
+                         "    SELECT CustomerId, Name, Email\n"
+                         "    FROM dbo.Customer\n"
+                         "    WHERE CustomerId = @CustomerId\n"
+                         "END\n"
+                         "GO\n")
+
+    def test_create_only(self):
+        scripter = NativeScripter(MssqlCatalogSnapshot.load(FIXTURE_PATH), is_script_drop_create=False)
+
+        self.assertTrue(scripter.script_objects()['dbo.ActiveCustomer'].startswith('CREATE VIEW'))
+
+    def test_write_to_path(self):
+        with tempfile.TemporaryDirectory() as path:
+            paths = self.scripter.write_to_path(path)
+
+            self.assertEqual(sorted([os.path.relpath(p, path) for p in paths]),
+                             [os.path.join('procedures', 'dbo.GetCustomer.StoredProcedure.sql'),
+                              os.path.join('tables', 'dbo.Customer.Table.sql'),
+                              os.path.join('views', 'dbo.ActiveCustomer.View.sql')])
+
+    def test_snapshot_round_trip(self):
+        snapshot = MssqlCatalogSnapshot.load(FIXTURE_PATH)
+
+        with tempfile.TemporaryDirectory() as path:
+            saved_path = os.path.join(path, 'snapshot.json')
+            snapshot.save(saved_path)
+
+            self.assertEqual(NativeScripter(MssqlCatalogSnapshot.load(saved_path)).script_objects(),
+                             self.scripter.script_objects())
+
+
+class ColumnTest(unittest.TestCase):
+
+    def test_nullable(self):
+        self.assertEqual(Column(name='Email', sql='[varchar](255)', is_nullable=True).get_sql(True),
+                         '[Email] [varchar](255)')
+
+    def test_not_nullable(self):
+        self.assertEqual(Column(name='Name', sql='[nvarchar](100)', is_nullable=False).get_sql(True),
+                         '[Name] [nvarchar](100) NOT NULL')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,364 @@
+import logging
+import os
+import sqlite3
+import threading
+from bisect import bisect_left, insort
+from collections import namedtuple
+from datetime import datetime, date
+
+
+class CatalogObject(namedtuple('CatalogObject', ['object_id', 'type', 'full_name', 'full_name_quoted', 'last_change_date'])):
+    """
+    One row of sys.objects, as returned by Database.get_objects()
+    """
+    __slots__ = ()
+
+    def to_dict(self):
+        """
+        Same keys as Database.get_objects(as_dict=True)
+        """
+        return {
+            'object_id': self.object_id,
+            'type': self.type,
+            'FullName': self.full_name,
+            'FullNameQuoted': self.full_name_quoted,
+            'LastChangeDate': self.last_change_date,
+        }
+
+
+class SchemaCatalog(object):
+    """
+    In-memory copy of a database's sys.objects, so existence checks and change queries don't go to the server
+
+    - Loaded once, then refresh() only pulls objects whose modify_date is >= the newest one already loaded
+      (plus a scan of object_ids to drop deleted objects)
+    - Indexed by full name (schema.name, see MssqlDatabase.get_unquoted_object_name()), quoted name ([schema].[name]),
+      type and last change date
+    - With a snapshot_path, it's saved to a SQLite file after every refresh that changed it, and loaded from there
+      on the next run, so the first refresh is incremental too
+    """
+
+    def __init__(self,
+                 database,
+                 snapshot_path: str = None,
+                 logger: logging.Logger = None):
+        """
+        :param database: MssqlDatabase to read sys.objects from
+        :type database: MssqlDatabase
+        :param snapshot_path: SQLite file the catalog is saved to and loaded from. None to keep it in memory only
+        :type snapshot_path: str
+        """
+        self.database = database
+        self.snapshot_path = os.path.abspath(snapshot_path) if snapshot_path else None
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self._lock = threading.RLock()
+        self.__clear()
+
+    def __clear(self):
+        self._objects = {}
+        self._by_name = {}
+        self._by_quoted_name = {}
+        self._by_type = {}
+        # (last_change_date, object_id), oldest first
+        self._by_change_date = []
+        self.last_snapshot = None
+        self.is_loaded = False
+
+    def __len__(self):
+        return len(self._objects)
+
+    def __contains__(self, name):
+        return self.is_exists(name)
+
+    @staticmethod
+    def get_catalog_object(row):
+        """
+        CatalogObject from a row of Database.get_objects()
+        """
+        return CatalogObject(object_id=int(row[0]),
+                             type=str(row[1]).strip() if row[1] is not None else None,
+                             full_name=row[2],
+                             full_name_quoted=row[3],
+                             last_change_date=row[4])
+
+    def __add(self, obj: CatalogObject):
+        self.__remove(obj.object_id)
+
+        self._objects[obj.object_id] = obj
+        self._by_name[self.database.get_unquoted_object_name(obj.full_name)] = obj
+        self._by_quoted_name[str(obj.full_name_quoted).strip().lower()] = obj
+        self._by_type.setdefault(obj.type, {})[obj.object_id] = obj
+
+        if obj.last_change_date is not None:
+            insort(self._by_change_date, (obj.last_change_date, obj.object_id))
+            if self.last_snapshot is None or obj.last_change_date > self.last_snapshot:
+                self.last_snapshot = obj.last_change_date
+
+    def __remove(self, object_id: int):
+        obj = self._objects.pop(object_id, None)
+        if not obj:
+            return
+
+        name_key = self.database.get_unquoted_object_name(obj.full_name)
+        if self._by_name.get(name_key) is obj:
+            del self._by_name[name_key]
+
+        quoted_key = str(obj.full_name_quoted).strip().lower()
+        if self._by_quoted_name.get(quoted_key) is obj:
+            del self._by_quoted_name[quoted_key]
+
+        self._by_type.get(obj.type, {}).pop(object_id, None)
+
+        if obj.last_change_date is not None:
+            i = bisect_left(self._by_change_date, (obj.last_change_date, object_id))
+            if i < len(self._by_change_date) and self._by_change_date[i] == (obj.last_change_date, object_id):
+                del self._by_change_date[i]
+
+    def refresh(self, is_full: bool = False):
+        """
+        Bring the catalog up to date with the database
+        The first refresh loads the snapshot file (if there is one) and then only reads what changed since
+        With a snapshot_path, the catalog is saved afterwards if anything changed or the file doesn't exist yet
+
+        :param is_full: reload every object
+        :type is_full: bool
+        :return: objects added or changed since the last refresh
+        :rtype: [CatalogObject]
+        """
+        with self._lock:
+            if not self.is_loaded and not is_full and self.snapshot_path:
+                self.load()
+
+            if is_full or not self.is_loaded or self.last_snapshot is None:
+                self.__clear()
+                changed = [SchemaCatalog.get_catalog_object(row) for row in self.database.get_objects()]
+                dropped = []
+            else:
+                changed = [SchemaCatalog.get_catalog_object(row)
+                           for row in self.database.get_objects_changed_since(self.last_snapshot)]
+
+                # Deletes don't show up by modify_date
+                object_ids = self.database.get_object_ids()
+                dropped = [object_id for object_id in self._objects if object_id not in object_ids]
+                for object_id in dropped:
+                    self.__remove(object_id)
+
+            # Objects at exactly last_snapshot are read again, so drop the ones that didn't change
+            changed = [obj for obj in changed if self._objects.get(obj.object_id) != obj]
+
+            for obj in changed:
+                self.__add(obj)
+
+            if self.is_loaded:
+                self.logger.info('Schema catalog refreshed: {} changed, {} dropped'.format(len(changed), len(dropped)))
+            else:
+                self.logger.info('Loaded {} objects into the schema catalog'.format(len(changed)))
+
+            self.is_loaded = True
+
+            if self.snapshot_path and (changed or dropped or not os.path.isfile(self.snapshot_path)):
+                try:
+                    self.save()
+                except (OSError, sqlite3.Error) as e:
+                    self.logger.warning('Unable to save schema catalog {}: {}'.format(self.snapshot_path, e))
+
+            return changed
+
+    def is_exists(self, name: str):
+        if not self.is_loaded:
+            self.refresh()
+
+        return self.database.get_unquoted_object_name(name) in self._by_name
+
+    def get_object(self, name: str):
+        """
+        :param name: schema.name or [schema].[name]
+        :type name: str
+        :return: None when it doesn't exist
+        :rtype: CatalogObject
+        """
+        if not self.is_loaded:
+            self.refresh()
+
+        return self._by_name.get(self.database.get_unquoted_object_name(name))
+
+    def get_object_by_quoted_name(self, name: str):
+        if not self.is_loaded:
+            self.refresh()
+
+        if not name:
+            return
+
+        return self._by_quoted_name.get(str(name).strip().lower())
+
+    def get_object_by_id(self, object_id: int):
+        if not self.is_loaded:
+            self.refresh()
+
+        return self._objects.get(object_id)
+
+    def get_names(self):
+        """
+        :return: schema.name (lowercase) of every object
+        :rtype: set
+        """
+        if not self.is_loaded:
+            self.refresh()
+
+        with self._lock:
+            return set(self._by_name.keys())
+
+    def get_objects(self, object_type: str = None):
+        """
+        :param object_type: sys.objects type, e.g. 'U', 'V', 'P'. None for all objects
+        :type object_type: str
+        :return:
+        :rtype: [CatalogObject]
+        """
+        if not self.is_loaded:
+            self.refresh()
+
+        with self._lock:
+            if object_type:
+                return list(self._by_type.get(str(object_type).strip().upper(), {}).values())
+
+            return list(self._objects.values())
+
+    def get_changed_since(self, since):
+        """
+        Objects created or modified on or after since, oldest first
+
+        :param since: datetime, date or ISO format string. None for all objects
+        :type since:
+        :return:
+        :rtype: [CatalogObject]
+        """
+        if not self.is_loaded:
+            self.refresh()
+
+        since = SchemaCatalog.get_datetime(since)
+
+        with self._lock:
+            if since is None:
+                keys = self._by_change_date
+            else:
+                keys = self._by_change_date[bisect_left(self._by_change_date, (since, -1)):]
+
+            return [self._objects[object_id] for _, object_id in keys]
+
+    def get_objects_not_found(self, objects: []):
+        """
+        :param objects: object names. Can be quoted with brackets
+        :type objects: []
+        :return: the names in objects that aren't in the catalog
+        :rtype: []
+        """
+        if not objects:
+            return []
+
+        if not self.is_loaded:
+            self.refresh()
+
+        return [o for o in objects if self.database.get_unquoted_object_name(o) not in self._by_name]
+
+    @staticmethod
+    def get_datetime(val):
+        if val is None or val == '':
+            return None
+        if isinstance(val, datetime):
+            return val
+        if isinstance(val, date):
+            return datetime(val.year, val.month, val.day)
+
+        return datetime.fromisoformat(str(val).strip())
+
+    def save(self, path: str = None):
+        """
+        Write the catalog to a SQLite file
+
+        :param path: defaults to snapshot_path
+        :type path: str
+        """
+        path = path or self.snapshot_path
+        if not path:
+            raise ValueError('Need a path to save the schema catalog to')
+
+        with self._lock:
+            rows = [(obj.object_id,
+                     obj.type,
+                     obj.full_name,
+                     obj.full_name_quoted,
+                     obj.last_change_date.isoformat() if obj.last_change_date is not None else None)
+                    for obj in self._objects.values()]
+            last_snapshot = self.last_snapshot.isoformat() if self.last_snapshot is not None else None
+
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute('DROP TABLE IF EXISTS catalog_objects')
+            conn.execute('DROP TABLE IF EXISTS catalog_info')
+            conn.execute("""CREATE TABLE catalog_objects (
+                                object_id INTEGER PRIMARY KEY
+                                ,type TEXT
+                                ,full_name TEXT
+                                ,full_name_quoted TEXT
+                                ,last_change_date TEXT
+                            )""")
+            conn.execute('CREATE TABLE catalog_info (name TEXT PRIMARY KEY, value TEXT)')
+            conn.executemany('INSERT INTO catalog_objects VALUES (?, ?, ?, ?, ?)', rows)
+            conn.executemany('INSERT INTO catalog_info VALUES (?, ?)',
+                             [('server', self.database.server),
+                              ('database', self.database.database),
+                              ('last_snapshot', last_snapshot)])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+
+    def load(self, path: str = None):
+        """
+        Read a catalog written by save()
+        Ignored if the file doesn't exist or was saved for another server/database
+
+        :param path: defaults to snapshot_path
+        :type path: str
+        :return: True if the catalog was loaded
+        :rtype: bool
+        """
+        path = path or self.snapshot_path
+        if not path or not os.path.isfile(path):
+            return False
+
+        conn = sqlite3.connect(path)
+        try:
+            info = dict(conn.execute('SELECT name, value FROM catalog_info').fetchall())
+            rows = conn.execute('SELECT * FROM catalog_objects').fetchall()
+        except sqlite3.Error as e:
+            self.logger.warning('Unable to read schema catalog {}: {}'.format(path, e))
+            return False
+        finally:
+            conn.close()
+
+        if str(info.get('server')).lower() != str(self.database.server).lower() \
+                or str(info.get('database')).lower() != str(self.database.database).lower():
+            self.logger.warning('Schema catalog {} is for another database. Ignoring it'.format(path))
+            return False
+
+        with self._lock:
+            self.__clear()
+            for row in rows:
+                self.__add(CatalogObject(object_id=row[0],
+                                         type=row[1],
+                                         full_name=row[2],
+                                         full_name_quoted=row[3],
+                                         last_change_date=SchemaCatalog.get_datetime(row[4])))
+
+            if info.get('last_snapshot'):
+                self.last_snapshot = SchemaCatalog.get_datetime(info['last_snapshot'])
+
+            self.is_loaded = True
+
+        self.logger.info('Loaded {} objects from schema catalog {}'.format(len(rows), path))
+        return True
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+class ObjectState(namedtuple('ObjectState', ['full_name', 'type', 'modify_date', 'hash'])):
+    """
+    A function, view or procedure as it is in one database. hash is of its normalized definition
+    """
+    __slots__ = ()
+
+
+class DefinitionHashCache(object):
+    """
+    Hash of each object's definition by (server, database, name, modify_date), so an object is only hashed again
+    once it changes
+
+    Kept in memory for the process (see get_cache()) and optionally saved to a JSON file between runs
+    """
+
+    __caches = {}
+    __caches_lock = threading.Lock()
+
+    def __init__(self, path: str = None, logger: logging.Logger = None):
+        """
+        :param path: JSON file the cache is saved to and loaded from. None to keep it in memory only
+        :type path: str
+        """
+        self.path = os.path.abspath(path) if path else None
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self._lock = threading.Lock()
+        # database key -> name key -> [modify_date, hash]
+        self._hashes = {}
+        self.is_changed = False
+
+        if self.path:
+            self.load()
+
+    @staticmethod
+    def get_cache(path: str = None):
+        """
+        Cache shared by every SchemaDiff in the process with the same path
+        """
+        key = os.path.abspath(path) if path else None
+
+        with DefinitionHashCache.__caches_lock:
+            cache = DefinitionHashCache.__caches.get(key)
+            if not cache:
+                cache = DefinitionHashCache(path)
+                DefinitionHashCache.__caches[key] = cache
+
+        return cache
+
+    @staticmethod
+    def get_database_key(database):
+        return '{}|{}'.format(str(database.server).strip().lower(), str(database.database).strip().lower())
+
+    @staticmethod
+    def get_modify_date(val):
+        if isinstance(val, datetime):
+            return val.isoformat()
+
+        return str(val) if val is not None else None
+
+    def get(self, database_key: str, name_key: str, modify_date):
+        """
+        :return: cached hash, None if the object isn't cached at this modify_date
+        :rtype: str
+        """
+        with self._lock:
+            cached = self._hashes.get(database_key, {}).get(name_key)
+
+        if cached and cached[0] == DefinitionHashCache.get_modify_date(modify_date):
+            return cached[1]
+
+    def set(self, database_key: str, name_key: str, modify_date, definition_hash: str):
+        with self._lock:
+            self._hashes.setdefault(database_key, {})[name_key] = [DefinitionHashCache.get_modify_date(modify_date),
+                                                                   definition_hash]
+            self.is_changed = True
+
+    def remove_missing(self, database_key: str, name_keys: set):
+        """
+        Forget objects of a database that aren't in name_keys anymore
+        """
+        with self._lock:
+            hashes = self._hashes.get(database_key, {})
+            for key in [k for k in hashes if k not in name_keys]:
+                del hashes[key]
+                self.is_changed = True
+
+    def load(self, path: str = None):
+        path = path or self.path
+        if not path or not os.path.isfile(path):
+            return False
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                hashes = json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning('Unable to read definition hash cache {}: {}'.format(path, e))
+            return False
+
+        with self._lock:
+            self._hashes = hashes
+            self.is_changed = False
+
+        return True
+
+    def save(self, path: str = None):
+        """
+        Write the cache. Written to a temp file first, so a failed save doesn't leave half a cache
+        """
+        path = path or self.path
+        if not path:
+            raise ValueError('Need a path to save the definition hash cache to')
+
+        with self._lock:
+            tmp_path = '{}.tmp'.format(path)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._hashes, f)
+            os.replace(tmp_path, path)
+            self.is_changed = False
+
+
+class SchemaDiff(object):
+    """
+    Which functions, views and procedures to create, modify or drop to make target match source
+
+    - Each database is read on its own (over its own connection pool, at the same time), so they can be
+      on different servers
+    - Only names and modify_dates are read every time. Definitions are only read and hashed for objects
+      that aren't in the DefinitionHashCache at their current modify_date
+    """
+
+    def __init__(self,
+                 source,
+                 target,
+                 cache_path: str = None,
+                 logger: logging.Logger = None):
+        """
+        :param source: database with the objects as they should be
+        :type source: Database
+        :param target: database to compare to source
+        :type target: Database
+        :param cache_path: JSON file to keep definition hashes in between runs. None to only keep them in memory
+        :type cache_path: str
+        """
+        self.source = source
+        self.target = target
+        self.cache = DefinitionHashCache.get_cache(cache_path)
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+    @staticmethod
+    def get_hash(definition: str):
+        """
+        SHA-256 of a definition, ignoring line breaks and leading/trailing whitespace
+        (same normalization as compare_objects_in_databases)
+        """
+        if definition is None:
+            return None
+
+        normalized = definition.strip().replace('\n', '').replace('\r', '')
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def get_states(self, database):
+        """
+        :return: name key -> ObjectState of every function, view and procedure in database
+        :rtype: dict
+        """
+        database_key = DefinitionHashCache.get_database_key(database)
+        rows = database.get_module_states()
+
+        states = {}
+        to_hash = {}
+
+        for row in rows:
+            object_id, object_type, full_name, modify_date = int(row[0]), str(row[1]).strip(), row[2], row[3]
+            key = database.get_unquoted_object_name(full_name)
+
+            definition_hash = self.cache.get(database_key, key, modify_date)
+            if definition_hash is None:
+                to_hash[object_id] = (key, full_name, object_type, modify_date)
+
+            states[key] = ObjectState(full_name=full_name,
+                                      type=object_type,
+                                      modify_date=modify_date,
+                                      hash=definition_hash)
+
+        if to_hash:
+            self.logger.info('Hashing {} of {} objects in {}'.format(len(to_hash), len(states), database.database))
+            definitions = database.get_module_definitions(list(to_hash.keys()))
+
+            for object_id, (key, full_name, object_type, modify_date) in to_hash.items():
+                definition_hash = SchemaDiff.get_hash(definitions.get(object_id))
+                states[key] = states[key]._replace(hash=definition_hash)
+                if definition_hash is not None:
+                    self.cache.set(database_key, key, modify_date, definition_hash)
+
+        self.cache.remove_missing(database_key, set(states.keys()))
+
+        return states
+
+    def compare(self):
+        """
+        :return: 'create' (only in source), 'modify' (definitions differ) and 'drop' (only in target),
+            each a list of ObjectState (from source for create/modify, target for drop) sorted by name
+        :rtype: OrderedDict
+        """
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            source_future = executor.submit(self.get_states, self.source)
+            target_future = executor.submit(self.get_states, self.target)
+            source_states = source_future.result()
+            target_states = target_future.result()
+
+        create = []
+        modify = []
+        for key in sorted(source_states):
+            state = source_states[key]
+            target_state = target_states.get(key)
+
+            if not target_state:
+                create.append(state)
+            elif state.hash != target_state.hash:
+                modify.append(state)
+
+        drop = [target_states[key] for key in sorted(target_states) if key not in source_states]
+
+        if self.cache.path and self.cache.is_changed:
+            self.cache.save()
+
+        self.logger.info('{} to create, {} to modify, {} to drop'.format(len(create), len(modify), len(drop)))
+
+        return OrderedDict([('create', create), ('modify', modify), ('drop', drop)])
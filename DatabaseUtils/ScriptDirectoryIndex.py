@@ -0,0 +1,134 @@
+import logging
+import os
+import threading
+
+from DatabaseUtils.Database import MssqlDatabase
+
+
+class ScriptDirectoryIndex(object):
+    """
+    Index of the .sql files in a folder of scripted objects, by object name
+
+    - mssql-scripter names files <schema>.<name>.<type>.sql, so each file is indexed under schema.name (lowercase)
+    - Built with one os.scandir, and only rebuilt when the folder's mtime changes (a file was added, removed or renamed)
+    - get_index() shares one index per folder, so deploy, diff and backup code don't each list the folder again
+    """
+
+    __indexes = {}
+    __indexes_lock = threading.Lock()
+
+    def __init__(self, path: str, logger: logging.Logger = None):
+        """
+        :param path: folder of scripts
+        :type path: str
+        """
+        if not path:
+            raise ValueError('Need a path for the script index')
+
+        self.path = os.path.abspath(path)
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+        self._lock = threading.RLock()
+        # name key -> file paths, sorted
+        self._files = {}
+        self._mtime_ns = None
+
+    @staticmethod
+    def get_index(path: str):
+        """
+        Shared index of path, brought up to date
+
+        :rtype: ScriptDirectoryIndex
+        """
+        key = os.path.normcase(os.path.abspath(path))
+
+        with ScriptDirectoryIndex.__indexes_lock:
+            index = ScriptDirectoryIndex.__indexes.get(key)
+            if not index:
+                index = ScriptDirectoryIndex(path)
+                ScriptDirectoryIndex.__indexes[key] = index
+
+        index.refresh()
+
+        return index
+
+    @staticmethod
+    def clear_indexes():
+        with ScriptDirectoryIndex.__indexes_lock:
+            ScriptDirectoryIndex.__indexes.clear()
+
+    @staticmethod
+    def get_file_key(file_name: str):
+        """
+        dbo.MyProc.StoredProcedure.sql -> dbo.myproc
+        """
+        return MssqlDatabase.get_unquoted_object_name('.'.join(os.path.basename(file_name).split('.')[0:2]))
+
+    def refresh(self, is_force: bool = False):
+        """
+        Rebuild the index if the folder changed since it was built
+
+        :return: True if it was rebuilt
+        :rtype: bool
+        """
+        with self._lock:
+            try:
+                mtime_ns = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                mtime_ns = None
+
+            if not is_force and self._mtime_ns is not None and mtime_ns == self._mtime_ns:
+                return False
+
+            files = {}
+            if mtime_ns is not None:
+                with os.scandir(self.path) as entries:
+                    for entry in entries:
+                        if entry.is_file() and entry.name.lower().endswith('.sql'):
+                            files.setdefault(ScriptDirectoryIndex.get_file_key(entry.name), []).append(entry.path)
+
+            for paths in files.values():
+                paths.sort()
+
+            self._files = files
+            self._mtime_ns = mtime_ns
+
+            return True
+
+    def __contains__(self, name):
+        return MssqlDatabase.get_unquoted_object_name(name) in self._files
+
+    def __len__(self):
+        return len(self._files)
+
+    def get_names(self):
+        """
+        :return: schema.name (lowercase) of every object with a file
+        :rtype: set
+        """
+        return set(self._files.keys())
+
+    def get_paths(self, name: str):
+        """
+        :param name: schema.name or [schema].[name]
+        :type name: str
+        :return: files of the object, empty if it has none
+        :rtype: []
+        """
+        return list(self._files.get(MssqlDatabase.get_unquoted_object_name(name), []))
+
+    def get_paths_for_objects(self, objects: []):
+        """
+        :return: files of each of objects, in the order of objects
+        :rtype: []
+        """
+        paths = []
+        seen = set()
+        for name in objects or []:
+            key = MssqlDatabase.get_unquoted_object_name(name)
+            if key in seen:
+                continue
+            seen.add(key)
+            paths += self._files.get(key, [])
+
+        return paths
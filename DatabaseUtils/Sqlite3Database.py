@@ -1,9 +1,10 @@
+import itertools
 import logging
 import os
 import sqlite3
 
-from . import Database
-from . import DatabaseType
+from DatabaseUtils.Database import Database
+from DatabaseUtils.DatabaseType import DatabaseType
 
 
 class Sqlite3Database(Database):
@@ -15,6 +16,12 @@ class Sqlite3Database(Database):
                  setup_scripts: [] = None,
                  is_force_new_initialization: bool = False):
         super(Sqlite3Database, self).__init__(database_type=DatabaseType.SQLITE3,
+                                              server=None,
+                                              database=database_path,
+                                              username=None,
+                                              password=None,
+                                              port=None,
+                                              local_path=None,
                                               logger=logger)
 
         self.database_path = database_path
@@ -102,6 +109,10 @@ class Sqlite3Database(Database):
     def get_conn(self):
         return sqlite3.connect(self.database_path)
 
+    def _connect(self):
+        # Pooled connections can be handed to different threads, one at a time
+        return sqlite3.connect(self.database_path, check_same_thread=False)
+
     def execute_sql_script(self, script_path: str):
         """
         Read a SQL script file and execute all commands
@@ -178,3 +189,44 @@ class Sqlite3Database(Database):
             return None
         finally:
             conn.close()
+
+    def execute_many(self, sql: str, rows, batch_size: int = 1000):
+        """
+        Same interface as MssqlDatabase.execute_many()
+        Execute a parameterized statement once for every row, committing every batch_size rows
+
+        :param sql: statement with ? placeholders
+        :type sql: str
+        :param rows: iterable of sequences of parameter values
+        :type rows:
+        :param batch_size: number of rows executed and committed at a time
+        :type batch_size: int
+        :return: number of rows executed
+        :rtype: int
+        """
+        if not sql:
+            return 0
+
+        if not batch_size or batch_size < 1:
+            batch_size = 1000
+
+        count = 0
+        rows = iter(rows)
+        conn = self.get_conn()
+        try:
+            cur = conn.cursor()
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+
+                cur.executemany(sql, batch)
+                conn.commit()
+                count += len(batch)
+        except sqlite3.Error as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+
+        return count
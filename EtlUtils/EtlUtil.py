@@ -1,14 +1,22 @@
 import os
 import csv
+import itertools
 import re
 import xlrd
 
+from concurrent.futures import ProcessPoolExecutor
+
 import TaskUtil
 
 from enum import Enum
 
 from StringUtil import StringUtil
 
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
 
 class EtlTask(TaskUtil.Task):
     pass
@@ -55,13 +63,38 @@ class SqlServerDataImport(DatabaseDataImport):
 
 
 class SqlBuilder(object):
+    # SQL Server does not allow more than 1000 rows in a single VALUES clause
+    MAX_INSERT_ROWS = 1000
+
+    # Doubles single quotes in one pass over the string
+    QUOTE_TRANSLATION = str.maketrans({"'": "''"})
+
+    # Chunks smaller than this aren't worth building a DataFrame for
+    VECTORIZED_MIN_ROWS = 500
+
+    # Values that can be written without quotes for a numeric column. Anything else is quoted,
+    # since types are only inferred from a sample and a later row can hold anything
+    INT_VALUE_REGEX = r'^[+-]?\d+$'
+    DECIMAL_VALUE_REGEX = r'^[+-]?(\d+\.?\d*|\.\d+)$'
+    __int_value_regex = re.compile(INT_VALUE_REGEX)
+    __decimal_value_regex = re.compile(DECIMAL_VALUE_REGEX)
+
     @staticmethod
     def create_table_from_header(
             table_name,
             database_name,
             header,
             schema_name='',
+            column_types: [] = None,
     ):
+        """
+        Description:
+            Returns the DROP/CREATE TABLE statement for the header
+        :param column_types: []
+            SQL type for each column in header (see ColumnTypeInference)
+            Every column is NVARCHAR(MAX) if not passed in
+        :return: str
+        """
 
         if not table_name.strip():
             return
@@ -82,8 +115,11 @@ class SqlBuilder(object):
         sql.append('CREATE TABLE {0} (\n'
                    '\t{1} INT PRIMARY KEY IDENTITY(1, 1)\n'.format(insert_name, id_name))
 
-        for col in header:
-            sql.append('\t,[{0}] {1}\n'.format(col, 'NVARCHAR(MAX)'))
+        for i, col in enumerate(header):
+            col_type = 'NVARCHAR(MAX)'
+            if column_types and i < len(column_types) and column_types[i]:
+                col_type = column_types[i]
+            sql.append('\t,[{0}] {1}\n'.format(col, col_type))
         sql.append(')\n')
 
         sql.append('\nGO\n')
@@ -120,7 +156,7 @@ class SqlBuilder(object):
                 return '\'\''
             return 'NULL'
 
-        val = re.sub("'", "''", val)
+        val = val.translate(SqlBuilder.QUOTE_TRANSLATION)
 
         # Don't need brackets for insert statements
         if is_quoted:
@@ -152,6 +188,123 @@ class SqlBuilder(object):
 
         return ''.join(sql)
 
+    @staticmethod
+    def is_unquoted_type(sql_type: str):
+        """
+        Description:
+            Whether values for a column of this SQL type are rendered without quotes
+        :return: bool
+        """
+        if not sql_type:
+            return False
+
+        return sql_type.strip().upper().split('(')[0] in ('INT', 'BIGINT', 'DECIMAL', 'BIT')
+
+    @staticmethod
+    def __get_unquoted_value(val: str, sql_type: str):
+        """
+        Description:
+            val without quotes if it's a valid value of sql_type, otherwise None
+        :return: str
+        """
+        val = val.strip()
+        sql_type = sql_type.strip().upper().split('(')[0]
+
+        if sql_type == 'BIT':
+            if val.lower() in ('1', 'true'):
+                return '1'
+            if val.lower() in ('0', 'false'):
+                return '0'
+            return None
+
+        if sql_type == 'DECIMAL':
+            return val if SqlBuilder.__decimal_value_regex.match(val) else None
+
+        return val if SqlBuilder.__int_value_regex.match(val) else None
+
+    @staticmethod
+    def escape_rows(rows: [], is_null_to_empty_string=False, column_types: [] = None):
+        """
+        Description:
+            Render the VALUES for a whole chunk of rows at once
+            Each item returned is the same as get_column_values(row, True) for that row
+            Empty rows (e.g. a blank line in a CSV) are skipped, so no INSERT is made for them
+            Uses pandas string methods column by column when pandas is installed and the chunk is big enough
+        :param rows: []
+            List of rows (lists of values)
+        :param is_null_to_empty_string: bool
+            Render empty values as '' instead of NULL
+        :param column_types: []
+            SQL type of each column. Numeric and BIT values are rendered without quotes
+        :return: []
+        """
+        if not rows:
+            return []
+
+        null_value = '\'\'' if is_null_to_empty_string else 'NULL'
+
+        if column_types and not any(SqlBuilder.is_unquoted_type(t) for t in column_types):
+            column_types = None
+
+        if pandas is not None and len(rows) >= SqlBuilder.VECTORIZED_MIN_ROWS:
+            width = len(rows[0])
+            if width and all(len(r) == width for r in rows):
+                return SqlBuilder.__escape_rows_vectorized(rows, null_value, column_types)
+
+        escaped = []
+        for row in rows:
+            if not row:
+                continue
+
+            vals = []
+            for i, val in enumerate(row):
+                val = str(val)
+                if not val.strip():
+                    vals.append(null_value)
+                else:
+                    unquoted = None
+                    if column_types and i < len(column_types) and SqlBuilder.is_unquoted_type(column_types[i]):
+                        unquoted = SqlBuilder.__get_unquoted_value(val, column_types[i])
+
+                    # Values that don't fit the column's type are quoted. SQL Server converts them if it can
+                    if unquoted is not None:
+                        vals.append(unquoted)
+                    else:
+                        vals.append('\'' + val.translate(SqlBuilder.QUOTE_TRANSLATION) + '\'')
+            escaped.append(' ' + ', '.join(vals))
+
+        return escaped
+
+    @staticmethod
+    def __escape_rows_vectorized(rows: [], null_value: str, column_types: [] = None):
+        frame = pandas.DataFrame(rows, dtype=object).astype(str)
+
+        rendered = None
+        for i, col in enumerate(frame.columns):
+            values = frame[col]
+            sql_type = column_types[i] if column_types and i < len(column_types) else None
+
+            escaped = '\'' + values.str.replace('\'', '\'\'', regex=False) + '\''
+            base_type = sql_type.strip().upper().split('(')[0] if sql_type else None
+
+            # Values that don't fit the column's type stay quoted
+            if base_type == 'BIT':
+                lowered = values.str.strip().str.lower()
+                escaped = escaped.where(~lowered.isin(['1', 'true']), '1')
+                escaped = escaped.where(~lowered.isin(['0', 'false']), '0')
+            elif base_type in ('INT', 'BIGINT', 'DECIMAL'):
+                stripped = values.str.strip()
+                regex = SqlBuilder.DECIMAL_VALUE_REGEX if base_type == 'DECIMAL' else SqlBuilder.INT_VALUE_REGEX
+                escaped = stripped.where(stripped.str.match(regex), escaped)
+            escaped = escaped.where(values.str.strip() != '', null_value)
+
+            if rendered is None:
+                rendered = ' ' + escaped
+            else:
+                rendered = rendered + ', ' + escaped
+
+        return rendered.tolist()
+
     # TODO: Get rid of appendGo - put this option in when building
     @staticmethod
     def create_insert_statement(tableName, database_name: str, colNames, insertVals, schema_name='', appendGo=True):
@@ -170,6 +323,233 @@ class SqlBuilder(object):
 
         return sql
 
+    @staticmethod
+    def get_insert_statement_prefix(tableName, database_name: str, colNames, schema_name=''):
+        """
+        Description:
+            Returns the start of an INSERT statement, up to the first value
+        :return: str
+        """
+        return 'INSERT INTO {0}.{1}.{2} (\n{3}\n)\nVALUES (\n'.format(database_name,
+                                                                    schema_name,
+                                                                    tableName,
+                                                                    SqlBuilder.get_column_values(colNames, False))
+
+    @staticmethod
+    def create_insert_statement_from_values(tableName, database_name: str, colNames, values: [], schema_name='',
+                                            appendGo=True, prefix: str = None):
+        """
+        Description:
+            Create one INSERT statement for many rows
+            Each item in values is a row that has already been rendered by get_column_values(row, True)
+            Raises ValueError if there are more rows than SQL Server allows in a single VALUES clause
+        :param prefix: str
+            get_insert_statement_prefix() for the table, when the caller already has it
+        :return: str
+        """
+        if len(values) > SqlBuilder.MAX_INSERT_ROWS:
+            raise ValueError('A single INSERT can have at most {0} rows, got {1}'.format(SqlBuilder.MAX_INSERT_ROWS,
+                                                                                        len(values)))
+
+        if prefix is None:
+            prefix = SqlBuilder.get_insert_statement_prefix(tableName, database_name, colNames, schema_name)
+
+        sql = '{0}{1}\n)\n'.format(prefix, '\n)\n,(\n'.join(values))
+
+        if appendGo:
+            sql = '{0}GO'.format(sql)
+
+        return sql
+
+    @staticmethod
+    def get_table_full_name(table_name, database_name: str = '', schema_name: str = ''):
+        """
+        Description:
+            Returns database.schema.table
+            If there is no database name, returns schema.table, or just the table name if there is no schema
+            (e.g. for SQLite)
+        :return: str
+        """
+        if database_name:
+            return '{0}.{1}.{2}'.format(database_name, schema_name, table_name)
+        if schema_name:
+            return '{0}.{1}'.format(schema_name, table_name)
+        return table_name
+
+    @staticmethod
+    def create_parameterized_insert_statement(tableName, database_name: str, colNames, schema_name=''):
+        """
+        Description:
+            Create an INSERT statement with a ? placeholder for every column
+            Used with executemany() so values don't need to be escaped or rendered into the SQL
+        :return: str
+        """
+        if type(colNames) == str:
+            colNames = (colNames,)
+
+        return 'INSERT INTO {0} ({1}) VALUES ({2})'.format(
+            SqlBuilder.get_table_full_name(tableName, database_name, schema_name),
+            SqlBuilder.get_column_values(colNames, False).strip(),
+            ', '.join(['?'] * len(colNames)))
+
+    @staticmethod
+    def create_multi_row_insert_statement(tableName, database_name: str, colNames, rows: [], schema_name='',
+                                          appendGo=True):
+        """
+        Description:
+            Create one INSERT statement with a VALUES row for each item in rows
+        :return: str
+        """
+        return SqlBuilder.create_insert_statement_from_values(tableName=tableName,
+                                                              database_name=database_name,
+                                                              colNames=colNames,
+                                                              values=[SqlBuilder.get_column_values(r, True)
+                                                                      for r in rows],
+                                                              schema_name=schema_name,
+                                                              appendGo=appendGo)
+
+
+class ColumnTypeInference(object):
+    """
+    Description:
+        Picks the narrowest SQL Server type for each column from the values seen in add_row()
+        Checked from narrowest to widest: BIT, INT, BIGINT, DECIMAL(p,s), DATE, DATETIME2, NVARCHAR(n)
+        Only text values of true/false make a BIT column; a column of only 0 and 1 is an INT
+    """
+    __int_regex = re.compile(r'^[+-]?\d+$')
+    __decimal_regex = re.compile(r'^[+-]?(\d*)\.(\d+)$')
+    __date_regex = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+    __datetime_regex = re.compile(r'^(\d{4}-\d{2}-\d{2})[ T](\d{2}:\d{2}(:\d{2})?)(\.\d{1,7})?$')
+
+    __int_max = 2 ** 31 - 1
+    __bigint_max = 2 ** 63 - 1
+    __decimal_max_precision = 38
+    __nvarchar_max_length = 4000
+
+    def __init__(self, column_count: int, is_sample: bool = True):
+        """
+        :param column_count: int
+            Number of columns in the header
+        :param is_sample: bool
+            Whether only a sample of the rows is being read
+            NVARCHAR lengths are doubled to leave room for longer values later in the data
+        """
+        self.column_count = column_count
+        self.is_sample = is_sample
+        self._columns = [{
+            'count': 0,
+            'max_length': 0,
+            'is_bit': True,
+            'is_bit_text': False,
+            'is_int': True,
+            'max_abs_int': 0,
+            'is_decimal': True,
+            'max_int_digits': 0,
+            'max_scale': 0,
+            'is_date': True,
+            'is_datetime': True,
+        } for _ in range(column_count)]
+
+    def add_row(self, row):
+        for i, val in enumerate(row):
+            if i >= self.column_count:
+                break
+            self.__add_value(self._columns[i], str(val).strip())
+
+    def __add_value(self, col: dict, val: str):
+        if not val:
+            return
+
+        col['count'] += 1
+        col['max_length'] = max(col['max_length'], len(val))
+
+        if col['is_bit']:
+            if val.lower() in ('true', 'false'):
+                col['is_bit_text'] = True
+            elif val not in ('0', '1'):
+                col['is_bit'] = False
+
+        if col['is_int']:
+            if ColumnTypeInference.__int_regex.match(val):
+                col['max_abs_int'] = max(col['max_abs_int'], abs(int(val)))
+            else:
+                col['is_int'] = False
+
+        if col['is_decimal']:
+            if ColumnTypeInference.__int_regex.match(val):
+                col['max_int_digits'] = max(col['max_int_digits'], len(val.lstrip('+-').lstrip('0')) or 1)
+            else:
+                match = ColumnTypeInference.__decimal_regex.match(val)
+                if match:
+                    col['max_int_digits'] = max(col['max_int_digits'], len(match.group(1).lstrip('0')) or 1)
+                    col['max_scale'] = max(col['max_scale'], len(match.group(2)))
+                else:
+                    col['is_decimal'] = False
+
+        if col['is_date']:
+            if not ColumnTypeInference.__date_regex.match(val) or not ColumnTypeInference.__is_valid_date(val):
+                col['is_date'] = False
+
+        if col['is_datetime']:
+            if ColumnTypeInference.__date_regex.match(val):
+                if not ColumnTypeInference.__is_valid_date(val):
+                    col['is_datetime'] = False
+            else:
+                match = ColumnTypeInference.__datetime_regex.match(val)
+                if not match or not ColumnTypeInference.__is_valid_date(match.group(1)):
+                    col['is_datetime'] = False
+
+    @staticmethod
+    def __is_valid_date(val: str):
+        from datetime import datetime
+
+        try:
+            datetime.strptime(val, '%Y-%m-%d')
+            return True
+        except ValueError:
+            return False
+
+    def __get_sql_type(self, col: dict):
+        if col['count'] == 0:
+            return 'NVARCHAR(MAX)'
+
+        if col['is_bit'] and col['is_bit_text']:
+            return 'BIT'
+
+        if col['is_int']:
+            if col['max_abs_int'] <= ColumnTypeInference.__int_max:
+                return 'INT'
+            if col['max_abs_int'] <= ColumnTypeInference.__bigint_max:
+                return 'BIGINT'
+
+        if col['is_decimal']:
+            precision = col['max_int_digits'] + col['max_scale']
+            if precision <= ColumnTypeInference.__decimal_max_precision:
+                return 'DECIMAL({0},{1})'.format(precision, col['max_scale'])
+
+        if col['is_date']:
+            return 'DATE'
+
+        if col['is_datetime']:
+            return 'DATETIME2'
+
+        length = col['max_length']
+        if self.is_sample:
+            length *= 2
+
+        if length > ColumnTypeInference.__nvarchar_max_length:
+            return 'NVARCHAR(MAX)'
+
+        return 'NVARCHAR({0})'.format(length)
+
+    def get_sql_types(self):
+        """
+        Description:
+            Returns the SQL type for each column, in order
+        :return: []
+        """
+        return [self.__get_sql_type(col) for col in self._columns]
+
 
 class DataImport(object):
     def __init__(self,
@@ -177,18 +557,109 @@ class DataImport(object):
                  schema_name: str,
                  table_name: str,
                  column_names: [],
-                 rows: [],
-                 is_row_contains_column_names: bool = False):
+                 rows,
+                 is_row_contains_column_names: bool = False,
+                 batch_size: int = 1000,
+                 rows_per_insert: int = 1,
+                 max_batch_size: int = None,
+                 is_infer_types: bool = False,
+                 type_inference_sample_size: int = 1000,
+                 column_types: [] = None):
+        """
+        :param rows: [] or callable
+            Either a list of rows or a callable that returns a new iterator of rows each time it's called
+            Pass a callable to stream the rows, so they are never all held in memory
+        :param batch_size: int
+            Number of rows turned into SQL at a time when streaming
+        :param rows_per_insert: int
+            Number of rows packed into a single INSERT statement (and GO batch)
+            Capped at SqlBuilder.MAX_INSERT_ROWS
+        :param max_batch_size: int
+            Max number of characters in the VALUES of a single INSERT statement
+            A statement is cut short when adding another row would go over this. None for no limit
+        :param is_infer_types: bool
+            Pick a SQL type for each column (see ColumnTypeInference) instead of NVARCHAR(MAX)
+            Numeric and BIT values are then inserted without quotes
+        :param type_inference_sample_size: int
+            Number of rows read to infer the types. None to read every row
+        :param column_types: []
+            SQL type of each column, when the types are already known. Takes the place of is_infer_types
+        """
         self.database_name = database_name
         self.schema_name = schema_name
         self.table_name = table_name
         self.column_names = column_names
+        self.batch_size = batch_size if batch_size and batch_size > 0 else 1000
+        self.rows_per_insert = min(max(rows_per_insert or 1, 1), SqlBuilder.MAX_INSERT_ROWS)
+        self.max_batch_size = max_batch_size
+        self._is_skip_first_row = False
+        self._insert_stmt_prefix = None
+        self.is_infer_types = is_infer_types
+        self.type_inference_sample_size = type_inference_sample_size
+        self._column_types = column_types
 
         if is_row_contains_column_names:
-            self.rows = rows[1:]
+            if callable(rows):
+                self._is_skip_first_row = True
+                self.rows = rows
+            else:
+                self.rows = rows[1:]
         else:
             self.rows = rows
 
+    def iter_rows(self):
+        """
+        Description:
+            Yields one row at a time
+            If rows is a callable, it is called to get a fresh iterator, so the rows can be read more than once
+        :return: generator
+        """
+        rows = iter(self.rows() if callable(self.rows) else self.rows)
+
+        if self._is_skip_first_row:
+            next(rows, None)
+
+        for r in rows:
+            yield r
+
+    def iter_row_batches(self):
+        """
+        Description:
+            Yields lists of at most batch_size rows
+        :return: generator
+        """
+        rows = self.iter_rows()
+        while True:
+            batch = list(itertools.islice(rows, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def get_column_types(self):
+        """
+        Description:
+            Returns the SQL type of each column
+            These are the column_types passed in, the inferred types if is_infer_types, or else None
+            Rows are only read for this the first time it's called
+        :return: []
+        """
+        if not self.is_infer_types:
+            return self._column_types
+
+        if self._column_types is None:
+            inference = ColumnTypeInference(column_count=len(self.column_names),
+                                            is_sample=bool(self.type_inference_sample_size))
+            rows = self.iter_rows()
+            if self.type_inference_sample_size:
+                rows = itertools.islice(rows, self.type_inference_sample_size)
+
+            for r in rows:
+                inference.add_row(r)
+
+            self._column_types = inference.get_sql_types()
+
+        return self._column_types
+
     def generate_sql_options(self):
         return 'SET NOCOUNT ON;\n\n'
 
@@ -201,23 +672,110 @@ class DataImport(object):
         return SqlBuilder.create_table_from_header(table_name=self.table_name,
                                                    database_name=self.database_name,
                                                    header=self.column_names,
-                                                   schema_name=self.schema_name)
+                                                   schema_name=self.schema_name,
+                                                   column_types=self.get_column_types())
+
+    def get_insert_stmt_prefix(self):
+        """
+        Description:
+            Returns the start of every INSERT statement, up to the first value
+            The column list never changes, so it's only rendered once
+        :return: str
+        """
+        if self._insert_stmt_prefix is None:
+            self._insert_stmt_prefix = SqlBuilder.get_insert_statement_prefix(tableName=self.table_name,
+                                                                              database_name=self.database_name,
+                                                                              colNames=self.column_names,
+                                                                              schema_name=self.schema_name)
+
+        return self._insert_stmt_prefix
+
+    def __get_insert_stmt(self, values: []):
+        return '{0}\n'.format(SqlBuilder.create_insert_statement_from_values(tableName=self.table_name,
+                                                                             database_name=self.database_name,
+                                                                             colNames=self.column_names,
+                                                                             values=values,
+                                                                             schema_name=self.schema_name,
+                                                                             prefix=self.get_insert_stmt_prefix()))
+
+    def generate_sql_insert_stmt(self, row):
+        """
+        Description:
+            Returns the SQL insert statement for a single row
+        :return: str
+        """
+        values = SqlBuilder.escape_rows([row], column_types=self.get_column_types())
+        if not values:
+            return ''
+
+        return self.__get_insert_stmt(values)
+
+    def iter_escaped_rows(self):
+        """
+        Description:
+            Yields the rendered VALUES of each row
+            Rows are escaped batch_size at a time with SqlBuilder.escape_rows()
+        :return: generator
+        """
+        for batch in self.iter_row_batches():
+            for val in SqlBuilder.escape_rows(batch, column_types=self.get_column_types()):
+                yield val
+
+    def iter_multi_row_insert_stmts(self):
+        """
+        Description:
+            Yields INSERT statements that each hold up to rows_per_insert rows, followed by GO
+            A statement is also ended early if its VALUES would go over max_batch_size characters
+        :return: generator
+        """
+        values = []
+        values_size = 0
+
+        for val in self.iter_escaped_rows():
+            if values and self.max_batch_size and values_size + len(val) > self.max_batch_size:
+                yield self.__get_insert_stmt(values)
+                values = []
+                values_size = 0
+
+            values.append(val)
+            values_size += len(val)
+
+            if len(values) >= self.rows_per_insert:
+                yield self.__get_insert_stmt(values)
+                values = []
+                values_size = 0
+
+        if values:
+            yield self.__get_insert_stmt(values)
 
     def generate_sql_insert_stmts_list(self):
         """
         Description:
             Returns list of SQL insert statements
+            If rows_per_insert > 1, each statement holds multiple rows
         :return: []
         """
-        stmts = []
-        for r in self.rows:
-            stmts.append('{0}{1}'.format(SqlBuilder.create_insert_statement(tableName=self.table_name,
-                                                                            database_name=self.database_name,
-                                                                            colNames=self.column_names,
-                                                                            insertVals=r,
-                                                                            schema_name=self.schema_name),
-                                         '\n'))
-        return stmts
+        if self.rows_per_insert > 1:
+            return list(self.iter_multi_row_insert_stmts())
+
+        return [self.__get_insert_stmt([val]) for val in self.iter_escaped_rows()]
+
+    def iter_sql_insert_stmts(self):
+        """
+        Description:
+            Yields one string of SQL insert statements per batch of rows
+            Only batch_size rows are held in memory at a time
+            If rows_per_insert > 1, yields one multi-row INSERT statement at a time
+        :return: generator
+        """
+        if self.rows_per_insert > 1:
+            for s in self.iter_multi_row_insert_stmts():
+                yield s
+            return
+
+        for batch in self.iter_row_batches():
+            yield ''.join([self.__get_insert_stmt([val])
+                           for val in SqlBuilder.escape_rows(batch, column_types=self.get_column_types())])
 
     def generate_all_sql(self):
         """
@@ -231,6 +789,62 @@ class DataImport(object):
 
         return sql
 
+    def iter_all_sql(self):
+        """
+        Description:
+            Same as generate_all_sql(), but yields the SQL chunk by chunk instead of building a list
+        :return: generator
+        """
+        yield self.generate_sql_options()
+        yield self.generate_sql_create_table_stmt()
+        for s in self.iter_sql_insert_stmts():
+            yield s
+
+    @staticmethod
+    def get_parameter_values(row):
+        """
+        Description:
+            Convert a row to the values passed as parameters when loading straight into a database
+            Empty values become None (NULL), the same as when generating INSERT statements
+        :return: []
+        """
+        return [None if val is None or not str(val).strip() else str(val) for val in row]
+
+    def load_to_database(self,
+                         database,
+                         batch_size: int = None,
+                         is_create_table: bool = False):
+        """
+        Description:
+            Insert the rows straight into a database with parameterized executemany()
+            No SQL text is rendered for the values
+        :param database: MssqlDatabase or Sqlite3Database
+            Anything with execute_many(sql, rows, batch_size)
+            For SQLite, use an empty database_name so the table name isn't prefixed with it
+        :param batch_size: int
+            Rows sent and committed at a time. Defaults to self.batch_size
+        :param is_create_table: bool
+            Runs the CREATE TABLE statement first. The generated DDL is for SQL Server only
+        :return: int
+            Number of rows loaded
+        """
+        if not database:
+            raise ValueError('Need a database to load into')
+
+        if is_create_table:
+            for sql in self.generate_sql_create_table_stmt().split('\nGO\n'):
+                if sql.strip():
+                    database.execute_sql(sql)
+
+        sql = SqlBuilder.create_parameterized_insert_statement(tableName=self.table_name,
+                                                               database_name=self.database_name,
+                                                               colNames=self.column_names,
+                                                               schema_name=self.schema_name)
+
+        return database.execute_many(sql,
+                                     (DataImport.get_parameter_values(r) for r in self.iter_rows()),
+                                     batch_size or self.batch_size)
+
     def write_output_file(self, output_name: str = None):
         if not output_name or not output_name.strip():
             output_name = '{0}.sql'.format(self.table_name)
@@ -238,7 +852,7 @@ class DataImport(object):
         with open(output_name, 'w') as f:
             f.write(self.generate_sql_options())
             f.write(self.generate_sql_create_table_stmt())
-            for s in self.generate_sql_insert_stmts_list():
+            for s in self.iter_sql_insert_stmts():
                 try:
                     f.write(s)
                 except Exception as e:
@@ -251,7 +865,28 @@ class CsvImport(object):
                  database_name: str,
                  schema_name: str = '',
                  table_name: str = '',
+                 is_streaming: bool = False,
+                 batch_size: int = 1000,
+                 rows_per_insert: int = 1,
+                 max_batch_size: int = None,
+                 is_infer_types: bool = False,
+                 type_inference_sample_size: int = 1000
                  ):
+        """
+        :param is_streaming: bool
+            If True, the CSV is read lazily every time SQL is generated instead of being loaded into memory
+            Peak memory is then bounded by batch_size and not by the size of the file
+        :param batch_size: int
+            Number of rows turned into SQL at a time
+        :param rows_per_insert: int
+            Number of rows packed into each INSERT statement. See DataImport
+        :param max_batch_size: int
+            Max number of characters in the VALUES of each INSERT statement. See DataImport
+        :param is_infer_types: bool
+            Pick a SQL type for each column instead of NVARCHAR(MAX). See DataImport
+        :param type_inference_sample_size: int
+            Number of rows read to infer the types. None to read every row
+        """
 
         if not table_name or not table_name.strip():
             self.table_name = os.path.basename(filename).split('.')[0]
@@ -260,10 +895,16 @@ class CsvImport(object):
 
         self.filename = filename
         self.database_name = database_name
+        self.is_streaming = is_streaming
+        self.batch_size = batch_size
+        self.rows_per_insert = rows_per_insert
+        self.max_batch_size = max_batch_size
+        self.is_infer_types = is_infer_types
+        self.type_inference_sample_size = type_inference_sample_size
 
         if not schema_name:
             schema_name = ''
-            self.schema_name = schema_name
+        self.schema_name = schema_name
 
         if not self.table_name:
             self.table_name = ''
@@ -273,38 +914,71 @@ class CsvImport(object):
     def get_all_sql(self):
         return self.data_import.generate_all_sql()
 
+    def iter_all_sql(self):
+        return self.data_import.iter_all_sql()
+
     def get_sql_insert_stmts_list(self):
         return self.data_import.generate_sql_insert_stmts_list()
 
+    def iter_sql_insert_stmts(self):
+        return self.data_import.iter_sql_insert_stmts()
+
     def get_sql_create_table_stmt(self):
         return self.data_import.generate_sql_create_table_stmt()
 
     def write_output_file(self, output_name: str = None):
         self.data_import.write_output_file(output_name)
 
-    def __get_data_import(self):
+    def load_to_database(self, database, batch_size: int = None, is_create_table: bool = False):
+        return self.data_import.load_to_database(database, batch_size, is_create_table)
+
+    def __get_column_names(self):
+        # TODO: Encoding
+        with open(self.filename, 'r', encoding='latin-1') as f:
+            csv_file = csv.reader(f)
+            try:
+                return next(csv_file)
+            except UnicodeDecodeError:
+                return next([StringUtil.encodingConvertUnicode(str(x)) for x in csv_file])
+
+    def __iter_rows(self):
         """
         Description:
-            Create DataImport class for SQL statements
-        :return:
+            Yields every row after the header
+            Opens the file each time it's called, so only one row is read into memory at a time
+        :return: generator
         """
-        rows = []
         # TODO: Encoding
         with open(self.filename, 'r', encoding='latin-1') as f:
             csv_file = csv.reader(f)
-            try:
-                col_names = next(csv_file)
-            except UnicodeDecodeError:
-                col_names = next([StringUtil.encodingConvertUnicode(str(x)) for x in csv_file])
+            next(csv_file, None)
 
             for r in csv_file:
-                rows.append([str(x) for x in r])
+                yield [str(x) for x in r]
+
+    def __get_data_import(self):
+        """
+        Description:
+            Create DataImport class for SQL statements
+        :return:
+        """
+        col_names = self.__get_column_names()
+
+        if self.is_streaming:
+            rows = self.__iter_rows
+        else:
+            rows = list(self.__iter_rows())
 
         return DataImport(database_name=self.database_name,
                           schema_name=self.schema_name,
                           table_name=self.table_name,
                           column_names=col_names,
-                          rows=rows
+                          rows=rows,
+                          batch_size=self.batch_size,
+                          rows_per_insert=self.rows_per_insert,
+                          max_batch_size=self.max_batch_size,
+                          is_infer_types=self.is_infer_types,
+                          type_inference_sample_size=self.type_inference_sample_size
                           )
 
     def __create_sql(self):
@@ -333,28 +1007,71 @@ class ExcelImport(object):
                  filename: str,
                  database_name: str,
                  schema_name: str = '',
-                 table_name: str = ''
+                 table_name: str = '',
+                 rows_per_insert: int = 1,
+                 max_batch_size: int = None,
+                 is_parallel: bool = False,
+                 max_workers: int = None,
+                 is_infer_types: bool = False,
+                 type_inference_sample_size: int = 1000
                  ):
+        """
+        :param rows_per_insert: int
+            Number of rows packed into each INSERT statement. See DataImport
+        :param max_batch_size: int
+            Max number of characters in the VALUES of each INSERT statement. See DataImport
+        :param is_parallel: bool
+            Read the worksheets and write their .sql files in a process pool
+            Imports and output files are always in the same order as the worksheets
+        :param max_workers: int
+            Number of processes when is_parallel. Defaults to the number of CPUs
+        :param is_infer_types: bool
+            Pick a SQL type for each column instead of NVARCHAR(MAX). See DataImport
+        :param type_inference_sample_size: int
+            Number of rows read to infer the types. None to read every row
+        """
         if not table_name or not table_name.strip():
             self.base_table_name = os.path.basename(filename).split('.')[0]
         else:
             self.base_table_name = table_name
 
+        self.filename = filename
         self.schema_name = schema_name
         self.database_name = database_name
+        self.rows_per_insert = rows_per_insert
+        self.max_batch_size = max_batch_size
+        self.is_parallel = is_parallel
+        self.max_workers = max_workers
+        self.is_infer_types = is_infer_types
+        self.type_inference_sample_size = type_inference_sample_size
 
-        self.workbook = xlrd.open_workbook(filename)
+        # Sheets are loaded by the worker processes when running in parallel
+        self.workbook = xlrd.open_workbook(filename, on_demand=is_parallel)
 
         self.imports = []
 
         self.__all_sheets_to_imports()
 
     def write_output_files(self, path: str):
+        """
+        Description:
+            Write a .sql file per worksheet, named after its table
+        :return: list
+            Paths of the files written, in the order of the worksheets
+        """
         if path and os.path.isdir(path):
             os.chdir(path)
 
-        for imp in self.imports:
-            imp.write_output_file()
+        output_names = [os.path.abspath('{0}.sql'.format(imp.table_name)) for imp in self.imports]
+
+        if not self.is_parallel:
+            for imp, output_name in zip(self.imports, output_names):
+                imp.write_output_file(output_name)
+            return output_names
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            # list() waits for every file, and raises the first error
+            return list(executor.map(ExcelImport._write_output_file, self.imports, output_names))
 
     def get_all_sql(self):
         sql = []
@@ -363,6 +1080,19 @@ class ExcelImport(object):
 
         return sql
 
+    def load_to_database(self, database, batch_size: int = None, is_create_table: bool = False):
+        """
+        Description:
+            Load every sheet straight into the database. See DataImport.load_to_database()
+        :return: int
+            Number of rows loaded
+        """
+        count = 0
+        for imp in self.imports:
+            count += imp.load_to_database(database, batch_size, is_create_table)
+
+        return count
+
     def get_table_names(self):
         names = []
         for imp in self.imports:
@@ -371,23 +1101,60 @@ class ExcelImport(object):
         return names
 
     def __all_sheets_to_imports(self):
-        for sheet in self.workbook.sheets():
-            self.imports.append(self.__sheet_to_import(sheet))
+        if not self.is_parallel:
+            for sheet in self.workbook.sheets():
+                self.imports.append(self.__sheet_to_import(sheet.name, ExcelImport._get_worksheet_rows(sheet)))
+            return
 
-    def __sheet_to_import(self, worksheet):
-        data = [
-            [worksheet.cell_value(r, col)
-             for col in range(worksheet.ncols)]
-            for r in range(worksheet.nrows)
-        ]
+        sheet_indexes = range(self.workbook.nsheets)
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            # map() returns results in the order of the sheets, no matter which finishes first
+            for name, data in executor.map(ExcelImport._read_worksheet,
+                                           [self.filename] * len(sheet_indexes),
+                                           sheet_indexes):
+                self.imports.append(self.__sheet_to_import(name, data))
+
+    @staticmethod
+    def _get_worksheet_rows(worksheet):
+        return [worksheet.row_values(r) for r in range(worksheet.nrows)]
+
+    @staticmethod
+    def _read_worksheet(filename: str, sheet_index: int):
+        """
+        Description:
+            Run in a worker process. Opens the workbook and reads the rows of a single worksheet
+        :return: (str, [])
+            Worksheet name and its rows
+        """
+        workbook = xlrd.open_workbook(filename, on_demand=True)
+        try:
+            worksheet = workbook.sheet_by_index(sheet_index)
+            return worksheet.name, ExcelImport._get_worksheet_rows(worksheet)
+        finally:
+            workbook.release_resources()
+
+    @staticmethod
+    def _write_output_file(data_import, output_name: str):
+        """
+        Description:
+            Run in a worker process. Writes the .sql file for a single worksheet
+        :return: str
+        """
+        data_import.write_output_file(output_name)
+        return output_name
 
-        table_name = '{0}_{1}'.format(self.base_table_name, worksheet.name)
+    def __sheet_to_import(self, sheet_name: str, data: []):
+        table_name = '{0}_{1}'.format(self.base_table_name, sheet_name)
 
         return DataImport(database_name=self.database_name,
                           schema_name=self.schema_name,
                           table_name=table_name,
                           column_names=data[0],
-                          rows=data[1:]
+                          rows=data[1:],
+                          rows_per_insert=self.rows_per_insert,
+                          max_batch_size=self.max_batch_size,
+                          is_infer_types=self.is_infer_types,
+                          type_inference_sample_size=self.type_inference_sample_size
                           )
 
     def __get_table_names(self):
@@ -1,10 +1,266 @@
+import csv
+import os
+
 from ConfigUtil import ConfigSingleton
 from DatabaseUtils.Database import MssqlDatabase
+from EtlUtils.EtlUtil import DataImport, SqlBuilder, ImportType
+from StringUtil import StringUtil
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+try:
+    import pyarrow
+    import pyarrow.csv
+except ImportError:
+    pyarrow = None
 
-import pandas
 
 class PandasEtlConfig(ConfigSingleton):
     db_server = 'localhost'
     db_name = 'EtlTesting'
     db_username = 'sa'
     db_password = ''
+
+
+class PandasImport(object):
+    """
+    Columnar version of EtlUtils.EtlUtil.CsvImport
+
+    Reads a CSV or Excel file with pandas (or pyarrow for CSV when it's installed) chunk by chunk
+    and coerces each column to its SQL type
+    Only CSV files are read a chunk at a time. pandas can't stream Excel, so a sheet is read whole
+    and then handed out in chunks
+    Has the same get_all_sql/write_output_file/load_to_database surface as CsvImport, so the two can be swapped
+    """
+
+    # Target of the block size pyarrow reads at a time. It batches by bytes, not rows
+    __pyarrow_bytes_per_row = 256
+
+    def __init__(self,
+                 filename: str,
+                 database_name: str,
+                 schema_name: str = '',
+                 table_name: str = '',
+                 chunk_size: int = 10000,
+                 column_types: dict = None,
+                 sheet_name=0,
+                 is_use_pyarrow: bool = True):
+        """
+        :param chunk_size: int
+            Number of rows read into a DataFrame at a time
+        :param column_types: dict
+            Column name to SQL type, e.g. {'Quantity': 'INT', 'OrderDate': 'DATETIME2'}
+            Columns not in here stay NVARCHAR(MAX)
+        :param sheet_name:
+            Worksheet to read for Excel files. Passed to pandas.read_excel
+        :param is_use_pyarrow: bool
+            Read CSV files with pyarrow when it's installed
+        """
+        if pandas is None:
+            raise ImportError('pandas is needed to import with PandasImport')
+
+        if not table_name or not table_name.strip():
+            table_name = os.path.basename(filename).split('.')[0]
+
+        self.filename = filename
+        self.database_name = database_name
+        self.schema_name = schema_name or ''
+        self.table_name = table_name
+        self.chunk_size = chunk_size if chunk_size and chunk_size > 0 else 10000
+        self.column_types = column_types or {}
+        self.sheet_name = sheet_name
+        self.is_use_pyarrow = is_use_pyarrow and pyarrow is not None
+        self.import_type = PandasImport.get_import_type(filename)
+
+        self.column_names = self.__get_column_names()
+        self.data_import = DataImport(database_name=self.database_name,
+                                      schema_name=self.schema_name,
+                                      table_name=self.table_name,
+                                      column_names=self.column_names,
+                                      rows=self.__iter_sql_rows,
+                                      batch_size=self.chunk_size,
+                                      column_types=self.get_sql_types())
+
+    @staticmethod
+    def get_import_type(filename: str):
+        file_extension = StringUtil.getFileExtension(filename).strip().lower()
+
+        if file_extension in ['xls', 'xlsx']:
+            return ImportType.EXCEL
+        if file_extension == 'csv':
+            return ImportType.CSV
+
+        raise ValueError('Unable to import file type: {}'.format(file_extension))
+
+    def get_sql_types(self):
+        """
+        SQL type for each column, in order. NVARCHAR(MAX) for columns not in column_types
+
+        :return:
+        :rtype: []
+        """
+        return [self.column_types.get(col, 'NVARCHAR(MAX)') for col in self.column_names]
+
+    def get_all_sql(self):
+        return self.data_import.generate_all_sql()
+
+    def iter_all_sql(self):
+        return self.data_import.iter_all_sql()
+
+    def get_sql_insert_stmts_list(self):
+        return self.data_import.generate_sql_insert_stmts_list()
+
+    def iter_sql_insert_stmts(self):
+        return self.data_import.iter_sql_insert_stmts()
+
+    def get_sql_create_table_stmt(self):
+        return self.data_import.generate_sql_create_table_stmt()
+
+    def write_output_file(self, output_name: str = None):
+        self.data_import.write_output_file(output_name)
+
+    def load_to_database(self, database: MssqlDatabase, batch_size: int = None, is_create_table: bool = False):
+        """
+        Insert the coerced values straight into the database with parameterized executemany()
+
+        :param database: MssqlDatabase or Sqlite3Database (anything with execute_many())
+        :type database:
+        :param batch_size: rows sent and committed at a time. Defaults to chunk_size
+        :type batch_size: int
+        :param is_create_table: run the CREATE TABLE statement first (SQL Server only)
+        :type is_create_table: bool
+        :return: number of rows loaded
+        :rtype: int
+        """
+        if not database:
+            raise ValueError('Need a database to load into')
+
+        if is_create_table:
+            for sql in self.get_sql_create_table_stmt().split('\nGO\n'):
+                if sql.strip():
+                    database.execute_sql(sql)
+
+        sql = SqlBuilder.create_parameterized_insert_statement(tableName=self.table_name,
+                                                               database_name=self.database_name,
+                                                               colNames=self.column_names,
+                                                               schema_name=self.schema_name)
+
+        return database.execute_many(sql, self.__iter_parameter_rows(), batch_size or self.chunk_size)
+
+    def iter_chunks(self):
+        """
+        Yields DataFrames of the file, coerced to column_types
+        Everything is read as text first, so values aren't guessed by pandas
+        Excel sheets are read whole first, then split into chunks
+
+        :return:
+        :rtype: generator
+        """
+        if self.import_type == ImportType.EXCEL:
+            frame = pandas.read_excel(self.filename, sheet_name=self.sheet_name, dtype=str, keep_default_na=False)
+            for start in range(0, len(frame), self.chunk_size):
+                yield self.__coerce(frame.iloc[start:start + self.chunk_size])
+        elif self.is_use_pyarrow:
+            for frame in self.__iter_pyarrow_csv_chunks():
+                yield self.__coerce(frame)
+        else:
+            for frame in pandas.read_csv(self.filename,
+                                         dtype=str,
+                                         keep_default_na=False,
+                                         encoding='latin-1',
+                                         chunksize=self.chunk_size):
+                yield self.__coerce(frame)
+
+    def __iter_pyarrow_csv_chunks(self):
+        read_options = pyarrow.csv.ReadOptions(encoding='latin-1',
+                                               block_size=self.chunk_size * self.__pyarrow_bytes_per_row)
+        convert_options = pyarrow.csv.ConvertOptions(column_types={col: pyarrow.string()
+                                                                   for col in self.column_names},
+                                                     strings_can_be_null=False)
+
+        reader = pyarrow.csv.open_csv(self.filename, read_options=read_options, convert_options=convert_options)
+        for batch in reader:
+            yield batch.to_pandas()
+
+    def __get_column_names(self):
+        if self.import_type == ImportType.EXCEL:
+            return [str(x) for x in pandas.read_excel(self.filename, sheet_name=self.sheet_name, nrows=0).columns]
+
+        with open(self.filename, 'r', encoding='latin-1') as f:
+            return next(csv.reader(f))
+
+    def __coerce(self, frame):
+        """
+        Convert each column in column_types to its pandas type
+        Values that can't be converted, and empty strings, become nulls
+
+        Integers become Python ints, parsed from the text so big values stay exact. DECIMAL, NUMERIC and MONEY
+        values stay text (checked to be numbers), so the database converts them without going through a float
+        """
+        frame = frame.copy()
+
+        for col in frame.columns:
+            values = frame[col].where(frame[col].astype(str).str.strip() != '', None)
+            sql_type = self.column_types.get(col, '').strip().upper().split('(')[0]
+
+            if sql_type in ('INT', 'BIGINT', 'SMALLINT', 'TINYINT'):
+                values = PandasImport.__match(values, SqlBuilder.INT_VALUE_REGEX)
+                # Built as object, since map() would infer float64 for ints and None
+                values = pandas.Series([None if pandas.isna(x) else int(x) for x in values],
+                                       index=values.index,
+                                       dtype=object)
+            elif sql_type in ('DECIMAL', 'NUMERIC', 'MONEY'):
+                values = PandasImport.__match(values, SqlBuilder.DECIMAL_VALUE_REGEX)
+            elif sql_type in ('FLOAT', 'REAL'):
+                values = pandas.to_numeric(values, errors='coerce')
+            elif sql_type in ('DATE', 'DATETIME', 'DATETIME2', 'SMALLDATETIME'):
+                values = pandas.to_datetime(values, errors='coerce')
+            elif sql_type == 'BIT':
+                values = values.map(lambda x: None if x is None else StringUtil.get_boolean_from_string(x))
+
+            frame[col] = values
+
+        return frame
+
+    @staticmethod
+    def __match(values, regex: str):
+        """
+        Stripped values that match regex. Everything else becomes None
+        """
+        stripped = values.astype(object).where(values.notna(), '').astype(str).str.strip()
+        return stripped.where(stripped.str.match(regex), None).astype(object)
+
+    @staticmethod
+    def __to_python_value(val):
+        """
+        pyodbc and sqlite3 only take Python types, not numpy/pandas scalars
+        """
+        if val is None or pandas.isna(val):
+            return None
+        if isinstance(val, pandas.Timestamp):
+            return val.to_pydatetime()
+        if hasattr(val, 'item'):
+            return val.item()
+        return val
+
+    @staticmethod
+    def __to_sql_text(val):
+        val = PandasImport.__to_python_value(val)
+        if val is None:
+            return ''
+        if type(val) == bool:
+            return '1' if val else '0'
+        return str(val)
+
+    def __iter_parameter_rows(self):
+        for frame in self.iter_chunks():
+            for row in frame.astype(object).itertuples(index=False, name=None):
+                yield [PandasImport.__to_python_value(val) for val in row]
+
+    def __iter_sql_rows(self):
+        for frame in self.iter_chunks():
+            for row in frame.astype(object).itertuples(index=False, name=None):
+                yield [PandasImport.__to_sql_text(val) for val in row]